@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AgentService.settings')
 
 application = get_asgi_application()
+
+# 工作进程启动时开始探测模型服务，第一个请求不必承担 DNS 解析与 TLS 握手的延迟
+from engines.health import start_prober  # noqa: E402
+
+start_prober()
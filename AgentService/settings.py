@@ -32,6 +32,21 @@ ALLOWED_HOSTS = ['localhost',
 BASE_URL = 'https://users.pulseheath.com/'
 TOKEN_COOKIE_NAME = 'joker'
 
+# 本地校验 JWT：配置了公钥或 JWKS 文件后，签名令牌直接在本地校验，不再请求用户服务
+# 未配置或令牌不是 JWT（如不透明令牌）时仍调用用户服务的 /users/api/users/me/
+AUTH_JWT_PUBLIC_KEY = os.environ.get('AUTH_JWT_PUBLIC_KEY')  # PEM 格式公钥
+AUTH_JWT_PUBLIC_KEY_FILE = os.environ.get('AUTH_JWT_PUBLIC_KEY_FILE')
+AUTH_JWT_JWKS_FILE = os.environ.get('AUTH_JWT_JWKS_FILE')
+AUTH_JWT_ALGORITHMS = ['RS256', 'ES256', 'EdDSA']
+AUTH_JWT_AUDIENCE = os.environ.get('AUTH_JWT_AUDIENCE')
+AUTH_JWT_ISSUER = os.environ.get('AUTH_JWT_ISSUER')
+AUTH_JWT_LEEWAY = 30  # 允许的时钟偏差（秒）
+# remote_user 字段 -> JWT 声明名称
+AUTH_JWT_CLAIMS = {
+    'id': 'user_id',
+    'is_premium': 'is_premium',
+}
+
 
 # Application definition
 
@@ -51,7 +66,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'middleware.deadline.DeadlineMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'middleware.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,14 +76,118 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'middleware.auth.TokenAuthMiddleware'
+    'middleware.auth.TokenAuthMiddleware',
+    'middleware.admission.AdmissionControlMiddleware',
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [],
     'DEFAULT_PERMISSION_CLASSES': [],
+    'DEFAULT_RENDERER_CLASSES': [
+        'utils.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'utils.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# 响应压缩：小于该字节数的响应不压缩
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+RESPONSE_COMPRESSION_BROTLI_QUALITY = 5
+
+# 准入控制：限制调用大模型的接口在单个进程内的并发，过载时返回 503 + Retry-After
+ADMISSION_CONTROL_PATHS = ['/api/agent/chat/']
+ADMISSION_MAX_IN_FLIGHT = 32
+ADMISSION_QUEUE_WEIGHTS = {'premium': 4, 'free': 1}  # 有空位时两个队列的出队比例
+ADMISSION_MAX_QUEUED = {'premium': 64, 'free': 16}
+ADMISSION_QUEUE_TIMEOUT = {'premium': 10, 'free': 3}  # 排队最长等待秒数
+ADMISSION_PER_USER_LIMIT = {'premium': 4, 'free': 2}  # 单个用户的并发上限（含排队），超出返回 429
+
+# 请求截止时间（秒）：客户端可通过请求头 X-Request-Timeout 指定，不超过 REQUEST_DEADLINE_MAX
+# 认证、准入排队和模型调用都以剩余时间为上限，超时返回 504；助手设置了 request_timeout 时进一步缩短
+REQUEST_DEADLINE_DEFAULT = 60
+REQUEST_DEADLINE_MAX = 300
+
+# 幂等请求：聊天请求带有 Idempotency-Key 头时，同一用户相同键的请求只执行一次，成功的响应保存 IDEMPOTENCY_TTL 秒
+# 记录保存在 IDEMPOTENCY_CACHE_ALIAS 指向的缓存中，该缓存为 django-redis 时多进程之间合并，否则只在进程内合并
+IDEMPOTENCY_CACHE_ALIAS = 'default'
+IDEMPOTENCY_TTL = 300
+IDEMPOTENCY_LOCK_TTL = REQUEST_DEADLINE_MAX + 30  # 执行中的占位的有效期，应大于请求的最长执行时间
+IDEMPOTENCY_WAIT_TIMEOUT = 60  # 相同请求等待执行结果的最长时间，超时返回 409
+
+# 模型健康探测：后台线程定期请求各模型服务的 /models，保持连接池中的连接，记录延迟与错误率
+# 状态见 /api/engines/health/（需要认证），就绪检查为 /api/engines/ready/（不需要认证，只返回是否就绪）
+ENGINE_HEALTH_PROBE = False
+ENGINE_PROBE_INTERVAL = 30  # 探测间隔（秒），应小于 ENGINE_HTTP_KEEPALIVE_EXPIRY，连接才不会被回收
+ENGINE_PROBE_TIMEOUT = 5
+ENGINE_UNHEALTHY_AFTER = 3  # 连续失败次数达到该值时视为不健康
+# 同一服务地址的模型客户端共用的连接池
+ENGINE_HTTP_MAX_CONNECTIONS = 100
+ENGINE_HTTP_MAX_KEEPALIVE = 20
+ENGINE_HTTP_KEEPALIVE_EXPIRY = 120
+# 按延迟路由：助手设置了多个可用模型时，使用其中当前延迟最低的健康模型，而不是请求指定的模型
+ENGINE_ROUTING = False
+
+# 缓存失效广播：Assistant / Engines / AssistantTemplates / 公共 AssistantsConfigs 修改后通知所有工作进程移除对应的进程内缓存
+# local 只在本进程内生效；file 通过共享文件在同一台机器的多个进程间广播；redis 使用 django-redis 的发布/订阅，多节点部署使用
+INVALIDATION_TRANSPORT = 'local'
+INVALIDATION_FILE = BASE_DIR / 'invalidation.log'
+INVALIDATION_FILE_MAX_BYTES = 10 * 1024 * 1024  # 超过该大小时轮转为 invalidation.log.1，各进程随后清空一次全部缓存
+INVALIDATION_REDIS_ALIAS = 'default'
+INVALIDATION_CHANNEL = 'agent:invalidation'
+# 进程内缓存的模型与助手配置的最长有效期（秒），兜底不发出信号的修改（如 queryset.update）
+REGISTRY_TTL = 3600
+# 进程内缓存的公共助手配置的最长有效期（秒），同上作为失效广播的兜底
+PUBLIC_CONFIGS_TTL = 300
+
+# 滑动窗口限流：scope -> 各等级的限额（格式与 DRF 相同，如 '60/min'），None 表示不限制
+# 计数保存在 THROTTLE_CACHE_ALIAS 指向的缓存中，该缓存为 django-redis 时多进程共享，否则为进程内计数
+THROTTLE_CACHE_ALIAS = 'default'
+THROTTLE_TIER_RATES = {
+    'user': {'premium': '120/min', 'free': '30/min'},
+    'assistant': {'premium': '60/min', 'free': '15/min'},
+}
+
+# 对话记忆保存在进程内，超过该用户数时淘汰最久未活跃用户的记忆
+AGENT_MEMORY_MAX_USERS = 10000
+# 将对话记忆同时写入数据库（agent.Conversation），多进程部署时共享，写入使用版本号做比较并交换
+AGENT_MEMORY_PERSIST = False
+AGENT_MEMORY_MAX_TURNS = 10  # 提示词中带入的最近对话轮数
+# 后台压缩（manage.py compact_conversations）：超出窗口的对话由便宜的模型概括为滚动摘要，请求路径只读取摘要
+# 开启后超出窗口的记录最多再保留 AGENT_MEMORY_COMPACTION_BACKLOG 条等待压缩；需要同时开启 AGENT_MEMORY_PERSIST
+AGENT_MEMORY_COMPACTION = False
+AGENT_MEMORY_COMPACTION_BACKLOG = 40
+AGENT_SUMMARY_ENGINE = 'qwen-turbo'
+AGENT_SUMMARY_MAX_CHARS = 500
+
+# 长期记忆：对话向量化后保存在每个会话自己的本地索引中，每轮只取回最相关的几条加入提示词
+AGENT_LONG_TERM_MEMORY = False
+AGENT_LONG_TERM_MEMORY_DIR = os.path.join(BASE_DIR, 'memory')
+AGENT_LONG_TERM_MEMORY_DIM = 256
+AGENT_LONG_TERM_MEMORY_TOP_K = 4
+AGENT_LONG_TERM_MEMORY_MIN_SCORE = 0.2  # 相似度低于该值的记录不加入提示词
+
+# emotion 接口的本地快速分类（词典 + 规则），置信度达到阈值时直接返回 {"emotion": 标签, "confidence": 置信度}
+# 标签为 happy/sad/angry/anxious/tired，返回前按 emotion 助手的输出结构（output_schema）校验，未设置输出结构或校验不通过时调用大模型
+AGENT_EMOTION_FAST_PATH = False
+AGENT_EMOTION_THRESHOLD = 0.7
+AGENT_EMOTION_MAX_CHARS = 80  # 超过该长度的文本直接交给大模型
+AGENT_EMOTION_LEXICON_FILE = None  # 自定义词典（JSON，格式同 agent.emotion.LEXICON）
+
+# 模型请求的默认超时（秒），模型（Engines）未设置 request_timeout 时使用
+ENGINE_DEFAULT_REQUEST_TIMEOUT = 60
+
+# 记账助手的规则提取：金额、货币单位与分类关键词可以可靠识别时直接返回，不调用大模型
+AGENT_BOOKKEEPING_FAST_PATH = False
+AGENT_BOOKKEEPING_ASSISTANTS = ['financial_analyst']
+AGENT_BOOKKEEPING_THRESHOLD = 0.8  # 任意一笔交易的置信度低于该值时交给大模型
+# 以上两种快速路径只在结果与调用大模型等价时使用：助手未开启记忆（快速路径不写入记忆）、没有使用自定义模板、
+# 且输出语言在此列表中（规则输出的记账分类与备注为中文），否则调用大模型
+AGENT_FAST_PATH_LANGUAGES = ['zh', 'zh-cn', 'zh-hans', 'chinese', '中文']
+
 ROOT_URLCONF = 'AgentService.urls'
 
 TEMPLATES = [
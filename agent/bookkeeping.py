@@ -0,0 +1,190 @@
+import re
+import threading
+
+from django.conf import settings
+
+# 分类关键词，与记账助手提示词中的分类一致；同一段文本命中多个分类时交给大模型
+EXPENSE_CATEGORIES = {
+    '餐饮': ['早餐', '早饭', '午餐', '午饭', '晚餐', '晚饭', '夜宵', '宵夜', '吃饭', '外卖', '饭', '咖啡', '奶茶', '火锅',
+           '烧烤', '食堂', '面条', '拉面', '米线', '饺子', '包子', '麦当劳', '肯德基', '星巴克', '瑞幸', '吃', '喝酒'],
+    '交通': ['打车', '出租车', '滴滴', '地铁', '公交', '高铁', '火车票', '机票', '加油', '油费', '停车', '过路费', '共享单车'],
+    '服装': ['衣服', '裤子', '鞋', '外套', 't恤', '裙子', '帽子', '袜子'],
+    '蔬菜': ['蔬菜', '青菜', '白菜', '土豆', '西红柿', '番茄', '黄瓜', '买菜'],
+    '零食': ['零食', '薯片', '饼干', '巧克力', '辣条', '坚果'],
+    '杂货': ['杂货', '日用品', '纸巾', '洗衣液', '牙膏', '洗发水'],
+    '购物': ['购物', '淘宝', '京东', '拼多多', '网购', '超市'],
+    '水果': ['水果', '苹果', '香蕉', '西瓜', '橙子', '葡萄', '草莓', '芒果', '榴莲'],
+    '运动': ['健身', '游泳', '瑜伽', '跑步', '打球', '篮球', '羽毛球', '足球', '网球', '私教'],
+    '通讯': ['话费', '流量', '宽带', '手机费'],
+    '学习': ['书', '课程', '培训', '学费', '教材', '报名费', '网课'],
+    '美容': ['理发', '剪头发', '美甲', '化妆品', '护肤', '面膜', '美容', '口红'],
+    '宠物': ['猫粮', '狗粮', '宠物', '猫砂', '兽医'],
+    '娱乐': ['电影', '游戏', 'ktv', '唱歌', '演唱会', '会员', '酒吧'],
+    '数码': ['手机', '电脑', '耳机', '键盘', '鼠标', '平板', '相机', '充电器', '数据线', '苹果手机', 'iphone', 'ipad'],
+    '礼物': ['礼物', '送礼', '礼品'],
+    '旅行': ['旅游', '旅行', '酒店', '民宿', '景区'],
+    '家居': ['家具', '房租', '水电', '电费', '水费', '燃气', '物业', '床垫', '沙发', '装修', '家居'],
+}
+INCOME_CATEGORIES = {
+    '工资': ['工资', '薪水', '发薪', '月薪'],
+    '兼职': ['兼职', '外快', '稿费'],
+    '投资': ['理财', '股票', '基金', '利息', '分红', '收益'],
+}
+INCOME_WORDS = ('收到', '进账', '赚', '收入', '发了', '到账', '奖金')
+EXPENSE_WORDS = ('花', '买', '付', '支付', '交了', '充值', '消费', '订了', '租', '请客', '吃', '打车')
+# 出现这些词时规则无法可靠判断（否定、提问、借还、退款、外币、分摊等），交给大模型
+AMBIGUOUS = re.compile(
+    r'没|不|吗|么|多少|几|[?？]|借|还钱|还款|退|美元|美金|刀|日元|欧元|港币|usd|\$|aa|平摊|一共|总共|比|预算|打算|准备|要'
+)
+
+CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+CN_UNITS = {'十': 10, '百': 100, '千': 1000, '万': 10000}
+CN_NUMBER = '[零〇一二两三四五六七八九十百千万]+'
+
+# 金额：阿拉伯数字后可跟 k/w/千/万 与货币单位；中文数字必须带货币单位（避免“一下”“三明治”之类）
+# “两块五”“3块5毛”中货币单位后的一位数字为角
+AMOUNT = re.compile(
+    r'(?<![\d.:：])(?P<num>\d+(?:\.\d+)?)\s*(?P<scale>[kw千万])?\s*(?P<unit>块钱|块|元|圆|rmb|人民币)?'
+    r'(?:(?P<jiao>\d)(?:毛|角)?)?'
+    r'|(?P<cn>' + CN_NUMBER + r')(?P<cn_unit>块钱|块|元|毛|角)(?:(?P<cn_jiao>[一二两三四五六七八九])(?:毛|角)?)?'
+)
+# 数字后跟这些字时是数量、日期或时间，不是金额
+NOT_AMOUNT_SUFFIX = re.compile(
+    r'\s*(?:个|点|号|日|月|年|岁|斤|公斤|克|次|杯|件|天|小时|分钟|分|公里|km|楼|人|%|:|：|折|倍|瓶|张|本|只|份|碗|盒|袋|箱|双|台)'
+)
+CLAUSE_SEPARATOR = re.compile(r'[，,。；;！!\n]+')
+
+
+def parse_chinese_number(text):
+    """中文数字转为整数，支持“一百五”“两万三”这类口语省略的写法"""
+    total, section, number, last_unit = 0, 0, 0, 1
+    for char in text:
+        if char in CN_DIGITS:
+            number = CN_DIGITS[char]
+        elif char == '万':
+            total += (section + number) * 10000
+            section, number, last_unit = 0, 0, 10000
+        else:
+            unit = CN_UNITS[char]
+            section += (number or 1) * unit
+            number, last_unit = 0, unit
+    if number and last_unit >= 100 and text[-1] in CN_DIGITS and text[-2:-1] in ('百', '千', '万'):
+        # “一百五” = 150，“两万三” = 23000
+        number *= last_unit // 10
+    return total + section + number
+
+
+class BookkeepingExtractor:
+    """
+    基于规则的记账信息提取，输出与记账助手相同的结构：
+    {"transactions": [{"type", "amount", "category", "note", "confidence"}]}
+    - 按标点切分为短句，每个短句最多一笔金额；没有金额的短句作为下一笔交易的上下文（如“今天吃早餐，花了20”）
+    - 收支类型由收入词/支出词/分类关键词判断，分类取关键词命中的唯一分类
+    - 出现否定、提问、外币、借还款等规则无法可靠处理的表达，或任何一笔置信度不足时返回 None，由调用方交给大模型
+    """
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        self.keywords = {}
+        for kind, categories in (('expense', EXPENSE_CATEGORIES), ('income', INCOME_CATEGORIES)):
+            for category, words in categories.items():
+                for word in words:
+                    self.keywords[word] = (kind, category)
+        self.keyword_pattern = re.compile('|'.join(map(re.escape, sorted(self.keywords, key=len, reverse=True))))
+
+    def find_amounts(self, clause):
+        amounts = []
+        for match in AMOUNT.finditer(clause):
+            if match.group('num'):
+                if match.group('unit') is None and NOT_AMOUNT_SUFFIX.match(clause, match.end()):
+                    continue
+                if clause[max(0, match.start() - 1):match.start()] == '第':
+                    continue
+                amount = float(match.group('num'))
+                scale = match.group('scale')
+                if scale:
+                    amount *= 10000 if scale in ('w', '万') else 1000
+                jiao = match.group('jiao') if match.group('unit') else None
+            else:
+                amount = float(parse_chinese_number(match.group('cn')))
+                if match.group('cn_unit') in ('毛', '角'):
+                    amount /= 10
+                jiao = CN_DIGITS[match.group('cn_jiao')] if match.group('cn_jiao') else None
+            if jiao is not None:
+                amount += int(jiao) / 10
+            amounts.append(round(amount, 2))
+        return amounts
+
+    def build_transaction(self, context, clause, amount):
+        text = context + clause
+        keywords = self.keyword_pattern.findall(text)
+        categories = {self.keywords[word] for word in keywords}
+        is_income = any(word in text for word in INCOME_WORDS) or any(kind == 'income' for kind, _ in categories)
+        is_expense = any(word in text for word in EXPENSE_WORDS) or any(kind == 'expense' for kind, _ in categories)
+
+        if is_income == is_expense:
+            # 既像收入又像支出，或者完全没有线索
+            kind, category, confidence = 'expense', '其他', 0.3
+        else:
+            kind = 'income' if is_income else 'expense'
+            matched = {category for category_kind, category in categories if category_kind == kind}
+            if len(matched) == 1:
+                category, confidence = matched.pop(), 0.95
+            elif not matched:
+                category, confidence = '其他', 0.6
+            else:
+                category, confidence = '其他', 0.4
+        words = list(dict.fromkeys(word for word in keywords if self.keywords[word][1] == category))
+        # 备注优先使用具体的名词（“早餐”而不是“吃”）
+        note = '、'.join([word for word in words if len(word) > 1] or words) or clause
+        return {'type': kind, 'amount': amount, 'category': category, 'note': note, 'confidence': confidence}
+
+    def extract(self, text):
+        """返回记账结果，无法可靠提取时返回 None"""
+        text = (text or '').strip().lower()
+        if not text or AMBIGUOUS.search(text):
+            return None
+        transactions = []
+        context = ''
+        for clause in CLAUSE_SEPARATOR.split(text):
+            amounts = self.find_amounts(clause)
+            if not amounts:
+                context += clause
+                continue
+            if len(amounts) > 1:
+                return None
+            transactions.append(self.build_transaction(context, clause, amounts[0]))
+            context = ''
+        if not transactions:
+            return None
+        if context and transactions[-1]['category'] == '其他':
+            # 金额在前、说明在后，如“花了20，吃早餐”
+            last = transactions.pop()
+            transactions.append(self.build_transaction('', context, last['amount']))
+        if any(transaction['confidence'] < self.threshold for transaction in transactions):
+            return None
+        return {'transactions': transactions}
+
+    def extract_batch(self, texts):
+        """批量提取，重复的文本只处理一次"""
+        results = {}
+        return [results[text] if text in results else results.setdefault(text, self.extract(text)) for text in texts]
+
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_bookkeeping_extractor():
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = BookkeepingExtractor(getattr(settings, 'AGENT_BOOKKEEPING_THRESHOLD', 0.8))
+    return _extractor
+
+
+def is_bookkeeping_assistant(assistant_name):
+    """开启 AGENT_BOOKKEEPING_FAST_PATH 且助手在 AGENT_BOOKKEEPING_ASSISTANTS 中时使用规则提取"""
+    return (getattr(settings, 'AGENT_BOOKKEEPING_FAST_PATH', False)
+            and assistant_name in getattr(settings, 'AGENT_BOOKKEEPING_ASSISTANTS', ()))
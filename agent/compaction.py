@@ -0,0 +1,96 @@
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+from langchain.chat_models import ChatOpenAI
+
+from engines.health import chat_completions_client
+from engines.models import Engines
+from . import metrics
+from .history import ROLE_HUMAN, CompactChatMessageHistory
+from .models import Conversation
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "下面是用户与助手之间较早的对话，以及此前已有的摘要。\n"
+    "请将两者合并为一段新的摘要，保留用户提到的事实、偏好、情绪变化和尚未完成的事项，省略寒暄，"
+    "不超过 {max_chars} 字，只输出摘要本身。\n\n"
+    "已有摘要：\n{summary}\n\n"
+    "对话：\n{transcript}"
+)
+
+
+def build_summary_llm(engine_name=None):
+    """压缩使用的模型，默认取 AGENT_SUMMARY_ENGINE，应选择便宜、快速的引擎"""
+    engine_name = engine_name or getattr(settings, 'AGENT_SUMMARY_ENGINE', 'qwen-turbo')
+    engine = Engines.objects.filter(name=engine_name, is_active=True).first()
+    if engine is None:
+        raise ValueError(f"Model {engine_name} not found.")
+    options = engine.client_options()
+    options['temperature'] = 0
+    return ChatOpenAI(
+        openai_api_key=engine.api_key,
+        model_name=engine.name,
+        base_url=engine.base_url,
+        client=chat_completions_client(engine.base_url, engine.api_key,
+                                       options['request_timeout'], options['max_retries']),
+        **options
+    )
+
+
+def summarize(llm, summary, turns, max_chars):
+    transcript = "\n".join(
+        f"{'用户' if turn.role == ROLE_HUMAN else '助手'}: {turn.text}" for turn in turns
+    )
+    prompt = SUMMARY_PROMPT.format(max_chars=max_chars, summary=summary or '（无）', transcript=transcript)
+    result = llm.invoke(prompt)
+    # 聊天模型返回消息对象，补全模型返回字符串
+    return getattr(result, 'content', result).strip()
+
+
+def compact_conversation(conversation, llm, keep, max_chars, max_attempts=3):
+    """
+    将超出 keep 条的较早记录与已有摘要合并为新的摘要，写回共享存储
+    模型调用在事务与锁之外进行；写入时按 version 比较并交换，期间有新的对话写入时，
+    在最新的数据上移除已被概括的记录（按时间戳）后重试，不会丢失新增的对话
+    返回被概括的记录数，无需压缩或放弃时返回 0
+    """
+    history = CompactChatMessageHistory.loads(bytes(conversation.data))
+    aging = history.turns[:-keep] if keep else history.turns
+    if not aging:
+        return 0
+    # 以完整的一轮（用户输入 + 回复）为单位概括，避免把一轮对话拆到摘要和窗口两边
+    if len(aging) < len(history.turns) and aging[-1].role == ROLE_HUMAN:
+        aging = aging[:-1]
+        if not aging:
+            return 0
+
+    summary = summarize(llm, history.summary, aging, max_chars)
+    until_ts = aging[-1].ts
+    version, data = conversation.version, conversation.data
+    for _ in range(max_attempts):
+        latest = CompactChatMessageHistory.loads(bytes(data))
+        if latest.summary != history.summary:
+            # 其他压缩任务已经更新过摘要，本次结果作废
+            metrics.incr('compaction.skipped')
+            return 0
+        latest.compact(until_ts, summary)
+        updated = Conversation.objects.filter(pk=conversation.pk, version=version).update(
+            data=latest.dumps(), version=version + 1, message_count=len(latest), updated_at=timezone.now()
+        )
+        if updated:
+            metrics.incr('compaction.conversations')
+            metrics.incr('compaction.turns', len(aging))
+            return len(aging)
+        metrics.incr('compaction.conflicts')
+        version, data = Conversation.objects.filter(pk=conversation.pk).values_list('version', 'data').get()
+    logger.warning("会话 %s 压缩时连续 %s 次写入冲突，留待下次处理", conversation, max_attempts)
+    return 0
+
+
+def pending_conversations(keep, min_aging):
+    """超出窗口的记录达到 min_aging 条的会话，按最近更新排序"""
+    return (Conversation.objects.filter(message_count__gte=keep + min_aging)
+            .only('pk', 'user_id', 'namespace', 'data', 'version')
+            .order_by('-updated_at'))
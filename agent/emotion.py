@@ -0,0 +1,114 @@
+import json
+import re
+import threading
+
+from django.conf import settings
+
+# 情绪词典：标签 -> {词: 权重}，权重 2 为含义明确的强烈表达
+LEXICON = {
+    'happy': {
+        '开心': 1, '高兴': 1, '快乐': 1, '愉快': 1, '幸福': 2, '兴奋': 1, '激动': 1, '满意': 1, '欣慰': 1,
+        '太棒了': 2, '哈哈': 1, '美滋滋': 2, '爽': 1, '喜欢': 1, '期待': 1, '顺利': 1,
+        'happy': 1, 'glad': 1, 'excited': 1, 'great': 1, 'awesome': 2, 'amazing': 2, 'love': 1,
+        'wonderful': 2, 'delighted': 2, 'thrilled': 2,
+    },
+    'sad': {
+        '难过': 1, '伤心': 2, '悲伤': 2, '失落': 1, '沮丧': 1, '心碎': 2, '想哭': 2, '哭了': 2, '孤独': 1,
+        '寂寞': 1, '失望': 1, '郁闷': 1, '痛苦': 2, '遗憾': 1, '委屈': 1,
+        'sad': 1, 'unhappy': 1, 'depressed': 2, 'lonely': 1, 'heartbroken': 2, 'miserable': 2,
+        'disappointed': 1, 'upset': 1, 'crying': 2,
+    },
+    'angry': {
+        '生气': 1, '愤怒': 2, '气死': 2, '恼火': 1, '烦死': 2, '讨厌': 1, '受够了': 2, '火大': 2, '可恶': 1,
+        '无语': 1,
+        'angry': 1, 'furious': 2, 'annoyed': 1, 'mad': 1, 'hate': 1, 'pissed': 2, 'irritated': 1,
+    },
+    'anxious': {
+        '焦虑': 2, '紧张': 1, '担心': 1, '害怕': 1, '不安': 1, '恐惧': 2, '慌': 1, '压力': 1, '睡不着': 1,
+        '失眠': 1, '忐忑': 2,
+        'anxious': 2, 'nervous': 1, 'worried': 1, 'afraid': 1, 'scared': 1, 'stressed': 1, 'panic': 2,
+    },
+    'tired': {
+        '累': 1, '疲惫': 2, '疲倦': 2, '困': 1, '没精神': 1, '筋疲力尽': 2, '心累': 2,
+        'tired': 1, 'exhausted': 2, 'sleepy': 1, 'drained': 2, 'burned out': 2,
+    },
+}
+
+INTENSIFIERS = ('非常', '特别', '超级', '真的', '好', '很', '太', '超', '巨', 'so ', 'very ', 'really ', 'extremely ')
+NEGATION = re.compile(r"(?:不|没|没有|别|未|不太|并不)$|\b(?:not|no|never|hardly)\s+$|n't\s+$")
+CJK = re.compile(r'[\u2e80-\u9fff]')
+
+
+class EmotionClassifier:
+    """
+    本地情绪分类（词典 + 否定/程度词规则），在 CPU 上毫秒级完成，置信度不足时由调用方交给大模型
+    - 否定的情绪词（如“不开心”）不计入任何标签，只降低置信度
+    - 置信度 = 最高标签得分占比 × 证据强度（得分达到 2 即为满分），没有命中时为 0
+    - 只处理 max_chars 以内的短文本，长文本往往包含多种情绪，直接交给大模型
+    """
+
+    def __init__(self, lexicon=None, max_chars=80):
+        self.lexicon = lexicon or LEXICON
+        self.max_chars = max_chars
+        self.weights = {}
+        for label, words in self.lexicon.items():
+            for word, weight in words.items():
+                self.weights[word.lower()] = (label, weight)
+        words = sorted(self.weights, key=len, reverse=True)
+        # 中文词直接匹配子串，英文词要求单词边界
+        self.pattern = re.compile('|'.join(
+            re.escape(word) if CJK.search(word) else rf'\b{re.escape(word)}\b' for word in words
+        ))
+
+    def classify(self, text):
+        """返回 (标签, 置信度)，无法判断时标签为 None"""
+        text = (text or '').strip().lower()
+        if not text or len(text) > self.max_chars:
+            return None, 0.0
+        scores = {}
+        negated = 0.0
+        for match in self.pattern.finditer(text):
+            label, weight = self.weights[match.group()]
+            prefix = text[max(0, match.start() - 12):match.start()]
+            if NEGATION.search(prefix):
+                negated += weight
+                continue
+            if prefix.endswith(INTENSIFIERS):
+                weight *= 1.5
+            scores[label] = scores.get(label, 0) + weight
+        if not scores:
+            return None, 0.0
+        label, top = max(scores.items(), key=lambda item: item[1])
+        total = sum(scores.values()) + negated
+        return label, round(top / total * min(1.0, top / 2), 3)
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_emotion_classifier():
+    """每个进程加载一次；AGENT_EMOTION_LEXICON_FILE 指向 JSON 词典时使用该词典（格式同 LEXICON）"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                lexicon = None
+                path = getattr(settings, 'AGENT_EMOTION_LEXICON_FILE', None)
+                if path:
+                    with open(path, encoding='utf-8') as f:
+                        lexicon = json.load(f)
+                _classifier = EmotionClassifier(lexicon, getattr(settings, 'AGENT_EMOTION_MAX_CHARS', 80))
+    return _classifier
+
+
+def classify_locally(text):
+    """
+    开启 AGENT_EMOTION_FAST_PATH 且置信度达到 AGENT_EMOTION_THRESHOLD 时返回 (标签, 置信度)，否则返回 None
+    """
+    if not getattr(settings, 'AGENT_EMOTION_FAST_PATH', False):
+        return None
+    label, confidence = get_emotion_classifier().classify(text)
+    if label is None or confidence < getattr(settings, 'AGENT_EMOTION_THRESHOLD', 0.7):
+        return None
+    return label, confidence
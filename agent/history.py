@@ -0,0 +1,154 @@
+import struct
+import time
+import zlib
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+try:
+    import zstandard
+except ImportError:  # 已列入 requirements/base.txt，未安装时使用 zlib 压缩
+    zstandard = None
+
+ROLE_HUMAN = 0
+ROLE_AI = 1
+
+MESSAGE_CLASSES = {ROLE_HUMAN: HumanMessage, ROLE_AI: AIMessage}
+MESSAGE_ROLES = {'human': ROLE_HUMAN, 'ai': ROLE_AI}
+
+# 序列化格式：版本(B) + 轮数(I) + 摘要长度(I) + UTF-8 摘要，之后每轮为 角色(B) + token 数(I) + 时间戳(d) + 文本长度(I) + UTF-8 文本
+# 版本 1 没有摘要字段，读取时仍然兼容
+FORMAT_VERSION = 2
+HEADER_V1 = struct.Struct('<BI')
+HEADER = struct.Struct('<BII')
+TURN_HEADER = struct.Struct('<BIdI')
+
+# 压缩后数据的第一个字节表示压缩方式
+CODEC_NONE = b'\x00'
+CODEC_ZLIB = b'\x01'
+CODEC_ZSTD = b'\x02'
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符每个约 1 个 token，其余字符约 4 个一个 token"""
+    wide = sum(1 for char in text if ord(char) >= 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+class Turn:
+    """一条对话记录，使用 __slots__ 避免每条消息一个 __dict__"""
+    __slots__ = ('role', 'text', 'tokens', 'ts')
+
+    def __init__(self, role, text, tokens=None, ts=None):
+        self.role = role
+        self.text = text
+        self.tokens = estimate_tokens(text) if tokens is None else tokens
+        self.ts = time.time() if ts is None else ts
+
+    def to_message(self):
+        return MESSAGE_CLASSES[self.role](content=self.text)
+
+
+class CompactChatMessageHistory(BaseChatMessageHistory):
+    """
+    紧凑的对话历史
+    - 只保存 (角色, 文本, token 数, 时间戳)，LangChain 消息对象在读取 messages 时（即调用模型时）才构建
+    - summary 为后台压缩任务生成的滚动摘要，概括了已从 turns 中移除的较早对话
+    - pack/unpack 序列化为紧凑的二进制格式，可选压缩后写入共享存储
+    """
+
+    def __init__(self, turns=None, version=0, summary=''):
+        self.turns = list(turns or [])
+        self.version = version  # 与共享存储中 Conversation.version 对应，用于判断是否需要重新加载
+        self.summary = summary
+
+    @property
+    def messages(self):
+        return [turn.to_message() for turn in self.turns]
+
+    def add_message(self, message):
+        role = MESSAGE_ROLES.get(message.type)
+        if role is None:
+            raise ValueError(f"不支持的消息类型: {message.type}")
+        self.turns.append(Turn(role, message.content))
+
+    def window_messages(self, max_messages=None):
+        """摘要（如有）加上最近的 max_messages 条记录，max_messages 为空时返回全部记录"""
+        turns = self.turns[-max_messages:] if max_messages else self.turns
+        messages = [SystemMessage(content=f"此前对话的摘要：{self.summary}")] if self.summary else []
+        return messages + [turn.to_message() for turn in turns]
+
+    def clear(self):
+        self.turns = []
+        self.summary = ''
+
+    def trim(self, max_messages):
+        """只保留最近的 max_messages 条记录"""
+        if len(self.turns) > max_messages:
+            del self.turns[:len(self.turns) - max_messages]
+
+    def char_count(self):
+        return sum(len(turn.text) for turn in self.turns)
+
+    def token_count(self):
+        return sum(turn.tokens for turn in self.turns)
+
+    def __len__(self):
+        return len(self.turns)
+
+    def compact(self, until_ts, summary):
+        """移除时间戳不晚于 until_ts 的记录（已被摘要概括），并更新摘要"""
+        self.turns = [turn for turn in self.turns if turn.ts > until_ts]
+        self.summary = summary
+
+    def pack(self):
+        summary = self.summary.encode('utf-8')
+        parts = [HEADER.pack(FORMAT_VERSION, len(self.turns), len(summary)), summary]
+        for turn in self.turns:
+            text = turn.text.encode('utf-8')
+            parts.append(TURN_HEADER.pack(turn.role, turn.tokens, turn.ts, len(text)))
+            parts.append(text)
+        return b''.join(parts)
+
+    @classmethod
+    def unpack(cls, data):
+        version = data[0]
+        if version == 1:
+            _, count = HEADER_V1.unpack_from(data, 0)
+            offset, summary = HEADER_V1.size, ''
+        elif version == FORMAT_VERSION:
+            _, count, length = HEADER.unpack_from(data, 0)
+            offset = HEADER.size + length
+            summary = data[HEADER.size:offset].decode('utf-8')
+        else:
+            raise ValueError(f"不支持的对话历史格式版本: {version}")
+        turns = []
+        for _ in range(count):
+            role, tokens, ts, length = TURN_HEADER.unpack_from(data, offset)
+            offset += TURN_HEADER.size
+            text = data[offset:offset + length].decode('utf-8')
+            offset += length
+            turns.append(Turn(role, text, tokens, ts))
+        return cls(turns, summary=summary)
+
+    def dumps(self, compress=True, level=3):
+        """序列化并压缩，优先使用 zstd，未安装时使用 zlib"""
+        data = self.pack()
+        if not compress:
+            return CODEC_NONE + data
+        if zstandard is not None:
+            return CODEC_ZSTD + zstandard.ZstdCompressor(level=level).compress(data)
+        return CODEC_ZLIB + zlib.compress(data, level)
+
+    @classmethod
+    def loads(cls, blob):
+        codec, data = blob[:1], blob[1:]
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("数据使用 zstd 压缩，但未安装 zstandard")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif codec == CODEC_ZLIB:
+            data = zlib.decompress(data)
+        elif codec != CODEC_NONE:
+            raise ValueError("未知的压缩方式")
+        return cls.unpack(data)
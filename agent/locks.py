@@ -0,0 +1,79 @@
+import threading
+
+
+class FairLock:
+    """按到达顺序获得的互斥锁（排号锁），保证同一会话的请求按先后顺序执行"""
+    __slots__ = ('_condition', '_next_ticket', '_serving')
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._next_ticket = 0
+        self._serving = 0
+
+    def acquire(self):
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._condition.wait()
+
+    def release(self):
+        with self._condition:
+            self._serving += 1
+            self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class KeyedLock:
+    """
+    按键创建的锁：每个键一把 FairLock，按引用计数在最后一个持有者或等待者释放后移除
+    不同的键从不共用同一把锁，某个会话的长时间调用不会阻塞其他会话；空闲的键不占用内存
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}  # 键 -> [FairLock, 引用计数]
+
+    def get(self, *key):
+        return _KeyedLockContext(self, key)
+
+    def acquire(self, key):
+        with self.lock:
+            entry = self.locks.get(key)
+            if entry is None:
+                entry = self.locks[key] = [FairLock(), 0]
+            entry[1] += 1
+        entry[0].acquire()
+
+    def release(self, key):
+        with self.lock:
+            entry = self.locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[key]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.locks)
+
+
+class _KeyedLockContext:
+    __slots__ = ('keyed', 'key')
+
+    def __init__(self, keyed, key):
+        self.keyed = keyed
+        self.key = key
+
+    def __enter__(self):
+        self.keyed.acquire(self.key)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.keyed.release(self.key)
@@ -0,0 +1,314 @@
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只保证进程内的一致
+    fcntl = None
+
+from . import metrics
+from .history import ROLE_AI, ROLE_HUMAN
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[\u2e80-\u9fff\uf900-\ufaff]', re.IGNORECASE)
+
+
+class HashingEmbedder:
+    """
+    基于特征哈希的本地向量化，不依赖模型或网络
+    英文按单词、中日韩文字按单字和相邻两字切分，哈希到 dim 维并做 L2 归一化
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def features(self, text):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = list(tokens)
+        features.extend(a + b for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = zlib.crc32(feature.encode('utf-8'))
+                # 最高位决定符号，减小哈希冲突带来的偏差
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class VectorIndex:
+    """
+    单个会话的向量索引，向量保存在按需倍增的 numpy 数组中，检索为精确的内积 top-k
+    持久化为追加写入的两个文件：<path>.f32（原始向量）和 <path>.jsonl（文本与时间戳）
+    多个进程可以共用同一个会话的文件：
+    - 追加与清空在 <path>.lock 的排他锁（fcntl.flock）内进行，两个文件总是一起更新；读取时持有共享锁
+    - 检索前比较两个文件的大小与锁文件的修改时间，有变化时读入其他进程追加的记录；
+      锁文件中保存清空的次数，其他进程清空过时先丢弃内存中的记录
+    """
+
+    def __init__(self, dim, path=None):
+        self.dim = dim
+        self.path = path
+        self.lock = threading.Lock()
+        self.generation = 0  # 已知的清空次数
+        self.stamp = (None, None, None)  # 上次同步时 .jsonl、.f32 的大小与锁文件的修改时间
+        self._reset()
+
+    def __len__(self):
+        return self.size
+
+    def _reset(self):
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.size = 0
+        self.texts = []
+        self.timestamps = np.zeros(0, dtype=np.float64)
+        self.offsets = (0, 0)  # 已读入的 .jsonl 与 .f32 的字节数
+
+    def _reserve(self, capacity):
+        if capacity <= len(self.vectors):
+            return
+        capacity = max(capacity, len(self.vectors) * 2, 64)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        timestamps = np.zeros(capacity, dtype=np.float64)
+        timestamps[:self.size] = self.timestamps[:self.size]
+        self.vectors, self.timestamps = vectors, timestamps
+
+    def _add(self, vectors, texts, timestamps):
+        count = len(texts)
+        self._reserve(self.size + count)
+        self.vectors[self.size:self.size + count] = vectors
+        self.timestamps[self.size:self.size + count] = timestamps
+        self.texts.extend(texts)
+        self.size += count
+
+    def add(self, vectors, texts, timestamps, persist=True):
+        with self.lock:
+            if persist and self.path:
+                with self._file_lock(exclusive=True) as lock_file:
+                    # 先读入其他进程追加的记录，再从文件末尾追加
+                    self._sync(lock_file)
+                    self._append_to_disk(vectors, texts, timestamps)
+            self._add(vectors, texts, timestamps)
+
+    def search(self, query, k, before=None):
+        """
+        返回与 query 内积最大的 k 条 (得分, 文本)
+        before 不为空时只在时间戳早于它的记录中检索（排除仍在短期记忆中的对话）
+        """
+        with self.lock:
+            if not self.size:
+                return []
+            scores = self.vectors[:self.size] @ query
+            if before is not None:
+                scores = np.where(self.timestamps[:self.size] < before, scores, -np.inf)
+            k = min(k, self.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.texts[i]) for i in top if scores[i] > -np.inf]
+
+    def _file_stamp(self):
+        stamp = []
+        for suffix in ('.jsonl', '.f32', '.lock'):
+            try:
+                stat = os.stat(self.path + suffix)
+            except FileNotFoundError:
+                stamp.append(None)
+            else:
+                stamp.append(stat.st_mtime_ns if suffix == '.lock' else stat.st_size)
+        return tuple(stamp)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'a+', encoding='utf-8') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                f.seek(0)
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """文件有变化时读入其他进程追加的记录，未变化时只有三次 stat"""
+        if not self.path or self._file_stamp() == self.stamp:
+            return
+        with self.lock, self._file_lock(exclusive=False) as lock_file:
+            self._sync(lock_file)
+
+    def _sync(self, lock_file):
+        """从上次读到的位置读入新的记录，调用方持有 self.lock 与文件锁"""
+        stamp = self._file_stamp()
+        generation = int(lock_file.read() or 0)
+        if generation != self.generation:
+            self._reset()
+            self.generation = generation
+        if stamp[0] is not None and stamp[1] is not None:
+            jsonl_offset, f32_offset = self.offsets
+            with open(self.path + '.jsonl', 'rb') as f:
+                f.seek(jsonl_offset)
+                lines = f.read().split(b'\n')[:-1]  # 最后一段没有换行符，是中途失败时写了一半的行
+            with open(self.path + '.f32', 'rb') as f:
+                f.seek(f32_offset)
+                blob = f.read()
+            row_bytes = self.dim * 4
+            vectors = np.frombuffer(blob[:len(blob) // row_bytes * row_bytes], dtype=np.float32).reshape(-1, self.dim)
+            records = []
+            for line in lines[:len(vectors)]:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+            if records:
+                self._add(vectors[:len(records)], [record['text'] for record in records],
+                          [record['ts'] for record in records])
+                consumed = sum(len(line) + 1 for line in lines[:len(records)])
+                self.offsets = (jsonl_offset + consumed, f32_offset + len(records) * row_bytes)
+        self.stamp = stamp
+
+    def _append_to_disk(self, vectors, texts, timestamps):
+        # 在排他锁内：先截掉中途失败留下的不完整记录，使两个文件保持对齐，再追加
+        for suffix, offset in zip(('.jsonl', '.f32'), self.offsets):
+            if os.path.exists(self.path + suffix) and os.path.getsize(self.path + suffix) > offset:
+                os.truncate(self.path + suffix, offset)
+        with open(self.path + '.jsonl', 'ab') as f:
+            for text, ts in zip(texts, timestamps):
+                f.write((json.dumps({'text': text, 'ts': float(ts)}, ensure_ascii=False) + '\n').encode('utf-8'))
+            jsonl_offset = f.tell()
+        with open(self.path + '.f32', 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f32_offset = f.tell()
+        self.offsets = (jsonl_offset, f32_offset)
+        self.stamp = self._file_stamp()
+
+    def clear(self):
+        """删除全部记录，其他进程在下一次检索前发现清空次数变化后丢弃各自内存中的记录"""
+        with self.lock:
+            if self.path:
+                with self._file_lock(exclusive=True) as lock_file:
+                    self.generation = int(lock_file.read() or 0) + 1
+                    lock_file.seek(0)
+                    lock_file.truncate()
+                    lock_file.write(str(self.generation))
+                    lock_file.flush()
+                    for suffix in ('.jsonl', '.f32'):
+                        if os.path.exists(self.path + suffix):
+                            os.remove(self.path + suffix)
+                self.stamp = self._file_stamp()
+            self._reset()
+
+    @classmethod
+    def load(cls, dim, path):
+        index = cls(dim, path)
+        index.refresh()
+        return index
+
+
+def format_snippet(human, ai):
+    return f"用户: {human.text}\n助手: {ai.text}"
+
+
+class LongTermMemory:
+    """
+    长期记忆：把对话按轮（用户输入 + 助手回复）向量化后存入每个会话自己的索引，调用时只取回最相关的 top_k 条
+    短期记忆的窗口大小不变，提示词长度保持稳定
+    索引在进程内按 LRU 缓存，超过 max_indexes 时淘汰最久未使用的（已持久化到磁盘，下次使用时重新加载）
+    """
+
+    def __init__(self, directory, dim=256, top_k=4, min_score=0.2, max_indexes=1000):
+        self.directory = directory
+        self.embedder = HashingEmbedder(dim)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_indexes = max_indexes
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()
+
+    def index_path(self, user_id, namespace):
+        return os.path.join(self.directory, *(re.sub(r'[^\w.-]', '_', str(part)) for part in (user_id, namespace)))
+
+    def get_index(self, user_id, namespace):
+        key = (user_id, namespace)
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None:
+                self.indexes.move_to_end(key)
+                return index
+        index = VectorIndex.load(self.embedder.dim, self.index_path(user_id, namespace))
+        with self.lock:
+            index = self.indexes.setdefault(key, index)
+            while len(self.indexes) > self.max_indexes:
+                self.indexes.popitem(last=False)
+        return index
+
+    def remember(self, user_id, namespace, turns):
+        """保存新增的对话，turns 为按顺序排列的 Turn，每一对 用户输入 + 助手回复 作为一条记录"""
+        pairs = [(human, ai) for human, ai in zip(turns[0::2], turns[1::2])
+                 if human.role == ROLE_HUMAN and ai.role == ROLE_AI]
+        if not pairs:
+            return
+        texts = [format_snippet(human, ai) for human, ai in pairs]
+        self.get_index(user_id, namespace).add(
+            self.embedder.embed(texts), texts, [human.ts for human, _ in pairs]
+        )
+
+    def recall(self, user_id, namespace, query, before=None):
+        """取回与 query 最相关的记录，before 为短期记忆中最早一条的时间戳"""
+        index = self.get_index(user_id, namespace)
+        index.refresh()
+        if not len(index):
+            return []
+        started = time.perf_counter()
+        results = index.search(self.embedder.embed([query])[0], self.top_k, before)
+        metrics.incr('long_term.recalls')
+        metrics.incr('long_term.recall_ms', (time.perf_counter() - started) * 1000)
+        return [text for score, text in results if score >= self.min_score]
+
+    def clear(self, user_id, namespace=None):
+        """清除用户的长期记忆，namespace 为空时清除该用户在所有命名空间下的记录"""
+        if namespace is not None:
+            namespaces = [namespace]
+        else:
+            # 目录中的文件名是转义后的命名空间，index_path 对其再次转义结果不变
+            user_dir = os.path.dirname(self.index_path(user_id, ''))
+            names = os.listdir(user_dir) if os.path.isdir(user_dir) else []
+            namespaces = {name[:-len('.jsonl')] for name in names if name.endswith('.jsonl')}
+            with self.lock:
+                namespaces.update(key[1] for key in self.indexes if key[0] == user_id)
+        for name in namespaces:
+            self.get_index(user_id, name).clear()
+
+
+_long_term = None
+_long_term_lock = threading.Lock()
+
+
+def get_long_term_memory():
+    """未开启 AGENT_LONG_TERM_MEMORY 时返回 None"""
+    global _long_term
+    if not getattr(settings, 'AGENT_LONG_TERM_MEMORY', False):
+        return None
+    if _long_term is None:
+        with _long_term_lock:
+            if _long_term is None:
+                _long_term = LongTermMemory(
+                    directory=getattr(settings, 'AGENT_LONG_TERM_MEMORY_DIR', os.path.join(settings.BASE_DIR, 'memory')),
+                    dim=getattr(settings, 'AGENT_LONG_TERM_MEMORY_DIM', 256),
+                    top_k=getattr(settings, 'AGENT_LONG_TERM_MEMORY_TOP_K', 4),
+                    min_score=getattr(settings, 'AGENT_LONG_TERM_MEMORY_MIN_SCORE', 0.2),
+                )
+    return _long_term
@@ -0,0 +1,92 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.emotion import get_emotion_classifier
+
+# (文本, 期望标签)，None 表示需要大模型判断
+SAMPLES = [
+    ("今天好开心！", 'happy'),
+    ("终于下班了，太棒了", 'happy'),
+    ("升职了，超级兴奋", 'happy'),
+    ("I'm so happy today", 'happy'),
+    ("心碎了，想哭", 'sad'),
+    ("被拒绝了，好难过", 'sad'),
+    ("I feel so lonely and depressed", 'sad'),
+    ("气死我了，又被放鸽子", 'angry'),
+    ("真是受够了这个项目", 'angry'),
+    ("I'm furious with my landlord", 'angry'),
+    ("最近压力好大，晚上总是睡不着", 'anxious'),
+    ("明天面试，好紧张好焦虑", 'anxious'),
+    ("I'm really worried about the exam", 'anxious'),
+    ("加班到凌晨，疲惫不堪", 'tired'),
+    ("好累啊", 'tired'),
+    ("I'm exhausted", 'tired'),
+    ("我不开心", None),
+    ("还行吧", None),
+    ("今天中午吃了面条", None),
+    ("累死了但是很开心", None),
+    ("你觉得我应该换工作吗？最近总是在想这件事，有时候觉得挺好，有时候又觉得不甘心", None),
+    ("not bad", None),
+]
+
+
+class Command(BaseCommand):
+    help = "测试 emotion 接口本地快速分类：本地处理的比例、准确率与节省的延迟"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', help="JSONL 文件，每行包含 text 字段，可选 label 字段用于计算准确率；缺省使用内置样例")
+        parser.add_argument('--threshold', type=float, default=None, help="置信度阈值，默认为 AGENT_EMOTION_THRESHOLD")
+        parser.add_argument('--llm-ms', type=float, default=800.0, help="一次大模型调用的平均耗时（毫秒），用于估算节省的延迟")
+        parser.add_argument('--repeat', type=int, default=200, help="每条样例重复分类的次数，用于测量延迟")
+
+    def handle(self, *args, **options):
+        samples = self.load_samples(options['input']) if options['input'] else SAMPLES
+        if not samples or options['repeat'] < 1:
+            raise CommandError("没有样例或 --repeat 小于 1")
+        threshold = options['threshold']
+        if threshold is None:
+            threshold = getattr(settings, 'AGENT_EMOTION_THRESHOLD', 0.7)
+
+        started = time.perf_counter()
+        classifier = get_emotion_classifier()
+        load_ms = (time.perf_counter() - started) * 1000
+
+        local, correct, labelled = 0, 0, 0
+        latencies = []
+        for text, expected in samples:
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                label, confidence = classifier.classify(text)
+            latencies.append((time.perf_counter() - started) * 1000 / options['repeat'])
+            if label is None or confidence < threshold:
+                continue
+            local += 1
+            # 内置样例中期望为 None 的应交给大模型，本地给出结果即为错误
+            if expected is not None or options['input'] is None:
+                labelled += 1
+                correct += label == expected
+
+        share = local / len(samples)
+        local_ms = statistics.mean(latencies)
+        self.stdout.write(f"{len(samples)} 条样例，阈值 {threshold}，加载词典 {load_ms:.1f} ms")
+        self.stdout.write(f"本地处理      {local} 条 ({share:.0%})")
+        if labelled:
+            self.stdout.write(f"本地准确率    {correct / labelled:.0%}")
+        self.stdout.write(f"本地分类      中位数 {statistics.median(latencies):.3f} ms  最大 {max(latencies):.3f} ms")
+        saved = share * (options['llm_ms'] - local_ms)
+        self.stdout.write(
+            f"平均每次请求节省 {saved:.0f} ms（按大模型 {options['llm_ms']:.0f} ms 估算），大模型调用减少 {share:.0%}"
+        )
+
+    def load_samples(self, path):
+        samples = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    samples.append((item['text'], item.get('label')))
+        return samples
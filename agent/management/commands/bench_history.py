@@ -0,0 +1,70 @@
+import pickle
+import random
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from langchain.memory import ChatMessageHistory
+
+from agent.history import CompactChatMessageHistory, zstandard
+
+SAMPLE_TURNS = [
+    "今天午饭花了 35 块，晚上打车回家 28。",
+    "已为你记录：午餐 35 元（餐饮），打车 28 元（交通）。本月餐饮支出已达 1260 元。",
+    "最近工作压力好大，晚上总是睡不着。",
+    "听起来你这段时间真的很辛苦。睡前可以试着放下手机，做几分钟深呼吸，需要的话我们可以聊聊让你焦虑的事情。",
+    "I bought a new keyboard for 89 dollars, is that too much?",
+    "It depends on how much you use it every day. If it replaces an old one you type on for hours, it is a reasonable investment.",
+]
+
+
+def build_histories(users, turns, history_class):
+    rng = random.Random(0)
+    histories = []
+    for _ in range(users):
+        history = history_class()
+        for index in range(turns):
+            text = rng.choice(SAMPLE_TURNS)
+            if index % 2 == 0:
+                history.add_user_message(text)
+            else:
+                history.add_ai_message(text)
+        histories.append(history)
+    return histories
+
+
+class Command(BaseCommand):
+    help = "对比 LangChain 消息对象与紧凑对话历史在内存占用和序列化大小上的差异"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help="模拟的用户数")
+        parser.add_argument('--turns', type=int, default=20, help="每个用户的消息条数")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['turns'] < 1:
+            raise CommandError("--users 和 --turns 必须大于 0")
+
+        self.stdout.write(f"{options['users']} 个用户 × {options['turns']} 条消息")
+        if zstandard is None:
+            self.stdout.write(self.style.WARNING("未安装 zstandard，压缩使用 zlib"))
+
+        baseline = None
+        for label, history_class in (('LangChain 消息', ChatMessageHistory),
+                                     ('紧凑格式', CompactChatMessageHistory)):
+            tracemalloc.start()
+            histories = build_histories(options['users'], options['turns'], history_class)
+            memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            per_user = memory / options['users']
+            ratio = f"  ({baseline / per_user:.1f}x)" if baseline else ''
+            baseline = baseline or per_user
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(f"  内存      {per_user / 1024:8.1f} KB/用户{ratio}")
+
+            pickled = sum(len(pickle.dumps(history)) for history in histories) / options['users']
+            self.stdout.write(f"  pickle    {pickled / 1024:8.1f} KB/用户")
+            if history_class is CompactChatMessageHistory:
+                packed = sum(len(history.pack()) for history in histories) / options['users']
+                compressed = sum(len(history.dumps()) for history in histories) / options['users']
+                self.stdout.write(f"  pack      {packed / 1024:8.1f} KB/用户")
+                self.stdout.write(f"  压缩后    {compressed / 1024:8.1f} KB/用户")
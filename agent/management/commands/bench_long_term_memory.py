@@ -0,0 +1,69 @@
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.longterm import HashingEmbedder, VectorIndex
+
+SAMPLE_QUERIES = [
+    "上个月我在餐饮上花了多少钱？",
+    "还记得我说过睡不着的事吗",
+    "What did I say about the keyboard I bought?",
+]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Command(BaseCommand):
+    help = "测试长期记忆在大量记录下的检索延迟（向量化 + top-k 检索）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snippets', type=int, default=1_000_000, help="索引中的记录数")
+        parser.add_argument('--dim', type=int, default=256, help="向量维度")
+        parser.add_argument('--queries', type=int, default=50, help="检索次数")
+        parser.add_argument('--top-k', type=int, default=4, help="每次取回的记录数")
+        parser.add_argument('--chunk', type=int, default=100_000, help="每批写入的记录数")
+
+    def handle(self, *args, **options):
+        snippets, dim = options['snippets'], options['dim']
+        if snippets < 1 or dim < 1 or options['queries'] < 1 or options['top_k'] < 1:
+            raise CommandError("参数必须大于 0")
+
+        self.stdout.write(f"{snippets} 条记录 × {dim} 维，约 {snippets * dim * 4 / 1024 ** 2:.0f} MB")
+        rng = np.random.default_rng(0)
+        index = VectorIndex(dim)
+        started = time.perf_counter()
+        now = time.time()
+        for offset in range(0, snippets, options['chunk']):
+            count = min(options['chunk'], snippets - offset)
+            vectors = rng.standard_normal((count, dim), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            # 文本只用于返回结果，这里用共享的占位字符串避免测到字符串本身的内存
+            index.add(vectors, ['snippet'] * count, now - snippets + offset + np.arange(count), persist=False)
+        self.stdout.write(f"构建索引    {time.perf_counter() - started:8.2f} s")
+
+        embedder = HashingEmbedder(dim)
+        embed_ms, search_ms, filtered_ms = [], [], []
+        for number in range(options['queries']):
+            query = SAMPLE_QUERIES[number % len(SAMPLE_QUERIES)]
+            started = time.perf_counter()
+            vector = embedder.embed([query])[0]
+            embed_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            index.search(vector, options['top_k'])
+            search_ms.append((time.perf_counter() - started) * 1000)
+
+            # 排除仍在短期记忆中的最近记录
+            started = time.perf_counter()
+            index.search(vector, options['top_k'], before=now - 20)
+            filtered_ms.append((time.perf_counter() - started) * 1000)
+
+        for label, samples in (('向量化', embed_ms), ('检索', search_ms), ('检索(按时间过滤)', filtered_ms)):
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(f"  中位数  {statistics.median(samples):8.3f} ms")
+            self.stdout.write(f"  p99     {percentile(samples, 0.99):8.3f} ms")
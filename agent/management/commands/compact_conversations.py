@@ -0,0 +1,65 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from agent.compaction import build_summary_llm, compact_conversation, pending_conversations
+
+
+class Command(BaseCommand):
+    help = (
+        "后台压缩对话记忆：将超出窗口的较早对话按 (用户, 助手) 概括为滚动摘要写回共享存储，"
+        "请求路径只读取摘要与最近的对话，不增加调用延迟。需要开启 AGENT_MEMORY_PERSIST"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', default=None, help="生成摘要使用的模型，默认为 AGENT_SUMMARY_ENGINE")
+        parser.add_argument('--keep', type=int, default=None,
+                            help="保留的最近记录数，默认为 AGENT_MEMORY_MAX_TURNS × 2（与提示词窗口一致）")
+        parser.add_argument('--min-aging', type=int, default=4, help="超出窗口的记录达到该数量才压缩，减少模型调用")
+        parser.add_argument('--max-chars', type=int, default=None, help="摘要的最大字数，默认为 AGENT_SUMMARY_MAX_CHARS")
+        parser.add_argument('--limit', type=int, default=None, help="每轮最多处理的会话数")
+        parser.add_argument('--interval', type=float, default=None, help="持续运行，每隔该秒数检查一次")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'AGENT_MEMORY_PERSIST', False):
+            raise CommandError("压缩任务读取共享存储中的对话，需要开启 AGENT_MEMORY_PERSIST")
+        keep = options['keep']
+        if keep is None:
+            keep = getattr(settings, 'AGENT_MEMORY_MAX_TURNS', 10) * 2
+        if keep < 0 or options['min_aging'] < 1:
+            raise CommandError("--keep 不能小于 0，--min-aging 必须大于 0")
+        max_chars = options['max_chars'] or getattr(settings, 'AGENT_SUMMARY_MAX_CHARS', 500)
+
+        try:
+            llm = build_summary_llm(options['engine'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        while True:
+            self.run_once(llm, keep, options['min_aging'], max_chars, options['limit'])
+            if options['interval'] is None:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def run_once(self, llm, keep, min_aging, max_chars, limit):
+        stats = {'conversations': 0, 'turns': 0, 'error': 0}
+        conversations = pending_conversations(keep, min_aging)
+        if limit is not None:
+            conversations = conversations[:limit]
+        for conversation in conversations.iterator():
+            try:
+                compacted = compact_conversation(conversation, llm, keep, max_chars)
+            except Exception as e:
+                # 单个会话失败（如模型超时）不影响其他会话，下次运行时重试
+                stats['error'] += 1
+                self.stderr.write(f"{conversation}: {e}")
+                continue
+            if compacted:
+                stats['conversations'] += 1
+                stats['turns'] += compacted
+        self.stdout.write(
+            f"压缩 {stats['conversations']} 个会话，概括 {stats['turns']} 条记录，失败 {stats['error']} 个"
+        )
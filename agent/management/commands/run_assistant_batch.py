@@ -0,0 +1,262 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from agent.bookkeeping import get_bookkeeping_extractor
+from agent.manager import initialize
+from utils.json_output import parse_json_output
+
+
+class Command(BaseCommand):
+    help = (
+        "离线批量调用助手：从 JSONL/CSV 文件流式读取输入，按引擎限制并发调用 AssistantManager，"
+        "结果逐条追加写入 JSONL 文件，中断后重新执行会跳过已成功的条目"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assistant', required=True, help="助手名称")
+        parser.add_argument('--model', required=True, help="默认模型名称（单条输入可用 model_name 字段覆盖）")
+        parser.add_argument('--input', required=True, help="输入文件路径（.jsonl 或 .csv）")
+        parser.add_argument('--output', required=True, help="结果文件路径（JSONL，追加写入）")
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help="输入格式，默认按扩展名判断")
+        parser.add_argument('--language', default='zh', help="输出语言")
+        parser.add_argument('--id-field', default='id', help="输入中作为唯一标识的字段，缺省时使用行号")
+        parser.add_argument('--text-field', default='text', help="输入中作为用户输入的字段")
+        parser.add_argument('--concurrency', type=int, default=8, help="总并发数")
+        parser.add_argument('--engine-limit', action='append', default=[], metavar='MODEL=N',
+                            help="单个引擎的并发上限，可重复指定，如 --engine-limit qwen-max=4")
+        parser.add_argument('--default-engine-limit', type=int, default=4, help="未单独指定的引擎的并发上限")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="最多处理的条目数，断点续跑时已完成而跳过的条目不计入")
+        parser.add_argument('--pre-parse', action='store_true',
+                            help="记账助手使用：先按批用规则提取，只有规则无法可靠处理的条目才调用模型")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency 必须大于 0")
+
+        input_path = options['input']
+        if not os.path.exists(input_path):
+            raise CommandError(f"输入文件不存在: {input_path}")
+        input_format = options['format'] or ('csv' if input_path.lower().endswith('.csv') else 'jsonl')
+
+        self.assistant_name = options['assistant']
+        self.default_model = options['model']
+        self.language = options['language']
+        self.engine_limits = self.parse_engine_limits(options['engine_limit'])
+        self.default_engine_limit = options['default_engine_limit']
+        self.engine_semaphores = {}
+        self.semaphore_lock = threading.Lock()
+        self.local = threading.local()
+
+        # 校验助手与默认模型是否存在，避免整个批次都以失败告终
+        manager = initialize()
+        if self.assistant_name not in manager.assistants:
+            raise CommandError(f"找不到名为 '{self.assistant_name}' 的助手")
+        if self.default_model not in manager.models:
+            raise CommandError(f"找不到名为 '{self.default_model}' 的模型")
+
+        done_ids = self.load_done_ids(options['output'])
+        if done_ids:
+            self.stdout.write(f"已完成 {len(done_ids)} 条，将跳过这些条目")
+
+        stats = {'ok': 0, 'error': 0, 'skipped': 0, 'rules': 0}
+        started = time.monotonic()
+        concurrency = options['concurrency']
+
+        with open(options['output'], 'a', encoding='utf-8') as output, \
+                ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = set()
+            items = self.read_items(input_path, input_format, options['id_field'], options['text_field'])
+            if options['pre_parse']:
+                items = self.pre_parse(items)
+            # 不调用模型的结果（规则提取、无法解析的输入行）攒成一批后经 write_results 写入并落盘
+            immediate = []
+            processed = 0
+            for item_id, item in items:
+                if options['limit'] is not None and processed >= options['limit']:
+                    break
+                if item_id in done_ids:
+                    stats['skipped'] += 1
+                    continue
+                processed += 1
+                if item.get('error') is not None:
+                    immediate.append({'id': item_id, 'model_name': item['model_name'],
+                                      'status': 'error', 'error': item['error']})
+                elif item.get('parsed') is not None:
+                    stats['rules'] += 1
+                    immediate.append({'id': item_id, 'model_name': item['model_name'], 'source': 'rules',
+                                      'status': 'ok', 'content': item['parsed']})
+                else:
+                    pending.add(executor.submit(self.process_item, item_id, item))
+                if len(immediate) >= concurrency * 2:
+                    self.write_results(output, immediate, stats)
+                    immediate = []
+                # 在途任务数有上限，保证不会把整个数据集读入内存
+                if len(pending) >= concurrency * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.write_results(output, finished, stats)
+
+            if immediate:
+                self.write_results(output, immediate, stats)
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                self.write_results(output, finished, stats)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"完成: 成功 {stats['ok']} 条（规则提取 {stats['rules']} 条），失败 {stats['error']} 条，"
+            f"跳过 {stats['skipped']} 条，耗时 {elapsed:.1f}s"
+        ))
+
+    def parse_engine_limits(self, values):
+        limits = {}
+        for value in values:
+            name, sep, limit = value.rpartition('=')
+            if not sep or not name:
+                raise CommandError(f"无效的引擎并发配置: {value}")
+            try:
+                limits[name] = int(limit)
+            except ValueError:
+                raise CommandError(f"无效的引擎并发配置: {value}")
+            if limits[name] < 1:
+                raise CommandError(f"引擎并发上限必须大于 0: {value}")
+        return limits
+
+    def get_engine_semaphore(self, model_name):
+        with self.semaphore_lock:
+            if model_name not in self.engine_semaphores:
+                limit = self.engine_limits.get(model_name, self.default_engine_limit)
+                self.engine_semaphores[model_name] = threading.BoundedSemaphore(limit)
+            return self.engine_semaphores[model_name]
+
+    def load_done_ids(self, output_path):
+        """读取已有结果文件中成功的条目ID，用于断点续跑"""
+        done_ids = set()
+        if not os.path.exists(output_path):
+            return done_ids
+        with open(output_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下半行，忽略即可，该条目会被重新处理
+                    continue
+                if record.get('status') == 'ok':
+                    done_ids.add(str(record.get('id')))
+        return done_ids
+
+    def read_items(self, path, input_format, id_field, text_field):
+        """
+        逐行读取输入，生成 (id, item) 元组
+        无法解析的行生成带 error 的条目（id 为 "line:行号"，不会与输入中的ID冲突），记录为该条失败，不中断整个批次
+        """
+        with open(path, encoding='utf-8', newline='') as f:
+            if input_format == 'csv':
+                rows = csv.DictReader(f)
+            else:
+                rows = self.read_jsonl_rows(f)
+
+            for line_number, row in enumerate(rows, start=1):
+                if not isinstance(row, dict):
+                    error = str(row) if isinstance(row, ValueError) else f"第 {line_number} 行不是 JSON 对象"
+                    yield f'line:{line_number}', {'model_name': self.default_model, 'error': error}
+                    continue
+                item_id = row.get(id_field)
+                if item_id in (None, ''):
+                    item_id = line_number
+                yield str(item_id), {
+                    'text': row.get(text_field) or '',
+                    'model_name': row.get('model_name') or self.default_model,
+                }
+
+    def read_jsonl_rows(self, f):
+        """逐行解析 JSONL，无法解析的行以 ValueError 代替"""
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"无法解析的 JSON: {e}")
+
+    def pre_parse(self, items, batch_size=256):
+        """按批用规则提取记账信息，提取成功的条目带上 parsed，保持原有顺序"""
+        extractor = get_bookkeeping_extractor()
+        batch = []
+        for entry in items:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                yield from self.parse_batch(extractor, batch)
+                batch = []
+        yield from self.parse_batch(extractor, batch)
+
+    def parse_batch(self, extractor, batch):
+        valid = [(item_id, item) for item_id, item in batch if item.get('error') is None]
+        results = iter(extractor.extract_batch([item['text'] for _, item in valid]))
+        for item_id, item in batch:
+            if item.get('error') is None:
+                item['parsed'] = next(results)
+            yield item_id, item
+
+    def get_manager(self):
+        """
+        每个工作线程持有独立的 AssistantManager，避免线程间共享助手的可变状态
+        一次性会话不写入共享存储与长期记忆，处理完只需移除进程内的记忆
+        """
+        manager = getattr(self.local, 'manager', None)
+        if manager is None:
+            manager = initialize()
+            manager.ephemeral = True
+            self.local.manager = manager
+        return manager
+
+    def process_item(self, item_id, item):
+        model_name = item['model_name']
+        record = {'id': item_id, 'model_name': model_name}
+        try:
+            close_old_connections()
+            manager = self.get_manager()
+            manager.use_model(self.assistant_name, model_name)
+
+            # 每个条目使用独立的一次性会话，条目之间不共享记忆
+            session_id = f"batch:{item_id}"
+            try:
+                with self.get_engine_semaphore(model_name):
+                    response_content = manager.invoke(assistant_name=self.assistant_name,
+                                                      user_id=session_id,
+                                                      user_input=item['text'],
+                                                      language=self.language)
+            finally:
+                manager.drop_memory(session_id)
+
+            content, errors = {}, []
+            if response_content:
+                schema = manager.assistants[self.assistant_name].output_schema
+                content, errors = parse_json_output(response_content, schema)
+                if content is None:
+                    content = response_content
+            record.update(status='ok', content=content)
+            if errors:
+                record['schema_errors'] = errors
+        except Exception as e:
+            record.update(status='error', error=str(e))
+        return record
+
+    def write_results(self, output, futures, stats):
+        """futures 中也可以直接是结果记录（如无法解析的输入行）"""
+        for future in futures:
+            record = future.result() if hasattr(future, 'result') else future
+            stats[record['status']] += 1
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            if record['status'] == 'error':
+                self.stderr.write(f"条目 {record['id']} 失败: {record['error']}")
+        # 每批结果立即落盘，崩溃后最多丢失在途条目
+        output.flush()
+        os.fsync(output.fileno())
@@ -1,78 +1,177 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.chat_models import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
-from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+from langchain.prompts import (
+    ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+)
 from langchain.chains import ConversationChain
 
-from assistant.models import Assistant as AssistantModel
+from assistant.models import Assistant as AssistantModel, Prompts
+from engines.health import chat_completions_client, get_engine_health, start_prober
 from engines.models import Engines
+from utils import deadline
+from . import metrics
+from .history import CompactChatMessageHistory
+from .longterm import get_long_term_memory
+from .registry import get_registry
+from .memory import (
+    ConversationWindowMemory, compaction_backlog, get_memory_store, memory_namespace, persistence_enabled,
+    record_prompt_history, refresh_history, save_turns
+)
+
+PROMPT_CACHE_SIZE = 1024
+
+_prompt_cache = OrderedDict()
+_prompt_cache_lock = threading.Lock()
+
+
+def get_chat_prompt(prompt_template: str, language: str, prompt_key: str = None,
+                    output_schema: dict = None) -> ChatPromptTemplate:
+    """
+    按 (提示词哈希, 语言, 输出结构) 缓存构建好的提示词对象（LRU）
+    使用同一份提示词的用户共享同一个对象，prompt_key 缺省时按内容计算哈希
+    """
+    schema_text = json.dumps(output_schema, ensure_ascii=False, sort_keys=True) if output_schema else None
+    key = (prompt_key or Prompts.digest(prompt_template or ''), language, schema_text)
+    with _prompt_cache_lock:
+        prompt = _prompt_cache.get(key)
+        if prompt is not None:
+            _prompt_cache.move_to_end(key)
+            return prompt
+
+    system_template = (
+        f"{prompt_template}\n"
+        f"请使用 {language} 语言进行回复。"  # 动态添加语言要求
+    )
+    if schema_text:
+        # 说明输出结构（JSON 模式也要求提示词中出现 JSON），花括号需转义以免被当作模板变量
+        escaped = schema_text.replace('{', '{{').replace('}', '}}')
+        system_template += f"\n只输出一个符合以下 JSON Schema 的 JSON 对象，不要使用代码块或添加其他内容：\n{escaped}"
+    # 历史作为独立的消息传给模型，在调用时才由紧凑格式转换为消息对象
+    prompt = ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(system_template),
+        MessagesPlaceholder(variable_name="history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ])
+    with _prompt_cache_lock:
+        _prompt_cache[key] = prompt
+        if len(_prompt_cache) > PROMPT_CACHE_SIZE:
+            _prompt_cache.popitem(last=False)
+    return prompt
+
+
+def build_chat_model(options: dict) -> ChatOpenAI:
+    """创建模型客户端，同一服务地址的客户端共用连接池，管理器重建后已建立的连接仍可复用"""
+    client = chat_completions_client(options.get('base_url'), options.get('openai_api_key'),
+                                     options.get('request_timeout'), options.get('max_retries', 2))
+    return ChatOpenAI(client=client, **options)
+
+
+class DeadlineCallbackHandler(BaseCallbackHandler):
+    """
+    在模型开始调用和流式输出的每个 token 时检查请求的截止时间与取消标记
+    超时或客户端断开时抛出异常，中止上游的流式响应，不再继续生成
+    """
+    raise_error = True
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        deadline.check()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        deadline.check()
+
+    def on_llm_new_token(self, token, **kwargs):
+        deadline.check()
 
 
 class Assistant:
-    def __init__(self, model, assistant_id: int, language: str = "en"):
-        """初始化Assistant"""
+    def __init__(self, model, assistant_id: int, language: str = "en", json_mode: bool = False,
+                 assistant_model: AssistantModel = None):
+        """初始化Assistant，传入 assistant_model 时不再查询数据库"""
         self.model = model
-        self.assistant = AssistantModel.objects.get(pk=assistant_id)  # 从数据库加载Assistant配置
+        self.model_name = None  # 当前使用的模型名称，用于记录模型的健康状态
+        self.engine_names = []  # 助手允许使用的模型，多于一个时可按延迟路由
+        self.json_mode = json_mode  # 模型是否支持 JSON 模式
+        # 从数据库加载Assistant配置
+        self.assistant = assistant_model if assistant_model is not None else AssistantModel.objects.get(pk=assistant_id)
         self.language = language
         self.prompt_template = self.assistant.prompt_template  # 存储原始提示词模板
+        self.prompt_key = None  # 提示词内容哈希，用于共享缓存
+        self.output_schema = self.assistant.output_schema  # 输出结构，为空时输出自由文本
+        self.client_overrides = self.assistant.client_overrides()  # 覆盖模型的 max_tokens/超时/重试
+        self.engine_stop = None  # 模型上配置的停止序列，助手设置了 stop 时以助手的为准
         self.prompt = self._build_prompt_template()  # 构建提示词
         self.store_in_memory = self.assistant.is_memory  # 从数据库模型中读取是否存入记忆
-        self.chain = None
+        self.memory_namespace = memory_namespace(self.assistant)  # 记忆按 (用户, 命名空间) 隔离
 
     def _build_prompt_template(self):
         """构建提示词模板，动态加入语言要求"""
-        system_template = (
-            f"{self.prompt_template}\n"
-            f"请使用 {self.language} 语言进行回复。"  # 动态添加语言要求
-        )
-        return ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(system_template),
-            HumanMessagePromptTemplate.from_template("{history}\n\n用户: {input}")
-        ])
+        return get_chat_prompt(self.prompt_template, self.language, self.prompt_key, self.output_schema)
 
-    def set_model(self, model):
+    def set_model(self, model, json_mode: bool = False, stop: list = None, model_name: str = None):
         """切换模型"""
         self.model = model
-        self.chain = None  # 重置chain，下次invoke时重新初始化
+        self.model_name = model_name
+        self.json_mode = json_mode
+        self.engine_stop = stop
+
+    @property
+    def stop(self):
+        return self.assistant.stop if self.assistant.stop is not None else self.engine_stop
 
     def set_language(self, language: str):
         """切换输出语言"""
         self.language = language
         self.prompt = self._build_prompt_template()  # 更新提示词模板
-        self.chain = None  # 重置chain
 
-    def set_prompt_template(self, prompt_template=None):
+    def set_prompt_template(self, prompt_template=None, prompt_key=None):
         """
         切换提示词模板（运行时动态调整）
         如果不提供新的模板，则使用助手默认的模板
+        prompt_key 为提示词内容哈希（如 UsersAssistantTemplates.prompt_id），可省去重复计算
         """
         if prompt_template is not None:
             self.prompt_template = prompt_template
+            self.prompt_key = prompt_key
         else:
             # 重新从数据库加载最新的提示词模板
             self.assistant = AssistantModel.objects.get(pk=self.assistant.id)
             self.prompt_template = self.assistant.prompt_template
+            self.prompt_key = None
             
         self.prompt = self._build_prompt_template()
-        self.chain = None  # 重置chain，下次invoke时重新初始化
 
     def invoke(self, user_input: str, memory: ConversationBufferMemory) -> str:
         """调用助手并生成响应，动态绑定memory"""
-        if self.chain is None or self.chain.memory != memory:
-            self.chain = ConversationChain(llm=self.model, memory=memory, prompt=self.prompt)
-
-        # 如果不存入记忆，临时移除memory
-        original_memory = None
-        if not self.store_in_memory:
-            original_memory = self.chain.memory  # 备份原始memory对象
-            self.chain.memory = None  # 移除memory，阻止自动更新
-
-        # 执行对话
-        response = self.chain.run(input=user_input)
-
-        # 恢复memory（如果之前移除）
-        if not self.store_in_memory and original_memory is not None:
-            self.chain.memory = original_memory
-
+        # 每次调用构建新的 chain：memory 按会话传入，同一个 Assistant 可被多个线程同时使用
+        llm = self.model
+        if self.output_schema and self.json_mode:
+            llm = llm.bind(response_format={"type": "json_object"})
+        llm_kwargs, callbacks = {}, None
+        if deadline.current() is not None:
+            # 请求中调用时以流式方式输出，超时或客户端断开时可以在任意 token 处中止；单次调用的超时不超过剩余时间
+            llm_kwargs = {'stream': True, 'timeout': deadline.timeout(None)}
+            callbacks = [DeadlineCallbackHandler()]
+        chain = ConversationChain(llm=llm, memory=memory, prompt=self.prompt, llm_kwargs=llm_kwargs)
+        # 停止序列作为链的输入传入（绑定在模型上会被 LLMChain 的 stop=None 覆盖）
+        inputs = {'input': user_input, 'stop': self.stop} if self.stop else {'input': user_input}
+        started = time.monotonic()
+        try:
+            response = chain.run(**inputs, callbacks=callbacks)
+        except (deadline.DeadlineExceeded, deadline.RequestCancelled):
+            raise  # 请求自身超时或被取消，不计为模型的错误
+        except Exception as e:
+            if self.model_name:
+                get_engine_health().record(self.model_name, error=e)
+            raise
+        if self.model_name:
+            get_engine_health().record(self.model_name, latency_ms=(time.monotonic() - started) * 1000)
         return response
 
 
@@ -81,17 +180,37 @@ class AssistantManager:
         """初始化Assistant管理器"""
         self.max_turns = max_turns
         self.models = {}
+        self.json_mode_models = set()  # 支持 JSON 模式的模型名称
+        self.model_options = {}  # 模型名称 -> 创建客户端的参数
+        self.model_stops = {}  # 模型名称 -> 停止序列
+        self.override_models = {}  # (模型名称, 助手覆盖的参数) -> 客户端
         self.assistants = {}
-        self.memory_dict = {}
+        self.engines = {}  # 模型名称 -> Engines
+        self.registry = None  # 设置后按模型配置复用进程内的客户端
+        self.memory_store = get_memory_store()  # 进程级记忆，多个管理器实例共享
+        # 为 True 时对话只保存在进程内，不写入共享存储（AGENT_MEMORY_PERSIST）和长期记忆，批处理等一次性会话使用
+        self.ephemeral = False
 
     def add_model(self, engine: Engines, **kwargs):
-        """添加模型，从数据库加载配置"""
-        self.models[engine.name] = ChatOpenAI(
+        """添加模型，从数据库加载配置，温度、最大输出 token 数、超时与重试次数在客户端上生效"""
+        options = dict(
             openai_api_key=engine.api_key,
             model_name=engine.name,
             base_url=engine.base_url,
-            **kwargs
+            **engine.client_options(),
         )
+        options.update(kwargs)
+        self.model_options[engine.name] = options
+        self.model_stops[engine.name] = engine.stop or None
+        self.engines[engine.name] = engine
+        if self.registry is not None and not kwargs:
+            self.models[engine.name] = self.registry.chat_model(engine, None, lambda: build_chat_model(options))
+        else:
+            self.models[engine.name] = build_chat_model(options)
+        if engine.supports_json_mode:
+            self.json_mode_models.add(engine.name)
+        else:
+            self.json_mode_models.discard(engine.name)
 
     def add_assistant(self, assistant: AssistantModel, model_name = 'qwen-max', language='en'):
         """添加Assistant，从数据库加载配置"""
@@ -100,49 +219,149 @@ class AssistantManager:
         self.assistants[assistant.name] = Assistant(
             model=self.models[model_name],
             assistant_id=assistant.id,
-            language=language
+            language=language,
+            assistant_model=assistant
         )
+        # 查询助手时应 prefetch_related('engines')
+        self.assistants[assistant.name].engine_names = [engine.name for engine in assistant.engines.all()
+                                                        if engine.is_active]
+        self.use_model(assistant.name, model_name)
 
-    def get_or_create_memory(self, user_id: str) -> ConversationBufferMemory:
-        """获取或创建用户的记忆实例"""
-        if user_id not in self.memory_dict:
-            self.memory_dict[user_id] = ConversationBufferMemory(return_messages=True)
-        return self.memory_dict[user_id]
+    def use_model(self, assistant_name: str, model_name: str):
+        """为助手切换到指定名称的模型，应用助手对生成限制的覆盖"""
+        if assistant_name not in self.assistants:
+            raise ValueError(f"Assistant {assistant_name} not found.")
+        if model_name not in self.models:
+            raise ValueError(f"Model {model_name} not found.")
+        assistant = self.assistants[assistant_name]
+        assistant.set_model(self.model_for(model_name, assistant.client_overrides),
+                            json_mode=model_name in self.json_mode_models,
+                            stop=self.model_stops.get(model_name),
+                            model_name=model_name)
+
+    def select_model(self, assistant_name: str, model_name: str) -> str:
+        """
+        开启 ENGINE_ROUTING 且助手允许使用多个模型时，返回其中当前延迟最低的健康模型
+        否则，或者还没有任何候选模型的健康数据时，返回请求指定的模型
+        """
+        if not getattr(settings, 'ENGINE_ROUTING', False) or assistant_name not in self.assistants:
+            return model_name
+        candidates = [name for name in self.assistants[assistant_name].engine_names if name in self.models]
+        if len(candidates) < 2:
+            return model_name
+        selected = get_engine_health().fastest(candidates)
+        if selected is None:
+            return model_name
+        if selected != model_name:
+            metrics.incr('routing.switched')
+        return selected
 
-    def invoke(self, assistant_name: str, user_id: str, user_input: str, language: str = None, prompt_template: str = None) -> str:
+    def model_for(self, model_name: str, overrides: dict = None):
+        """
+        模型客户端，助手覆盖了生成限制时使用单独的客户端（超时与重试次数设置在客户端上，无法按次调用指定）
+        相同的覆盖参数共用一个客户端
         """
-        调用指定Assistant并生成响应，基于用户ID管理记忆
+        if not overrides or model_name not in self.model_options:
+            return self.models[model_name]
+        options = {**self.model_options[model_name], **overrides}
+        if self.registry is not None and model_name in self.engines:
+            return self.registry.chat_model(self.engines[model_name], overrides, lambda: build_chat_model(options))
+        key = (model_name, tuple(sorted(overrides.items())))
+        model = self.override_models.get(key)
+        if model is None:
+            model = self.override_models[key] = build_chat_model(options)
+        return model
+
+    def get_or_create_memory(self, user_id: str, namespace: str) -> CompactChatMessageHistory:
+        """获取或创建用户在指定命名空间下的对话历史"""
+        return self.memory_store.get_or_create(user_id, namespace)
+
+    def invoke(self, assistant_name: str, user_id: str, user_input: str, language: str = None,
+               prompt_template: str = None, prompt_key: str = None) -> str:
+        """
+        调用指定Assistant并生成响应，记忆按 (用户ID, 助手的记忆命名空间) 隔离
         可选参数:
         - language: 指定输出语言
         - prompt_template: 自定义提示词模板
+        - prompt_key: 自定义提示词的内容哈希，用于共享提示词缓存
         """
         if assistant_name not in self.assistants:
             raise ValueError(f"Assistant {assistant_name} not found.")
             
         assistant = self.assistants[assistant_name]
+        # 助手设置了请求超时时缩短本次请求的截止时间
+        deadline.narrow(assistant.assistant.request_timeout)
+        deadline.check()
         
         # 如果提供了自定义提示词模板，则更新
         if prompt_template:
-            assistant.set_prompt_template(prompt_template)
+            assistant.set_prompt_template(prompt_template, prompt_key)
             
         # 如果提供了语言设置，则更新
         if language and language != assistant.language:
             assistant.set_language(language)
             
-        memory = self.get_or_create_memory(user_id)
-        response = assistant.invoke(user_input, memory)
-        
-        # 管理对话历史长度
-        if assistant.store_in_memory and len(memory.chat_memory.messages) > self.max_turns * 2:
-            memory.chat_memory.messages = memory.chat_memory.messages[-self.max_turns * 2:]
-            
+        if not assistant.store_in_memory:
+            # 不使用记忆的助手只看到本轮输入：使用临时的历史，调用结束后丢弃
+            record_prompt_history(user_id, None)
+            memory = ConversationBufferMemory(chat_memory=CompactChatMessageHistory(), return_messages=True,
+                                              input_key='input')
+            return assistant.invoke(user_input, memory)
+
+        namespace = assistant.memory_namespace
+        max_messages = self.max_turns * 2
+        # 开启后台压缩时，超出窗口的记录先保留在历史中（不进入提示词），由压缩任务概括为摘要后移除
+        retained = max_messages + (0 if self.ephemeral else compaction_backlog())
+        # 同一会话的请求（如移动端重复点击）依次执行，后一个请求能看到前一轮对话，不会丢失记录
+        with self.memory_store.conversation_lock(user_id, namespace):
+            history = self.get_or_create_memory(user_id, namespace)
+            persist = persistence_enabled() and not self.ephemeral
+            if persist:
+                refresh_history(user_id, namespace, history)
+            record_prompt_history(user_id, history)
+
+            # 长期记忆：只取回与本轮输入最相关、且已不在短期记忆中的几条较早对话
+            long_term = None if self.ephemeral else get_long_term_memory()
+            recalled = []
+            if long_term is not None:
+                window = history.turns[-max_messages:]
+                before = window[0].ts if window else None
+                recalled = long_term.recall(user_id, namespace, user_input, before)
+
+            turns_before = len(history)
+            memory = ConversationWindowMemory(chat_memory=history, return_messages=True, input_key='input',
+                                              window=max_messages, recalled=recalled)
+            response = assistant.invoke(user_input, memory)
+            if deadline.is_cancelled():
+                # 客户端在生成结束前已经断开，回复不会被看到，也不写入记忆
+                del history.turns[turns_before:]
+                raise deadline.RequestCancelled()
+            new_turns = history.turns[turns_before:]
+            if long_term is not None:
+                long_term.remember(user_id, namespace, new_turns)
+
+            # 管理对话历史长度
+            history.trim(retained)
+            if persist:
+                # 多进程部署时进程锁只能保证本进程内的顺序，共享存储中按版本号比较并交换
+                save_turns(user_id, namespace, history, new_turns, retained)
+
         return response
 
-    def clear_memory(self, user_id: str):
-        """清除指定用户的记忆"""
-        if user_id in self.memory_dict:
-            self.memory_dict[user_id].clear()
-            
+    def clear_memory(self, user_id: str, namespace: str = None):
+        """清除指定用户的记忆（包括长期记忆），不指定命名空间时清除该用户在所有助手下的记忆"""
+        self.memory_store.clear(user_id, namespace)
+        long_term = get_long_term_memory()
+        if long_term is not None:
+            long_term.clear(user_id, namespace)
+
+    def drop_memory(self, user_id: str, namespace: str = None):
+        """
+        移除指定用户在进程内的记忆实例（批处理等一次性会话使用，避免记忆无限增长）
+        不涉及共享存储与长期记忆，一次性会话应在 ephemeral 的管理器上执行
+        """
+        self.memory_store.drop(user_id, namespace)
+
     def update_assistant_prompt(self, assistant_name: str, prompt_template: str):
         """更新指定助手的提示词模板"""
         if assistant_name not in self.assistants:
@@ -151,14 +370,18 @@ class AssistantManager:
 
 
 def initialize() -> AssistantManager:
-    manager = AssistantManager(max_turns=10)
+    """
+    创建管理器；模型与助手配置、模型客户端来自进程内的注册表，只在配置变化时重新查询
+    每个请求使用独立的管理器实例（use_model 等会修改助手的状态）
+    """
+    start_prober()
+    manager = AssistantManager(max_turns=getattr(settings, 'AGENT_MEMORY_MAX_TURNS', 10))
+    manager.registry = get_registry()
+    engines, assistant_models = manager.registry.snapshot()
 
-    engines = Engines.objects.all()
     for engine in engines:
         manager.add_model(engine)
 
-    assistant_models = AssistantModel.objects.all()
-
     for assistant in assistant_models:
         manager.add_assistant(assistant)
 
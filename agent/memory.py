@@ -0,0 +1,180 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import SystemMessage
+
+from . import metrics
+from .history import CompactChatMessageHistory
+from .locks import KeyedLock
+
+
+def memory_namespace(assistant):
+    """
+    助手使用的记忆命名空间
+    设置了 memory_namespace 的助手共享同名空间的记忆，否则每个助手单独一份
+    """
+    return assistant.memory_namespace or f'assistant:{assistant.pk}'
+
+
+def history_chars(history):
+    return history.char_count()
+
+
+class MemoryStore:
+    """
+    进程级的对话记忆，按 (user_id, 命名空间) 保存紧凑格式的对话历史（CompactChatMessageHistory）
+    以用户为单位做 LRU，超过 max_users 时淘汰最久未活跃用户的全部记忆
+    同一会话的读取-调用-追加需在 conversation_lock 内完成，每个会话一把锁，不同会话互不阻塞
+    """
+
+    def __init__(self, max_users=10000):
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.users = OrderedDict()  # user_id -> {命名空间: 对话历史}
+        self.conversation_locks = KeyedLock()
+
+    def conversation_lock(self, user_id, namespace):
+        """会话级的锁，同一会话的请求按到达顺序依次执行"""
+        return self.conversation_locks.get(user_id, namespace)
+
+    def get_or_create(self, user_id, namespace):
+        with self.lock:
+            memories = self.users.get(user_id)
+            if memories is None:
+                memories = self.users[user_id] = {}
+                while len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+                    metrics.incr('memory.evicted_users')
+            else:
+                self.users.move_to_end(user_id)
+            history = memories.get(namespace)
+            if history is None:
+                history = memories[namespace] = CompactChatMessageHistory()
+            return history
+
+    def user_memories(self, user_id):
+        """用户在所有命名空间下的记忆"""
+        with self.lock:
+            return dict(self.users.get(user_id, {}))
+
+    def clear(self, user_id, namespace=None):
+        """清空记忆内容，namespace 为空时清空该用户的全部记忆"""
+        for key, history in self.user_memories(user_id).items():
+            if namespace is None or key == namespace:
+                history.clear()
+
+    def drop(self, user_id, namespace=None):
+        """移除记忆实例，namespace 为空时移除该用户的全部记忆"""
+        with self.lock:
+            if namespace is None:
+                self.users.pop(user_id, None)
+            elif user_id in self.users:
+                self.users[user_id].pop(namespace, None)
+
+    def __len__(self):
+        return len(self.users)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MemoryStore(getattr(settings, 'AGENT_MEMORY_MAX_USERS', 10000))
+    return _store
+
+
+def record_prompt_history(user_id, history):
+    """
+    记录本次调用带入提示词的历史大小（不使用记忆的助手传入 None），以及如果所有助手共用一份记忆时会带入的大小
+    两者之差即按 (用户, 助手) 隔离记忆后节省的提示词
+    """
+    scoped = history_chars(history) if history is not None else 0
+    shared = sum(history_chars(other) for other in get_memory_store().user_memories(user_id).values())
+    metrics.incr('prompt.calls')
+    metrics.incr('prompt.history_chars', scoped)
+    metrics.incr('prompt.history_chars_if_shared', max(shared, scoped))
+
+
+class ConversationWindowMemory(ConversationBufferMemory):
+    """
+    调用模型时带入的记忆：滚动摘要 + 最近 window 条记录，以及从长期记忆中取回的相关对话
+    历史中超出窗口、等待后台压缩的记录不会进入提示词
+    """
+    window: int = 0
+    recalled: list = []
+
+    def load_memory_variables(self, inputs):
+        messages = self.chat_memory.window_messages(self.window)
+        if self.recalled:
+            content = "以下是与当前话题相关的较早对话，仅供参考：\n\n" + "\n\n".join(self.recalled)
+            messages.insert(0, SystemMessage(content=content))
+        return {self.memory_key: messages}
+
+
+class ConversationConflict(Exception):
+    """多次比较并交换都因并发写入失败"""
+
+
+def persistence_enabled():
+    return getattr(settings, 'AGENT_MEMORY_PERSIST', False)
+
+
+def compaction_backlog():
+    """
+    开启后台压缩时，超出窗口的记录最多再保留多少条，等待压缩任务生成摘要后移除
+    压缩任务读取共享存储，因此需要同时开启 AGENT_MEMORY_PERSIST
+    """
+    if not (getattr(settings, 'AGENT_MEMORY_COMPACTION', False) and persistence_enabled()):
+        return 0
+    return getattr(settings, 'AGENT_MEMORY_COMPACTION_BACKLOG', 40)
+
+
+def refresh_history(user_id, namespace, history):
+    """共享存储中的版本与进程内不一致（其他进程写入过）时，用共享存储的内容替换进程内的历史"""
+    from .models import Conversation
+
+    row = (Conversation.objects.filter(user_id=str(user_id), namespace=namespace)
+           .values_list('version', 'data').first())
+    if row is None or row[0] == history.version:
+        return history
+    loaded = CompactChatMessageHistory.loads(bytes(row[1]))
+    history.turns = loaded.turns
+    history.summary = loaded.summary
+    history.version = row[0]
+    metrics.incr('memory.refreshed')
+    return history
+
+
+def save_turns(user_id, namespace, history, new_turns, max_messages, max_attempts=5):
+    """
+    将本轮新增的记录追加到共享存储
+    以读取到的 version 为条件更新（UPDATE ... WHERE version = v），被其他进程抢先写入时重新读取、合并后重试
+    成功后进程内的历史与共享存储保持一致
+    """
+    from .models import Conversation
+
+    conversation, _ = Conversation.objects.get_or_create(user_id=str(user_id), namespace=namespace)
+    version, data = conversation.version, conversation.data
+    for attempt in range(max_attempts):
+        merged = CompactChatMessageHistory.loads(bytes(data)) if data else CompactChatMessageHistory()
+        merged.turns.extend(new_turns)
+        merged.trim(max_messages)
+        updated = Conversation.objects.filter(pk=conversation.pk, version=version).update(
+            data=merged.dumps(), version=version + 1, message_count=len(merged), updated_at=timezone.now()
+        )
+        if updated:
+            history.turns = merged.turns
+            history.summary = merged.summary
+            history.version = version + 1
+            return history
+        metrics.incr('memory.cas_conflicts')
+        version, data = Conversation.objects.filter(pk=conversation.pk).values_list('version', 'data').get()
+    raise ConversationConflict(f"会话 {user_id}:{namespace} 连续 {max_attempts} 次写入冲突")
@@ -0,0 +1,26 @@
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+
+
+def incr(name, value=1):
+    """累加计数器"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot():
+    """当前进程所有计数器的副本"""
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=64, verbose_name='用户ID')),
+                ('namespace', models.CharField(max_length=100, verbose_name='记忆命名空间')),
+                ('data', models.BinaryField(default=bytes, verbose_name='对话历史')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='版本')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '对话记忆',
+                'verbose_name_plural': '对话记忆',
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'namespace'), name='unique_conversation_namespace')],
+            },
+        ),
+    ]
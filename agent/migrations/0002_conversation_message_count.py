@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agent', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='记录数'),
+        ),
+    ]
@@ -1,3 +1,25 @@
 from django.db import models
 
-# Create your models here.
+
+class Conversation(models.Model):
+    """
+    持久化的对话记忆，多个进程共享
+    data 为 CompactChatMessageHistory.dumps() 的结果，写入时按 version 做比较并交换（CAS），并发写入不会丢失对话
+    message_count 为 data 中的记录数，后台压缩任务据此筛选需要生成摘要的会话，不必逐条解压
+    """
+    user_id = models.CharField('用户ID', max_length=64)
+    namespace = models.CharField('记忆命名空间', max_length=100)
+    data = models.BinaryField('对话历史', default=bytes)
+    version = models.PositiveIntegerField('版本', default=0)
+    message_count = models.PositiveIntegerField('记录数', default=0, db_index=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '对话记忆'
+        verbose_name_plural = '对话记忆'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'namespace'], name='unique_conversation_namespace'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.namespace}'
@@ -0,0 +1,124 @@
+import threading
+import time
+
+from django.conf import settings
+
+from assistant.models import Assistant as AssistantModel
+from engines.models import Engines
+from utils.invalidation import get_bus, instance_version, model_label
+
+ENGINE = model_label(Engines)
+ASSISTANT = model_label(AssistantModel)
+
+
+class Registry:
+    """
+    进程内缓存的模型与助手配置，以及按模型配置创建的客户端
+    之前每个请求都要重新查询全部模型和助手、重新创建客户端；现在只在配置变化时重新加载：
+    - 订阅缓存失效事件，模型或助手被修改时只移除对应的条目，下一次读取时只重新查询发生变化的记录
+    - REGISTRY_TTL 作为兜底（如 queryset.update 不会发出信号），有失效广播时可以设置得很长
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.engines = {}  # pk -> Engines
+        self.assistants = {}  # pk -> Assistant（已预取 engines）
+        self.clients = {}  # (模型 pk, 覆盖参数) -> 客户端
+        self.stale = {ENGINE: set(), ASSISTANT: set()}  # 需要重新查询的 pk
+        self.loaded_at = None
+
+    def snapshot(self):
+        """返回 (模型列表, 助手列表)，需要时重新加载"""
+        with self.lock:
+            expired = self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+            stale = {label: set(pks) for label, pks in self.stale.items()}
+            for pks in self.stale.values():
+                pks.clear()
+        if expired:
+            self.load_all()
+        else:
+            if stale[ENGINE]:
+                self.reload(Engines.objects.all(), self.engines, stale[ENGINE])
+            if stale[ASSISTANT]:
+                self.reload(AssistantModel.objects.prefetch_related('engines'), self.assistants, stale[ASSISTANT])
+        with self.lock:
+            return list(self.engines.values()), list(self.assistants.values())
+
+    def assistant(self, name):
+        """按名称返回助手配置，不存在时返回 None"""
+        _, assistants = self.snapshot()
+        return next((assistant for assistant in assistants if assistant.name == name), None)
+
+    def load_all(self):
+        engines = {engine.pk: engine for engine in Engines.objects.all()}
+        assistants = {assistant.pk: assistant for assistant in AssistantModel.objects.prefetch_related('engines')}
+        with self.lock:
+            self.engines, self.assistants = engines, assistants
+            self.clients.clear()
+            self.loaded_at = time.monotonic()
+
+    def reload(self, queryset, cache, pks):
+        """只重新查询指定的记录，已删除的记录从缓存中移除"""
+        if None in pks:
+            rows = {row.pk: row for row in queryset}
+            with self.lock:
+                cache.clear()
+                cache.update(rows)
+            return
+        rows = {row.pk: row for row in queryset.filter(pk__in=pks)}
+        with self.lock:
+            for pk in pks:
+                if pk in rows:
+                    cache[pk] = rows[pk]
+                else:
+                    cache.pop(pk, None)
+
+    def chat_model(self, engine, overrides, build):
+        """按模型和覆盖参数复用客户端，模型配置变化时对应的客户端被移除"""
+        key = (engine.pk, tuple(sorted((overrides or {}).items())))
+        with self.lock:
+            model = self.clients.get(key)
+        if model is None:
+            model = build()
+            with self.lock:
+                # 创建期间模型可能已被修改，只缓存与当前配置一致的客户端
+                if self.engines.get(engine.pk) is engine:
+                    self.clients[key] = model
+        return model
+
+    def invalidate(self, event):
+        with self.lock:
+            cache = self.engines if event.model == ENGINE else self.assistants
+            if event.pk is None:
+                self.loaded_at = None
+                return
+            cached = cache.get(event.pk)
+            if cached is not None and event.version is not None and instance_version(cached) == event.version:
+                return  # 已经是最新的（如本进程在事件到达前已重新加载）
+            self.stale[event.model].add(event.pk)
+            if event.model == ENGINE:
+                for key in [key for key in self.clients if key[0] == event.pk]:
+                    del self.clients[key]
+                # 助手预取的可用模型（名称、是否启用）也随之过期
+                for assistant in self.assistants.values():
+                    if any(engine.pk == event.pk for engine in assistant.engines.all()):
+                        self.stale[ASSISTANT].add(assistant.pk)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = Registry(ttl=getattr(settings, 'REGISTRY_TTL', 3600))
+                bus = get_bus()
+                bus.subscribe(ENGINE, registry.invalidate)
+                bus.subscribe(ASSISTANT, registry.invalidate)
+                _registry = registry
+    get_bus().ensure_started()
+    return _registry
@@ -1,3 +1,828 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from langchain.llms.fake import FakeListLLM
+from rest_framework.test import APIRequestFactory
+
+from assistant.models import Assistant as AssistantModel
+from engines.health import EngineHealth
+from engines.models import Engines
+from .bookkeeping import BookkeepingExtractor
+from .compaction import compact_conversation
+from .emotion import EmotionClassifier
+from utils.invalidation import Event, instance_version
+from utils.throttling import UserRateThrottle
+from . import history as history_module
+from .history import CompactChatMessageHistory, Turn, ROLE_AI, ROLE_HUMAN
+from .locks import FairLock, KeyedLock
+from .longterm import LongTermMemory, VectorIndex
+from .manager import AssistantManager
+from .memory import MemoryStore, save_turns
+from .models import Conversation
+from .registry import ASSISTANT, ENGINE, Registry
+from .views import AgentViewSet
+
+
+class EchoLLM(FakeListLLM):
+    """返回 "本轮输入#提示词中的用户消息数"，并模拟模型调用的耗时"""
+    delay: float = 0.005
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.delay)
+        return f"{prompt.rsplit('Human: ', 1)[-1]}#{prompt.count('Human: ')}"
+
+
+class ConcurrentTurnsTest(TestCase):
+    """同一会话的并发请求依次执行且不丢失记录，不同会话之间并行"""
+
+    def setUp(self):
+        self.assistant = AssistantModel.objects.create(name='companion', prompt_template='hi', is_memory=True)
+
+    def build_manager(self, delay=0.005, max_turns=100):
+        manager = AssistantManager(max_turns=max_turns)
+        manager.memory_store = MemoryStore()
+        manager.models['echo'] = EchoLLM(responses=[''], delay=delay)
+        manager.add_assistant(self.assistant, model_name='echo')
+        return manager
+
+    def test_no_lost_updates(self):
+        manager = self.build_manager()
+        users, turns = 20, 15
+
+        def run(user_id, index):
+            manager.invoke('companion', user_id, f'{user_id}-{index}')
+
+        with ThreadPoolExecutor(max_workers=64) as executor:
+            futures = [executor.submit(run, user_id, index) for index in range(turns) for user_id in range(users)]
+            for future in futures:
+                future.result()
+
+        namespace = manager.assistants['companion'].memory_namespace
+        for user_id in range(users):
+            history = manager.memory_store.get_or_create(user_id, namespace)
+            self.assertEqual(len(history), turns * 2)
+            # 每一轮的用户输入和回复相邻，没有被其他请求插入
+            for human, ai in zip(history.turns[0::2], history.turns[1::2]):
+                self.assertEqual((human.role, ai.role), (ROLE_HUMAN, ROLE_AI))
+                self.assertEqual(ai.text.split('#')[0], human.text)
+            # 第 n 轮调用时能看到前 n-1 轮，没有两个请求基于同一份历史
+            self.assertEqual([int(turn.text.split('#')[1]) for turn in history.turns[1::2]],
+                             list(range(1, turns + 1)))
+            self.assertEqual({turn.text for turn in history.turns[0::2]},
+                             {f'{user_id}-{index}' for index in range(turns)})
+
+    def test_different_users_run_in_parallel(self):
+        delay, users = 0.05, 32
+        manager = self.build_manager(delay=delay)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            list(executor.map(lambda user_id: manager.invoke('companion', user_id, 'hello'), range(users)))
+        parallel = time.monotonic() - started
+        # 串行需要 users × delay，并行时应远小于这个值
+        self.assertLess(parallel, users * delay / 4)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda index: manager.invoke('companion', 'same-user', f'{index}'), range(8)))
+        # 同一会话的请求依次执行
+        self.assertGreaterEqual(time.monotonic() - started, 8 * delay)
+
+    def test_fair_lock_preserves_arrival_order(self):
+        lock = FairLock()
+        order = []
+
+        def worker(index):
+            with lock:
+                order.append(index)
+
+        lock.acquire()
+        threads = []
+        for index in range(10):
+            thread = threading.Thread(target=worker, args=(index,))
+            thread.start()
+            threads.append(thread)
+            # 等待该线程领到号码后再启动下一个
+            while lock._next_ticket != index + 2:
+                time.sleep(0.001)
+        lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, list(range(10)))
+
+
+    def test_keyed_lock_does_not_block_other_keys(self):
+        locks = KeyedLock()
+        entered, done = threading.Event(), threading.Event()
+
+        def other_conversation():
+            with locks.get(2, 'companion'):
+                entered.set()
+                done.wait(1)
+
+        with locks.get(1, 'companion'):
+            # 持有一个会话的锁期间（如等待模型回复），其他会话的锁可以立即获得
+            thread = threading.Thread(target=other_conversation)
+            thread.start()
+            self.assertTrue(entered.wait(1))
+            self.assertEqual(len(locks), 2)
+            done.set()
+            thread.join()
+        # 没有持有者和等待者的锁被移除
+        self.assertEqual(len(locks), 0)
+
+class ConversationCompareAndSetTest(TestCase):
+    """共享存储中按版本号比较并交换，并发写入时合并而不是覆盖"""
+
+    def test_concurrent_writer_is_merged(self):
+        save_turns('u1', 'ns', CompactChatMessageHistory(), [Turn(ROLE_HUMAN, 'a'), Turn(ROLE_AI, 'a')], 100)
+
+        original_loads = CompactChatMessageHistory.loads
+        calls = []
+
+        def loads_with_concurrent_write(blob):
+            # 第一次读取之后，另一个进程抢先写入了一轮对话
+            if not calls:
+                calls.append(blob)
+                other = original_loads(blob)
+                other.turns.extend([Turn(ROLE_HUMAN, 'b'), Turn(ROLE_AI, 'b')])
+                Conversation.objects.filter(user_id='u1', namespace='ns').update(data=other.dumps(), version=2)
+            return original_loads(blob)
+
+        history = CompactChatMessageHistory()
+        with mock.patch.object(CompactChatMessageHistory, 'loads', side_effect=loads_with_concurrent_write):
+            save_turns('u1', 'ns', history, [Turn(ROLE_HUMAN, 'c'), Turn(ROLE_AI, 'c')], 100)
+
+        conversation = Conversation.objects.get(user_id='u1', namespace='ns')
+        stored = CompactChatMessageHistory.loads(bytes(conversation.data))
+        self.assertEqual([turn.text for turn in stored.turns], ['a', 'a', 'b', 'b', 'c', 'c'])
+        self.assertEqual(conversation.version, 3)
+        self.assertEqual(history.version, 3)
+
+    @override_settings(AGENT_MEMORY_PERSIST=True)
+    def test_manager_reloads_newer_version(self):
+        assistant = AssistantModel.objects.create(name='companion', prompt_template='hi', is_memory=True)
+        managers = []
+        for _ in range(2):
+            # 两个管理器使用各自的进程内记忆，模拟两个进程
+            manager = AssistantManager(max_turns=100)
+            manager.memory_store = MemoryStore()
+            manager.models['echo'] = EchoLLM(responses=[''], delay=0)
+            manager.add_assistant(assistant, model_name='echo')
+            managers.append(manager)
+
+        managers[0].invoke('companion', 7, 'first')
+        managers[1].invoke('companion', 7, 'second')
+        managers[0].invoke('companion', 7, 'third')
+
+        namespace = managers[0].assistants['companion'].memory_namespace
+        history = managers[0].memory_store.get_or_create(7, namespace)
+        self.assertEqual([turn.text for turn in history.turns[0::2]], ['first', 'second', 'third'])
+
+
+class SharedVectorIndexTest(TestCase):
+    """多个进程共用同一个会话的长期记忆文件：检索前读入其他进程的追加与清空"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'user', 'ns')
+        self.addCleanup(self.directory.cleanup)
+
+    def add(self, index, *texts):
+        vectors = [[1.0, 0.0, 0.0, 0.0]] * len(texts)
+        index.add(vectors, list(texts), [time.time()] * len(texts))
+
+    def test_appends_and_clear_from_other_process(self):
+        first, second = VectorIndex.load(4, self.path), VectorIndex.load(4, self.path)
+        self.add(first, 'a')
+        second.refresh()
+        self.assertEqual(second.texts, ['a'])
+
+        self.add(second, 'b')
+        self.add(first, 'c')
+        second.refresh()
+        self.assertEqual(sorted(first.texts), ['a', 'b', 'c'])
+        self.assertEqual(sorted(second.texts), ['a', 'b', 'c'])
+        self.assertEqual(len(VectorIndex.load(4, self.path)), 3)
+
+        first.clear()
+        self.add(first, 'd')
+        second.refresh()
+        self.assertEqual(second.texts, ['d'])
+
+    def test_torn_write_is_discarded(self):
+        index = VectorIndex.load(4, self.path)
+        self.add(index, 'a')
+        with open(self.path + '.jsonl', 'ab') as f:
+            f.write(b'{"text": "half')
+        with open(self.path + '.f32', 'ab') as f:
+            f.write(b'\x00' * 6)
+        reloaded = VectorIndex.load(4, self.path)
+        self.assertEqual(reloaded.texts, ['a'])
+        self.add(reloaded, 'b')
+        self.assertEqual(VectorIndex.load(4, self.path).texts, ['a', 'b'])
+
+    def test_clear_user(self):
+        memory = LongTermMemory(self.directory.name, dim=64)
+        turns = [Turn(ROLE_HUMAN, '我喜欢爬山', ts=1), Turn(ROLE_AI, '爬山很好', ts=1)]
+        memory.remember('u1', 'assistant:1', turns)
+        memory.remember('u1', 'assistant:2', turns)
+        memory.remember('u2', 'assistant:1', turns)
+        self.assertTrue(memory.recall('u1', 'assistant:1', '爬山'))
+
+        memory.clear('u1')
+        self.assertEqual(memory.recall('u1', 'assistant:1', '爬山'), [])
+        self.assertEqual(memory.recall('u1', 'assistant:2', '爬山'), [])
+        self.assertTrue(LongTermMemory(self.directory.name, dim=64).recall('u2', 'assistant:1', '爬山'))
+
+
+class BatchCommandTest(TestCase):
+    """批处理：无法解析的输入行记为该条失败，一次性会话不写入共享存储"""
+
+    def setUp(self):
+        self.assistant = AssistantModel.objects.create(name='companion', prompt_template='hi', is_memory=True)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def build_manager(self):
+        manager = AssistantManager()
+        manager.memory_store = MemoryStore()
+        manager.models['echo'] = EchoLLM(responses=[''], delay=0)
+        manager.add_assistant(self.assistant, model_name='echo')
+        return manager
+
+    @override_settings(AGENT_MEMORY_PERSIST=True)
+    def test_malformed_line_and_no_persistence(self):
+        input_path = os.path.join(self.directory.name, 'input.jsonl')
+        output_path = os.path.join(self.directory.name, 'output.jsonl')
+        with open(input_path, 'w', encoding='utf-8') as f:
+            f.write('{"id": "a", "text": "你好"}\n{"id": "b", "text": \n["不是对象"]\n{"id": "c", "text": "再见"}\n')
+
+        with mock.patch('agent.management.commands.run_assistant_batch.initialize', side_effect=self.build_manager), \
+                mock.patch('agent.manager.save_turns') as save_turns:
+            call_command('run_assistant_batch', assistant='companion', model='echo', input=input_path,
+                         output=output_path, concurrency=2, stdout=mock.Mock(), stderr=mock.Mock())
+
+        with open(output_path, encoding='utf-8') as f:
+            records = {record['id']: record for record in map(json.loads, f)}
+        self.assertEqual(records['a']['status'], 'ok')
+        self.assertEqual(records['c']['status'], 'ok')
+        # 无法解析的行以 line:行号 为ID，不会与输入中的ID冲突
+        self.assertEqual(records['line:2']['status'], 'error')
+        self.assertEqual(records['line:3']['status'], 'error')
+        save_turns.assert_not_called()
+
+    def run_batch(self, lines, output_lines=(), **options):
+        input_path = os.path.join(self.directory.name, 'input.jsonl')
+        output_path = os.path.join(self.directory.name, 'output.jsonl')
+        with open(input_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(line, ensure_ascii=False) + '\n' for line in output_lines)
+        with mock.patch('agent.management.commands.run_assistant_batch.initialize', side_effect=self.build_manager):
+            call_command('run_assistant_batch', assistant='companion', model='echo', input=input_path,
+                         output=output_path, stdout=mock.Mock(), stderr=mock.Mock(), **options)
+        with open(output_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_limit_counts_processed_items(self):
+        records = self.run_batch(
+            [{'id': 'a', 'text': '1'}, {'id': 'b', 'text': '2'}, {'id': 'c', 'text': '3'}, {'id': 'd', 'text': '4'}],
+            output_lines=[{'id': 'a', 'status': 'ok'}, {'id': 'b', 'status': 'ok'}],
+            limit=1,
+        )
+        self.assertEqual([record['id'] for record in records], ['a', 'b', 'c'])
+
+    def test_rules_records_are_synced(self):
+        extractor = mock.Mock()
+        extractor.extract_batch.side_effect = lambda texts: [{'amount': 35} if '35' in text else None
+                                                              for text in texts]
+        with mock.patch('agent.management.commands.run_assistant_batch.get_bookkeeping_extractor',
+                        return_value=extractor), \
+                mock.patch('agent.management.commands.run_assistant_batch.os.fsync') as fsync:
+            records = self.run_batch([{'id': 'a', 'text': '午饭 35'}, {'id': 'b', 'text': '你好'}], pre_parse=True)
+        records = {record['id']: record for record in records}
+        self.assertEqual((records['a']['source'], records['a']['content']), ('rules', {'amount': 35}))
+        self.assertNotIn('source', records['b'])
+        # 规则提取的结果与模型结果一样经 write_results 落盘
+        self.assertEqual(fsync.call_count, 2)
+
+
+class BookkeepingExtractorTest(SimpleTestCase):
+    """规则只处理可以可靠提取的输入，其余交给大模型"""
+
+    def setUp(self):
+        self.extractor = BookkeepingExtractor()
+
+    def test_parsed(self):
+        for text, kind, amount, category in [
+            ('今天花了20吃早餐', 'expense', 20, '餐饮'),
+            ('打车花了35块', 'expense', 35, '交通'),
+            ('两块五买了包子', 'expense', 2.5, '餐饮'),
+            ('收到工资8000', 'income', 8000, '工资'),
+        ]:
+            with self.subTest(text=text):
+                [transaction] = self.extractor.extract(text)['transactions']
+                self.assertEqual((transaction['type'], transaction['amount'], transaction['category']),
+                                 (kind, amount, category))
+
+    def test_falls_back_to_llm(self):
+        for text in [
+            '早餐20 午饭30',  # 同一短句中有多个金额
+            '今天没花钱吃早餐20',  # 否定
+            '吃早餐花了20吗',  # 提问
+            '借了朋友100',  # 借还
+            '买了衣服和零食花了50',  # 命中多个分类
+            '付了50',  # 没有分类线索
+            '',
+        ]:
+            with self.subTest(text=text):
+                self.assertIsNone(self.extractor.extract(text))
+
+
+@override_settings(AGENT_BOOKKEEPING_FAST_PATH=True, AGENT_BOOKKEEPING_ASSISTANTS=['financial_analyst'],
+                   AGENT_FAST_PATH_LANGUAGES=['zh'])
+class BookkeepingFastPathTest(TestCase):
+    """规则提取成功时直接返回 {"content": 结果}；自定义模板、其他语言或开启记忆的助手调用大模型"""
+
+    def setUp(self):
+        Engines.objects.create(name='qwen-max')
+        self.assistant = AssistantModel.objects.create(name='financial_analyst', prompt_template='hi',
+                                                       is_memory=False)
+        patcher = mock.patch('agent.registry._registry', Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = mock.MagicMock()
+        self.manager.invoke.return_value = '{"transactions": []}'
+        self.manager.assistants['financial_analyst'].output_schema = None
+
+    def post(self, **overrides):
+        data = {'assistant_name': 'financial_analyst', 'model_name': 'qwen-max',
+                'users_input': '今天花了20吃早餐', 'language': 'zh', **overrides}
+        request = APIRequestFactory().post('/api/agent/', data, format='json')
+        request.remote_user = {'id': 1, 'is_premium': False}
+        with mock.patch('agent.views.initialize', return_value=self.manager) as initialize:
+            response = AgentViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']['content'], initialize.called
+
+    def test_rules_answer(self):
+        content, called_llm = self.post()
+        self.assertFalse(called_llm)
+        [transaction] = content['transactions']
+        self.assertEqual((transaction['amount'], transaction['category']), (20, '餐饮'))
+
+    def test_falls_back_to_llm(self):
+        self.assertEqual(self.post(users_input='早餐20 午饭30'), ({'transactions': []}, True))
+        self.assertTrue(self.post(language='en')[1])
+        self.assertTrue(self.post(user_template_id='3')[1])
+        self.manager.invoke.assert_called_with(user_id=1, assistant_name='financial_analyst',
+                                               user_input='今天花了20吃早餐', language='zh',
+                                               prompt_template=None, prompt_key=None)
+
+    def test_assistant_with_memory_uses_llm(self):
+        self.assistant.is_memory = True
+        self.assistant.save()
+        self.assertTrue(self.post()[1])
+
+
+EMOTION_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'emotion': {'enum': ['happy', 'sad', 'angry', 'anxious', 'tired', 'neutral']},
+        'confidence': {'type': 'number', 'minimum': 0, 'maximum': 1},
+    },
+    'required': ['emotion', 'confidence'],
+}
+
+
+class EmotionClassifierTest(SimpleTestCase):
+    """词典分类：明确的情绪给出高置信度，否定与混合的情绪不给出或只给出低置信度"""
+
+    def setUp(self):
+        self.classifier = EmotionClassifier()
+
+    def test_labels(self):
+        self.assertEqual(self.classifier.classify('今天太开心了，美滋滋'), ('happy', 1.0))
+        self.assertEqual(self.classifier.classify('好伤心，想哭'), ('sad', 1.0))
+        self.assertEqual(self.classifier.classify('我不开心'), (None, 0.0))
+        label, confidence = self.classifier.classify('开心又有点担心')
+        self.assertLess(confidence, 0.7)
+
+
+@override_settings(AGENT_EMOTION_FAST_PATH=True, AGENT_EMOTION_THRESHOLD=0.7, AGENT_FAST_PATH_LANGUAGES=['zh'])
+class EmotionFastPathTest(TestCase):
+    """置信度足够且结果符合 emotion 助手的输出结构时直接返回，否则调用大模型"""
+
+    def setUp(self):
+        Engines.objects.create(name='qwen-max')
+        self.assistant = AssistantModel.objects.create(name='emotion', prompt_template='hi', is_memory=False,
+                                                       output_schema=EMOTION_SCHEMA)
+        patcher = mock.patch('agent.registry._registry', Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = mock.MagicMock()
+        self.manager.invoke.return_value = '{"emotion": "neutral", "confidence": 0.5}'
+        self.manager.assistants['emotion'].output_schema = EMOTION_SCHEMA
+
+    def post(self, users_input, language='zh'):
+        data = {'assistant_name': 'emotion', 'model_name': 'qwen-max', 'users_input': users_input,
+                'language': language}
+        request = APIRequestFactory().post('/api/agent/emotion/', data, format='json')
+        request.remote_user = {'id': 1, 'is_premium': False}
+        with mock.patch('agent.views.initialize', return_value=self.manager) as initialize:
+            response = AgentViewSet.as_view({'post': 'emotion'})(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']['content'], initialize.called
+
+    def test_local_result(self):
+        self.assertEqual(self.post('今天太开心了，美滋滋'), ({'emotion': 'happy', 'confidence': 1.0}, False))
+        self.assertEqual(self.post('好伤心，想哭'), ({'emotion': 'sad', 'confidence': 1.0}, False))
+
+    def test_falls_back_to_llm(self):
+        llm = ({'emotion': 'neutral', 'confidence': 0.5}, True)
+        self.assertEqual(self.post('我不开心'), llm)
+        self.assertEqual(self.post('开心又有点担心'), llm)
+        self.assertEqual(self.post('今天太开心了，美滋滋', language='en'), llm)
+
+    def test_schema_mismatch_uses_llm(self):
+        self.assistant.output_schema = {'type': 'object', 'required': ['mood']}
+        self.assistant.save()
+        self.assertTrue(self.post('今天太开心了，美滋滋')[1])
+
+    def test_no_schema_uses_llm(self):
+        self.assistant.output_schema = None
+        self.assistant.save()
+        self.assertTrue(self.post('今天太开心了，美滋滋')[1])
+
+
+@override_settings(ENGINE_ROUTING=True)
+class EngineRoutingTest(TestCase):
+    """真实调用记录延迟，开启路由时选择候选模型中延迟最低的健康模型"""
+
+    def setUp(self):
+        self.health = EngineHealth(unhealthy_after=1, alpha=1.0)
+        patcher = mock.patch('engines.health._health', self.health)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        assistant = AssistantModel.objects.create(name='companion', prompt_template='hi', is_memory=False)
+        assistant.engines.set([Engines.objects.create(name='fast'), Engines.objects.create(name='slow')])
+        self.manager = AssistantManager()
+        self.manager.models['fast'] = EchoLLM(responses=[''], delay=0)
+        self.manager.models['slow'] = EchoLLM(responses=[''], delay=0.05)
+        self.manager.add_assistant(AssistantModel.objects.prefetch_related('engines').get(), model_name='slow')
+
+    def test_invoke_records_latency(self):
+        self.manager.invoke('companion', 'u1', '你好')
+        self.assertGreaterEqual(self.health.snapshot()['slow']['latency_ms'], 50)
+
+    def test_select_model(self):
+        # 还没有健康数据时使用请求指定的模型
+        self.assertEqual(self.manager.select_model('companion', 'slow'), 'slow')
+        for model_name in ('slow', 'fast'):
+            self.manager.use_model('companion', model_name)
+            self.manager.invoke('companion', 'u1', '你好')
+        self.assertEqual(self.manager.select_model('companion', 'slow'), 'fast')
+
+        self.health.record('fast', error='timeout')
+        self.assertEqual(self.manager.select_model('companion', 'fast'), 'slow')
+        with override_settings(ENGINE_ROUTING=False):
+            self.assertEqual(self.manager.select_model('companion', 'fast'), 'fast')
+
+
+class RegistryTest(TestCase):
+    """注册表缓存模型与助手配置，失效事件只让对应的记录重新查询"""
+
+    def setUp(self):
+        self.engine = Engines.objects.create(name='qwen-max')
+        self.assistant = AssistantModel.objects.create(name='companion', prompt_template='hi')
+        self.assistant.engines.add(self.engine)
+        self.registry = Registry()
+
+    def names(self):
+        engines, assistants = self.registry.snapshot()
+        return sorted(engine.name for engine in engines), sorted(assistant.name for assistant in assistants)
+
+    def test_snapshot_is_cached(self):
+        self.assertEqual(self.names(), (['qwen-max'], ['companion']))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), (['qwen-max'], ['companion']))
+        self.assertEqual(self.registry.assistant('companion').pk, self.assistant.pk)
+        self.assertIsNone(self.registry.assistant('missing'))
+
+    def test_invalidate_reloads_only_changed_rows(self):
+        self.names()
+        AssistantModel.objects.filter(pk=self.assistant.pk).update(name='renamed')
+        other = AssistantModel.objects.create(name='other')
+        # 没有事件时仍使用缓存
+        self.assertEqual(self.names()[1], ['companion'])
+
+        self.registry.invalidate(Event(ASSISTANT, self.assistant.pk, None))
+        with self.assertNumQueries(2):  # 重新查询变化的助手并预取可用模型
+            self.assertEqual(self.names()[1], ['renamed'])
+
+        self.registry.invalidate(Event(ASSISTANT, None, None))
+        self.assertEqual(self.names()[1], ['other', 'renamed'])
+
+        other.delete()
+        self.registry.invalidate(Event(ASSISTANT, other.pk, None))
+        self.assertEqual(self.names()[1], ['renamed'])
+
+    def test_up_to_date_version_is_skipped(self):
+        self.names()
+        self.registry.invalidate(Event(ASSISTANT, self.assistant.pk, instance_version(self.assistant)))
+        with self.assertNumQueries(0):
+            self.names()
+
+    def test_engine_change_drops_clients_and_assistants(self):
+        self.names()
+        engine = self.registry.engines[self.engine.pk]
+        client = self.registry.chat_model(engine, None, object)
+        self.assertIs(self.registry.chat_model(engine, None, object), client)
+
+        self.registry.invalidate(Event(ENGINE, self.engine.pk, None))
+        self.assertEqual(self.registry.clients, {})
+        self.assertEqual(self.registry.stale[ASSISTANT], {self.assistant.pk})
+
+    def test_ttl(self):
+        self.registry.ttl = -1  # 每次读取都已过期
+        self.names()
+        AssistantModel.objects.filter(pk=self.assistant.pk).update(name='renamed')
+        self.assertEqual(self.names()[1], ['renamed'])
+
+
+class HistorySerializationTest(SimpleTestCase):
+    """dumps/loads 在各压缩方式下往返不丢信息，兼容旧格式，数据与当前环境不匹配时明确报错"""
+
+    def make_history(self):
+        return CompactChatMessageHistory([
+            Turn(ROLE_HUMAN, '今天花了 35 元吃饭 🍜', ts=1700000000.5),
+            Turn(ROLE_AI, 'Noted — 已记账：餐饮 ¥35', tokens=7, ts=1700000001.25),
+            Turn(ROLE_HUMAN, '', ts=1700000002.0),
+        ], version=5, summary='用户在记账，偏好简短回复')
+
+    def assertSameHistory(self, loaded, expected):
+        self.assertEqual(loaded.summary, expected.summary)
+        self.assertEqual(
+            [(turn.role, turn.text, turn.tokens, turn.ts) for turn in loaded.turns],
+            [(turn.role, turn.text, turn.tokens, turn.ts) for turn in expected.turns],
+        )
+
+    def round_trip(self, history, **kwargs):
+        blob = history.dumps(**kwargs)
+        loaded = CompactChatMessageHistory.loads(blob)
+        self.assertSameHistory(loaded, history)
+        return blob
+
+    def test_zlib(self):
+        with mock.patch.object(history_module, 'zstandard', None):
+            for history in (self.make_history(), CompactChatMessageHistory()):
+                blob = self.round_trip(history)
+                self.assertEqual(blob[:1], history_module.CODEC_ZLIB)
+
+    @unittest.skipUnless(history_module.zstandard, '未安装 zstandard')
+    def test_zstd(self):
+        for history in (self.make_history(), CompactChatMessageHistory()):
+            blob = self.round_trip(history)
+            self.assertEqual(blob[:1], history_module.CODEC_ZSTD)
+
+    def test_zstd_codec_dispatch(self):
+        # 不依赖 zstandard 是否安装，用 zlib 模拟其压缩接口，检查写入与读取时按首字节选择压缩方式
+        fake = mock.Mock()
+        fake.ZstdCompressor.return_value.compress.side_effect = zlib.compress
+        fake.ZstdDecompressor.return_value.decompress.side_effect = zlib.decompress
+        with mock.patch.object(history_module, 'zstandard', fake):
+            blob = self.round_trip(self.make_history(), level=7)
+        self.assertEqual(blob[:1], history_module.CODEC_ZSTD)
+        fake.ZstdCompressor.assert_called_once_with(level=7)
+
+    def test_uncompressed(self):
+        blob = self.round_trip(self.make_history(), compress=False)
+        self.assertEqual(blob[:1], history_module.CODEC_NONE)
+
+    def test_codec_fallback(self):
+        history = self.make_history()
+        with mock.patch.object(history_module, 'zstandard', None):
+            blob = history.dumps()
+        # zlib 数据在安装了 zstandard 的环境中仍可读取
+        self.assertSameHistory(CompactChatMessageHistory.loads(blob), history)
+
+        zstd_blob = history_module.CODEC_ZSTD + b'\x28\xb5\x2f\xfd'
+        with mock.patch.object(history_module, 'zstandard', None), self.assertRaises(RuntimeError):
+            CompactChatMessageHistory.loads(zstd_blob)
+        with self.assertRaises(ValueError):
+            CompactChatMessageHistory.loads(b'\x09' + history.pack())
+
+    def test_version(self):
+        history = self.make_history()
+        # version 对应共享存储中的行版本，不写入序列化数据，由读取方设置
+        self.assertEqual(CompactChatMessageHistory.loads(history.dumps()).version, 0)
+
+        # 格式版本 1 没有摘要字段
+        parts = [history_module.HEADER_V1.pack(1, len(history.turns))]
+        for turn in history.turns:
+            text = turn.text.encode('utf-8')
+            parts += [history_module.TURN_HEADER.pack(turn.role, turn.tokens, turn.ts, len(text)), text]
+        loaded = CompactChatMessageHistory.loads(history_module.CODEC_NONE + b''.join(parts))
+        history.summary = ''
+        self.assertSameHistory(loaded, history)
+
+        with self.assertRaises(ValueError):
+            CompactChatMessageHistory.unpack(b'\x03' + history.pack()[1:])
+
+
+class CompactionTest(TestCase):
+    """压缩期间其他请求写入新的对话时，新对话不丢失；其他压缩任务已更新摘要时不覆盖"""
+
+    def setUp(self):
+        turns = [Turn(ROLE_HUMAN if i % 2 == 0 else ROLE_AI, f't{i}', ts=1000 + i) for i in range(8)]
+        save_turns('u1', 'ns', CompactChatMessageHistory(), turns, 100)
+
+    def conversation(self):
+        return Conversation.objects.get(user_id='u1', namespace='ns')
+
+    def stored(self):
+        return CompactChatMessageHistory.loads(bytes(self.conversation().data))
+
+    def write_turns(self, *texts):
+        # 模拟其他进程的请求：追加一轮对话，version 加 1
+        turns = [Turn(ROLE_HUMAN if i % 2 == 0 else ROLE_AI, text, ts=2000 + i) for i, text in enumerate(texts)]
+        save_turns('u1', 'ns', CompactChatMessageHistory(), turns, 100)
+
+    def llm(self, summary, during=None):
+        def invoke(prompt):
+            if during:
+                during()
+            return summary
+        return mock.Mock(invoke=mock.Mock(side_effect=invoke))
+
+    def test_write_during_summarize(self):
+        llm = self.llm('摘要', during=lambda: self.write_turns('n0', 'n1'))
+        self.assertEqual(compact_conversation(self.conversation(), llm, keep=4, max_chars=100), 4)
+
+        stored = self.stored()
+        self.assertEqual(stored.summary, '摘要')
+        self.assertEqual([turn.text for turn in stored.turns], ['t4', 't5', 't6', 't7', 'n0', 'n1'])
+        self.assertEqual(self.conversation().version, 3)
+        self.assertEqual(self.conversation().message_count, 6)
+
+    def test_write_between_read_and_update(self):
+        original_loads = CompactChatMessageHistory.loads
+        calls = []
+
+        def loads_with_concurrent_write(blob):
+            calls.append(blob)
+            # 第二次读取是写入前读取最新数据，此时另一个请求抢先写入
+            if len(calls) == 2:
+                self.write_turns('n0', 'n1')
+            return original_loads(blob)
+
+        conversation = self.conversation()
+        with mock.patch.object(CompactChatMessageHistory, 'loads', side_effect=loads_with_concurrent_write):
+            self.assertEqual(compact_conversation(conversation, self.llm('摘要'), keep=4, max_chars=100), 4)
+        stored = self.stored()
+        self.assertEqual([turn.text for turn in stored.turns], ['t4', 't5', 't6', 't7', 'n0', 'n1'])
+        self.assertEqual(stored.summary, '摘要')
+
+    def test_concurrent_compaction_wins(self):
+        def other_compaction():
+            compact_conversation(self.conversation(), self.llm('较早完成的摘要'), keep=2, max_chars=100)
+            self.write_turns('n0', 'n1')
+
+        llm = self.llm('较晚完成的摘要', during=other_compaction)
+        self.assertEqual(compact_conversation(self.conversation(), llm, keep=4, max_chars=100), 0)
+        stored = self.stored()
+        self.assertEqual(stored.summary, '较早完成的摘要')
+        self.assertEqual([turn.text for turn in stored.turns], ['t6', 't7', 'n0', 'n1'])
+
+    def test_gives_up_after_conflicts(self):
+        original_loads = CompactChatMessageHistory.loads
+        calls = []
+
+        def loads_with_concurrent_write(blob):
+            calls.append(blob)
+            # 第一次读取用于生成摘要，之后每次写入前都有新的对话抢先写入
+            if len(calls) > 1:
+                with mock.patch.object(CompactChatMessageHistory, 'loads', original_loads):
+                    self.write_turns(f'n{len(calls)}')
+            return original_loads(blob)
+
+        conversation = self.conversation()
+        with mock.patch.object(CompactChatMessageHistory, 'loads', side_effect=loads_with_concurrent_write), \
+                self.assertLogs('agent.compaction', 'WARNING'):
+            compacted = compact_conversation(conversation, self.llm('摘要'), keep=4, max_chars=100, max_attempts=2)
+        self.assertEqual(compacted, 0)
+        stored = self.stored()
+        self.assertEqual(stored.summary, '')
+        self.assertEqual([turn.text for turn in stored.turns[8:]], ['n2', 'n3'])
+
+    @override_settings(AGENT_MEMORY_PERSIST=True)
+    def test_command(self):
+        with mock.patch('agent.management.commands.compact_conversations.build_summary_llm',
+                        return_value=self.llm('摘要')):
+            call_command('compact_conversations', '--keep', '2', '--min-aging', '4', stdout=mock.Mock())
+        stored = self.stored()
+        self.assertEqual((stored.summary, [turn.text for turn in stored.turns]), ('摘要', ['t6', 't7']))
+
+
+class ClientOverridesTest(TestCase):
+    """助手覆盖的 max_tokens/超时/重试在客户端上生效，不同覆盖使用不同的客户端，相同覆盖共用一个"""
+
+    def setUp(self):
+        self.engine = Engines.objects.create(name='qwen-max', api_key='sk-test', base_url='http://llm.test/v1',
+                                             max_tokens=1000, request_timeout=30, max_retries=2)
+        self.short = AssistantModel.objects.create(name='short', prompt_template='hi', max_tokens=100,
+                                                   request_timeout=5)
+        self.same = AssistantModel.objects.create(name='same', prompt_template='hi', max_tokens=100,
+                                                  request_timeout=5)
+        self.no_retry = AssistantModel.objects.create(name='no-retry', prompt_template='hi', max_retries=0)
+        self.plain = AssistantModel.objects.create(name='plain', prompt_template='hi')
+
+    def build_manager(self, registry=None):
+        manager = AssistantManager()
+        manager.registry = registry
+        engines = registry.snapshot()[0] if registry else [self.engine]
+        manager.add_model(engines[0])
+        for assistant in (self.short, self.same, self.no_retry, self.plain):
+            manager.add_assistant(assistant, model_name='qwen-max')
+        return manager
+
+    def model(self, manager, name):
+        return manager.assistants[name].model
+
+    def test_client_overrides(self):
+        self.assertEqual(self.short.client_overrides(), {'max_tokens': 100, 'request_timeout': 5})
+        self.assertEqual(self.no_retry.client_overrides(), {'max_retries': 0})
+        self.assertEqual(self.plain.client_overrides(), {})
+
+    def test_overrides_reach_client(self):
+        manager = self.build_manager()
+        short = self.model(manager, 'short')
+        self.assertEqual((short.max_tokens, short.request_timeout, short.max_retries), (100, 5, 2))
+        no_retry = self.model(manager, 'no-retry')
+        self.assertEqual((no_retry.max_tokens, no_retry.request_timeout, no_retry.max_retries), (1000, 30, 0))
+        self.assertIs(self.model(manager, 'plain'), manager.models['qwen-max'])
+        self.assertEqual(manager.models['qwen-max'].max_tokens, 1000)
+
+        self.assertIsNot(short, no_retry)
+        self.assertIs(self.model(manager, 'same'), short)
+
+    def test_registry_caches_clients_per_overrides(self):
+        registry = Registry()
+        with mock.patch('agent.manager.build_chat_model', side_effect=lambda options: mock.Mock(options=options)) \
+                as build:
+            first = self.build_manager(registry)
+            second = self.build_manager(registry)
+        # 引擎默认客户端、两组不同的覆盖各创建一次，第二个管理器全部复用
+        self.assertEqual(build.call_count, 3)
+        for name in ('short', 'same', 'no-retry', 'plain'):
+            self.assertIs(self.model(second, name), self.model(first, name))
+        self.assertIsNot(self.model(first, 'short'), self.model(first, 'no-retry'))
+        self.assertEqual(self.model(first, 'short').options['max_tokens'], 100)
+        self.assertEqual(len(registry.clients), 3)
+
+        registry.invalidate(Event(ENGINE, self.engine.pk, None))
+        self.assertEqual(registry.clients, {})
+
+    def test_stop_validation(self):
+        for stop in (None, [], ['\n\n', '用户：']):
+            AssistantModel(name='a', stop=stop).clean()
+        for stop in ('\n', ['ok', 1], {'a': 'b'}):
+            with self.assertRaises(ValidationError):
+                AssistantModel(name='a', stop=stop).clean()
+
+    def test_stop_overrides_engine(self):
+        self.engine.stop = ['END']
+        self.engine.save()
+        manager = self.build_manager()
+        self.assertEqual(manager.assistants['plain'].stop, ['END'])
+        self.short.stop = ['用户：']
+        manager.add_assistant(self.short, model_name='qwen-max')
+        self.assertEqual(manager.assistants['short'].stop, ['用户：'])
+
+
+class MetricsThrottleTest(SimpleTestCase):
+    """指标接口不受调用限额约束，对话接口仍然限流"""
+
+    def test_metrics_not_throttled(self):
+        factory = APIRequestFactory()
+        with mock.patch.object(UserRateThrottle, 'allow_request', return_value=False), \
+                mock.patch.object(UserRateThrottle, 'wait', return_value=60):
+            request = factory.get('/api/agent/metrics/')
+            request.remote_user = {'id': 1, 'is_premium': False}
+            response = AgentViewSet.as_view({'get': 'metrics'}, **AgentViewSet.metrics.kwargs)(request)
+            self.assertEqual(response.status_code, 200)
+
+            request = factory.post('/api/agent/', {'assistant_name': 'companion'}, format='json')
+            request.remote_user = {'id': 1, 'is_premium': False}
+            self.assertEqual(AgentViewSet.as_view({'post': 'create'})(request).status_code, 429)
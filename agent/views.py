@@ -1,27 +1,119 @@
-import json
+import time
 
+from django.conf import settings
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
 
+from utils.idempotency import idempotent
+from utils.json_output import parse_json_output, schema_errors
 from utils.permissions import IsAuthenticatedExternal
+from utils.throttling import AssistantRateThrottle, RateLimitHeadersMixin, UserRateThrottle
 from .serializers import AgentInputSerializer
 from agent.manager import initialize
+from agent.registry import get_registry
+from agent import metrics
+from agent.bookkeeping import get_bookkeeping_extractor, is_bookkeeping_assistant
+from agent.emotion import classify_locally
 from utils.mixins import *
 from rest_framework.viewsets import GenericViewSet
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 
-class AgentViewSet(CreateModelMixin,
+class AgentViewSet(RateLimitHeadersMixin,
+                   CreateModelMixin,
                    GenericViewSet):
 
     permission_classes = [IsAuthenticatedExternal]
+    throttle_classes = [UserRateThrottle, AssistantRateThrottle]
+
+    def content_response(self, response_content, output_schema=None):
+        """
+        解析模型输出：整段为 JSON（可带代码块）时返回解析结果，否则返回原始内容
+        设置了输出结构时容忍前后说明文字与被截断的 JSON 并按其校验，校验不通过时在 schema_errors 中给出错误
+        """
+        if not response_content:  # 处理空响应
+            content, errors = {}, []
+        else:
+            content, errors = parse_json_output(response_content, output_schema)
+            if content is None:
+                # 不是 JSON，返回原始内容
+                content = response_content
+        data = {"content": content}
+        if errors:
+            data["schema_errors"] = errors
+        return Response({
+            "status": "success",
+            "message": "请求已接收",
+            "data": data
+        })
+
+    def fast_path_assistant(self, assistant_name, language, custom_template=False):
+        """
+        规则/词典快速路径只在结果与调用大模型等价时使用，满足条件时返回助手配置，否则返回 None：
+        - 使用了自定义模板（指定 user_template_id 或用户有默认模板）时，模板中的要求规则无法体现
+        - 输出语言不在 AGENT_FAST_PATH_LANGUAGES 中
+        - 助手开启了记忆：快速路径不写入记忆，交给大模型以免之后的对话缺少这一轮
+        """
+        if custom_template:
+            return None
+        languages = getattr(settings, 'AGENT_FAST_PATH_LANGUAGES', ())
+        if (language or '').strip().lower() not in {name.lower() for name in languages}:
+            return None
+        assistant = get_registry().assistant(assistant_name)
+        if assistant is None or assistant.is_memory:
+            return None
+        return assistant
+
+    def classify_locally(self, assistant_name, users_input, language):
+        """
+        本地情绪分类，返回 {"emotion", "confidence"}；无法使用快速路径（见 fast_path_assistant）、置信度不足、
+        助手没有输出结构或结果不符合输出结构时返回 None，由大模型处理
+        """
+        local = classify_locally(users_input) if assistant_name == 'emotion' else None
+        if local is None:
+            return None
+        assistant = self.fast_path_assistant(assistant_name, language)
+        if assistant is None or not assistant.output_schema:
+            return None
+        label, confidence = local
+        content = {"emotion": label, "confidence": confidence}
+        if schema_errors(content, assistant.output_schema):
+            metrics.incr('emotion.schema_mismatch')
+            return None
+        return content
+
+    def get_user_prompt(self, user_id, user_template_id, is_premium):
+        """返回用户的自定义提示词 (提示词, 提示词ID)，没有时均为 None"""
+        try:
+            from assistant.models import UsersAssistantTemplates
+            user_templates = UsersAssistantTemplates.objects.select_related('prompt')
+            if user_template_id and is_premium:
+                user_template = user_templates.get(user_id=user_id, id=user_template_id, is_premium_template=True)
+            elif user_template_id and not is_premium:
+                user_template = user_templates.get(user_id=user_id, id=user_template_id, is_premium_template=False)
+            else:
+                user_template = user_templates.get(user_id=user_id, is_default=True)
+            return user_template.prompt_template, user_template.prompt_id
+        except:
+            return None, None  # 如果出错，使用默认模板
+
+    def get_throttles(self):
+        # emotion 接口的 assistant_name 可省略，默认使用 emotion 助手
+        self.default_assistant_name = 'emotion' if self.action == 'emotion' else None
+        return super().get_throttles()
 
     @swagger_auto_schema(
         operation_summary="发送聊天请求",
         operation_description="向指定的助手发送聊天请求，并获取响应",
         request_body=AgentInputSerializer,
+        manual_parameters=[
+            openapi.Parameter(
+                'Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING, required=False,
+                description="幂等键：客户端重试时携带相同的值，同一请求只调用一次模型、只写入一次记忆，重复的请求重放第一次的响应"
+            )
+        ],
         responses={
             200: openapi.Response(
                 description="成功响应",
@@ -33,7 +125,11 @@ class AgentViewSet(CreateModelMixin,
                         'data': openapi.Schema(
                             type=openapi.TYPE_OBJECT,
                             properties={
-                                'content': openapi.Schema(type=openapi.TYPE_OBJECT, description="响应内容")
+                                'content': openapi.Schema(type=openapi.TYPE_OBJECT, description="响应内容"),
+                                'schema_errors': openapi.Schema(
+                                    type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING),
+                                    description="输出不符合助手输出结构时的错误信息"
+                                )
                             }
                         )
                     }
@@ -41,6 +137,7 @@ class AgentViewSet(CreateModelMixin,
             )
         }
     )
+    @idempotent('chat')
     def create(self, request, *args, **kwargs):
         serializer = AgentInputSerializer(data=request.data)
         if not serializer.is_valid():
@@ -56,61 +153,37 @@ class AgentViewSet(CreateModelMixin,
         user_template_id = validated_data.get("user_template_id", None)
         is_premium = request.remote_user.get('is_premium')
 
+        custom_prompt, prompt_key = self.get_user_prompt(user_id, user_template_id, is_premium)
+
+        # 记账助手：简单的输入由规则提取，只有规则无法可靠处理的输入才调用大模型
+        # 使用自定义模板、输出语言不是中文或助手开启了记忆时不使用规则提取（见 fast_path_assistant）
+        custom_template = bool(user_template_id or custom_prompt)
+        if is_bookkeeping_assistant(assistant_name) and self.fast_path_assistant(assistant_name, language,
+                                                                                 custom_template):
+            parsed = get_bookkeeping_extractor().extract(users_input)
+            metrics.incr('bookkeeping.local' if parsed is not None else 'bookkeeping.llm')
+            if parsed is not None:
+                return Response({
+                    "status": "success",
+                    "message": "请求已接收",
+                    "data": {
+                        "content": parsed
+                    }
+                })
+
         manager = initialize()
-        manager.assistants[assistant_name].set_model(manager.models[model_name])
+        manager.use_model(assistant_name, manager.select_model(assistant_name, model_name))
 
-        custom_prompt = None
-        try:
-            from assistant.models import UsersAssistantTemplates
-            if user_template_id and is_premium:
-                user_template = UsersAssistantTemplates.objects.get(user_id=user_id, id=user_template_id, is_premium_template=True)
-                custom_prompt = user_template.prompt_template
-            elif user_template_id and not is_premium:
-                user_template = UsersAssistantTemplates.objects.get(user_id=user_id, id=user_template_id, is_premium_template=False)
-                custom_prompt = user_template.prompt_template
-            else:
-                user_template = UsersAssistantTemplates.objects.get(user_id=user_id, is_default=True)
-                custom_prompt = user_template.prompt_template
-        except:
-            pass  # 如果出错，使用默认模板
-        
         # 获取响应内容
         response_content = manager.invoke(user_id=user_id,
                                           assistant_name=assistant_name,
                                           user_input=users_input,
                                           language=language,
-                                          prompt_template=custom_prompt)
+                                          prompt_template=custom_prompt,
+                                          prompt_key=prompt_key)
 
         # 处理响应内容
-        if response_content:  # 确保响应内容不为空
-            try:
-                # 尝试解析JSON
-                parsed_content = json.loads(response_content)
-                return Response({
-                    "status": "success",
-                    "message": "请求已接收",
-                    "data": {
-                        "content": parsed_content
-                    }
-                })
-            except json.JSONDecodeError:
-                # 如果不是有效的JSON，返回原始内容
-                return Response({
-                    "status": "success",
-                    "message": "请求已接收",
-                    "data": {
-                        "content": response_content
-                    }
-                })
-        else:
-            # 处理空响应
-            return Response({
-                "status": "success",
-                "message": "请求已接收",
-                "data": {
-                    "content": {}
-                }
-            })
+        return self.content_response(response_content, manager.assistants[assistant_name].output_schema)
 
     @action(detail=False, methods=['post'])
     def emotion(self, request):
@@ -126,42 +199,49 @@ class AgentViewSet(CreateModelMixin,
         users_input = validated_data.get("users_input")
         language = validated_data.get("language")
 
+        # 本地快速分类：置信度足够高、且结果符合助手的输出结构时直接返回，不调用大模型
+        started = time.perf_counter()
+        content = self.classify_locally(assistant_name, users_input, language)
+        if content is not None:
+            metrics.incr('emotion.local')
+            metrics.incr('emotion.local_ms', (time.perf_counter() - started) * 1000)
+            return Response({
+                "status": "success",
+                "message": "请求已接收",
+                "data": {
+                    "content": content
+                }
+            })
+
         manager = initialize()
-        manager.assistants[assistant_name].set_model(manager.models[model_name])
+        manager.use_model(assistant_name, manager.select_model(assistant_name, model_name))
 
         # 获取响应内容
         response_content = manager.invoke(user_id=user_id,
                                           assistant_name=assistant_name,
                                           user_input=users_input,
                                           language=language)
+        metrics.incr('emotion.llm')
+        metrics.incr('emotion.llm_ms', (time.perf_counter() - started) * 1000)
 
+        return self.content_response(response_content, manager.assistants[assistant_name].output_schema)
 
-        if response_content:  # 确保响应内容不为空
-            try:
-                # 尝试解析JSON
-                parsed_content = json.loads(response_content)
-                return Response({
-                    "status": "success",
-                    "message": "请求已接收",
-                    "data": {
-                        "content": parsed_content
-                    }
-                })
-            except json.JSONDecodeError:
-                # 如果不是有效的JSON，返回原始内容
-                return Response({
-                    "status": "success",
-                    "message": "请求已接收",
-                    "data": {
-                        "content": response_content
-                    }
-                })
-        else:
-            # 处理空响应
-            return Response({
-                "status": "success",
-                "message": "请求已接收",
-                "data": {
-                    "content": {}
-                }
-            })
\ No newline at end of file
+    @swagger_auto_schema(
+        operation_summary="对话指标",
+        operation_description="当前进程的调用计数，按助手隔离记忆后带入提示词的历史字符数与共用记忆时的对比，以及 emotion 接口由本地分类处理的比例"
+    )
+    @action(detail=False, methods=['get'], throttle_classes=[])  # 监控读取指标不占用调用限额
+    def metrics(self, request):
+        counters = metrics.snapshot()
+        scoped = counters.get('prompt.history_chars', 0)
+        shared = counters.get('prompt.history_chars_if_shared', 0)
+        emotion_calls = counters.get('emotion.local', 0) + counters.get('emotion.llm', 0)
+        return Response({
+            "status": "success",
+            "message": "请求已接收",
+            "data": {
+                "counters": counters,
+                "history_reduction": round(1 - scoped / shared, 4) if shared else 0,
+                "emotion_local_share": round(counters.get('emotion.local', 0) / emotion_calls, 4) if emotion_calls else 0,
+            }
+        })
@@ -1,5 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
 from .models import Assistant, AssistantTemplates, AssistantsConfigs, UsersAssistantTemplates
+from .propagation import propagate_template_in_background
+from .templating import compile_template
 
 @admin.register(Assistant)
 class AssistantAdmin(admin.ModelAdmin):
@@ -7,12 +10,23 @@ class AssistantAdmin(admin.ModelAdmin):
     list_filter = ('is_active', 'is_memory', 'created_at', 'updated_at')
     search_fields = ('name', 'description', 'prompt_template')
     readonly_fields = ('created_at', 'updated_at')
+    filter_horizontal = ('engines',)
     fieldsets = (
         ('基本信息', {
             'fields': ('name', 'description')
         }),
         ('助手配置', {
-            'fields': ('is_active', 'is_memory', 'prompt_template')
+            'fields': ('is_active', 'is_memory', 'memory_namespace', 'prompt_template', 'output_schema')
+        }),
+        ('模型路由', {
+            'description': '选择多个模型并开启 ENGINE_ROUTING 时，按健康探测的延迟选择模型',
+            'fields': ('engines',),
+            'classes': ('collapse',)
+        }),
+        ('生成限制', {
+            'description': '留空时使用所选模型的设置',
+            'fields': ('max_tokens', 'request_timeout', 'max_retries', 'stop'),
+            'classes': ('collapse',)
         }),
         ('时间信息', {
             'fields': ('created_at', 'updated_at'),
@@ -27,6 +41,7 @@ class AssistantTemplatesAdmin(admin.ModelAdmin):
     list_filter = ('is_default', 'created_at', 'updated_at')
     search_fields = ('name', 'prompt_template')
     readonly_fields = ('created_at', 'updated_at')
+    actions = ['propagate_to_user_templates']
     fieldsets = (
         ('基本信息', {
             'fields': ('name', 'is_default')
@@ -41,6 +56,25 @@ class AssistantTemplatesAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # 未知占位符已在 clean() 中拦截，缺少的占位符只做提醒
+        missing = compile_template(obj.prompt_template).missing_placeholders
+        if missing:
+            names = ', '.join(f'{{{name}}}' for name in sorted(missing))
+            self.message_user(request, f'模板未使用以下占位符: {names}', level=messages.WARNING)
+
+        # 模板内容变更后，在后台把修改同步到由它生成的用户模板
+        if change and 'prompt_template' in form.changed_data:
+            transaction.on_commit(lambda: propagate_template_in_background(obj.pk))
+            self.message_user(request, '已在后台开始同步由该模板生成的用户模板')
+
+    @admin.action(description='同步到由这些模板生成的用户模板')
+    def propagate_to_user_templates(self, request, queryset):
+        for template in queryset:
+            propagate_template_in_background(template.pk)
+        self.message_user(request, f'已在后台开始同步 {queryset.count()} 个模板')
+
 
 @admin.register(AssistantsConfigs)
 class AssistantsConfigsAdmin(admin.ModelAdmin):
@@ -61,8 +95,8 @@ class AssistantsConfigsAdmin(admin.ModelAdmin):
 class UsersAssistantTemplatesAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'user_id', 'is_default', 'created_at', 'updated_at')
     list_filter = ('is_default', 'created_at', 'updated_at')
-    search_fields = ('name', 'user_id', 'prompt_template')
-    readonly_fields = ('created_at', 'updated_at', 'prompt_template')
+    search_fields = ('name', 'user_id', 'prompt__content')
+    readonly_fields = ('created_at', 'updated_at', 'prompt_template', 'template', 'config', 'template_version')
     fieldsets = (
         ('基本信息', {
             'fields': ('name', 'user_id', 'is_default')
@@ -71,6 +105,9 @@ class UsersAssistantTemplatesAdmin(admin.ModelAdmin):
             'fields': ('prompt_template',),
             'description': '此字段由系统自动生成，不可手动编辑'
         }),
+        ('来源', {
+            'fields': ('template', 'config', 'template_version'),
+        }),
         ('时间信息', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -4,3 +4,24 @@ from django.apps import AppConfig
 class AssistantConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'assistant'
+
+    def ready(self):
+        # 注册公共配置缓存的失效信号
+        from . import public_configs
+        # 全文检索触发器的系统检查
+        from . import checks  # noqa: F401
+
+        # 迁移可能增删全文索引，清空索引是否存在的缓存
+        from django.db.models.signals import post_migrate
+        from utils.search import FullTextSearchFilter
+        post_migrate.connect(FullTextSearchFilter.clear_index_cache, dispatch_uid='clear_fulltext_index_cache')
+
+        # 助手与模板被修改时广播失效事件，各工作进程移除对应的缓存
+        from utils.invalidation import get_bus, model_label, track
+        from .models import Assistant, AssistantTemplates, AssistantsConfigs
+        from .templating import evict_template
+        track(Assistant)
+        track(AssistantTemplates)
+        get_bus().subscribe(model_label(AssistantTemplates), lambda event: evict_template(event.pk))
+        # 公共配置只在相关的修改后广播（见 public_configs 中的信号），不对每个私有配置的修改都广播
+        get_bus().subscribe(model_label(AssistantsConfigs), public_configs.invalidate)
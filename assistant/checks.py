@@ -0,0 +1,37 @@
+from importlib import import_module
+
+from django.core import checks
+from django.db import connections
+
+FULLTEXT_INDEXES = import_module('assistant.migrations.0003_fulltext_search').FULLTEXT_INDEXES
+
+
+@checks.register(checks.Tags.database)
+def check_fulltext_triggers(app_configs, databases=None, **kwargs):
+    """
+    SQLite 上的全文索引依赖 0003 迁移中用原生 SQL 创建的触发器同步
+    之后重建表的迁移（如 AlterField）会静默丢弃触发器，索引不再随数据更新，这里检查触发器是否齐全
+    """
+    errors = []
+    for alias in databases or ():
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+            names = {row[0] for row in cursor.fetchall()}
+        for table in FULLTEXT_INDEXES:
+            fts = f'{table}_fts'
+            if fts not in names:
+                # 尚未执行 0003 迁移，FullTextSearchFilter 会回退到 LIKE 查询
+                continue
+            missing = [f'{fts}_{suffix}' for suffix in ('ai', 'ad', 'au') if f'{fts}_{suffix}' not in names]
+            if missing:
+                errors.append(checks.Error(
+                    f'{table} 的全文索引缺少触发器: {", ".join(missing)}，搜索结果不会随数据更新',
+                    hint='表被迁移重建后需要重新创建触发器并重建索引，'
+                         '见 assistant/migrations/0003_fulltext_search.py 中的 sqlite_forward',
+                    obj=alias,
+                    id='assistant.E001',
+                ))
+    return errors
@@ -44,11 +44,20 @@ FREE_NICKNAME_OPTIONS = ["Friend", "Mate", "Dude"]
 # 免费性格选项
 FREE_PERSONALITY_OPTIONS = ["Cheerful", "Cute"]
 
+# 各字段的免费选项与全部预设选项，使用 frozenset 保证 O(1) 的成员判断
+FREE_OPTION_SETS = {
+    'relationship': frozenset(RELATIONSHIP_OPTIONS['free']),
+    'nickname': frozenset(NICKNAME_OPTIONS['free']),
+    'personality': frozenset(PERSONALITY_OPTIONS['free']),
+}
+
+ALL_OPTION_SETS = {
+    'relationship': frozenset(RELATIONSHIP_OPTIONS['free'] + RELATIONSHIP_OPTIONS['premium']),
+    'nickname': frozenset(NICKNAME_OPTIONS['free'] + NICKNAME_OPTIONS['premium']),
+    'personality': frozenset(PERSONALITY_OPTIONS['free'] + PERSONALITY_OPTIONS['premium']),
+}
+
 # 判断是否是自定义值
 def is_custom_value(field, value):
-    all_options = RELATIONSHIP_OPTIONS if field == 'relationship' else \
-                 NICKNAME_OPTIONS if field == 'nickname' else \
-                 PERSONALITY_OPTIONS
-    
-    all_values = all_options['free'] + all_options['premium']
-    return value not in all_values 
\ No newline at end of file
+    all_values = ALL_OPTION_SETS.get(field, ALL_OPTION_SETS['personality'])
+    return value not in all_values
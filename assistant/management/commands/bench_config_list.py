@@ -0,0 +1,111 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from assistant import public_configs
+from assistant.constants import NICKNAME_OPTIONS, PERSONALITY_OPTIONS, RELATIONSHIP_OPTIONS
+from assistant.models import AssistantsConfigs
+from assistant.views import AssistantsConfigsViewSet
+
+BENCH_USER_ID = -1  # 测试数据使用的用户ID，不会与真实用户冲突
+
+
+class Rollback(Exception):
+    pass
+
+
+def random_config(rng, user_id, is_public):
+    options = (RELATIONSHIP_OPTIONS, NICKNAME_OPTIONS, PERSONALITY_OPTIONS)
+    # 大约一半的配置只使用免费选项
+    tier = 'free' if rng.random() < 0.5 else 'premium'
+    relationship, nickname, personality = (rng.choice(option[tier]) for option in options)
+    return AssistantsConfigs(
+        name=f'bench-{rng.randrange(10 ** 6)}', user_id=user_id, is_public=is_public,
+        relationship=relationship, nickname=nickname, personality=personality,
+    )
+
+
+class Command(BaseCommand):
+    help = "对比配置列表接口在数据库 OR 查询与内存归并公共配置两种方式下的耗时（测试数据在事务中写入并回滚）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--public', type=int, default=2000, help="公共配置数量")
+        parser.add_argument('--own', type=int, default=50, help="测试用户自己的配置数量")
+        parser.add_argument('--others', type=int, default=20000, help="其他用户的私有配置数量")
+        parser.add_argument('--iterations', type=int, default=200, help="每项测试的重复次数")
+        parser.add_argument('--page-size', type=int, default=50, help="每页条目数")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations 必须大于 0")
+
+        try:
+            with transaction.atomic():
+                self.seed(options)
+                # 写入在事务中，on_commit 不会触发，这里直接失效
+                public_configs.invalidate()
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            public_configs.invalidate()
+
+    def seed(self, options):
+        rng = random.Random(0)
+        configs = (
+            [random_config(rng, None, True) for _ in range(options['public'])]
+            + [random_config(rng, BENCH_USER_ID, False) for _ in range(options['own'])]
+            + [random_config(rng, BENCH_USER_ID - 1 - index % 1000, False) for index in range(options['others'])]
+        )
+        rng.shuffle(configs)
+        AssistantsConfigs.objects.bulk_create(configs, batch_size=1000)
+        self.stdout.write(f"已写入 {len(configs)} 条测试配置")
+
+    def run(self, options):
+        factory = APIRequestFactory()
+        view = AssistantsConfigsViewSet.as_view({'get': 'list'})
+        page_size = options['page_size']
+        cases = [
+            # 带 ordering 参数时走原来的数据库 OR 查询
+            ('数据库 OR 查询', f'/?page_size={page_size}&ordering=-id'),
+            ('内存归并', f'/?page_size={page_size}'),
+        ]
+
+        for is_premium in (False, True):
+            self.stdout.write(self.style.MIGRATE_HEADING('付费用户' if is_premium else '免费用户'))
+            user = {'id': BENCH_USER_ID, 'is_premium': is_premium}
+            baseline = None
+            first_pages = []
+            for label, path in cases:
+                def call():
+                    request = factory.get(path)
+                    request.remote_user = user
+                    response = view(request)
+                    response.render()
+                    return response
+
+                first_pages.append([item['id'] for item in call().data['data']['results']])
+                with CaptureQueriesContext(connection) as queries:
+                    call()
+                ms = self.measure(call, options['iterations'])
+                speedup = f"  ({baseline / ms:.1f}x)" if baseline else ''
+                baseline = baseline or ms
+                self.stdout.write(f"  {label:<12} {ms:8.3f} ms  {len(queries):>2} 条查询{speedup}")
+
+            if first_pages[0] != first_pages[1]:
+                self.stdout.write(self.style.WARNING("  两种方式返回的第一页不一致"))
+
+    def measure(self, func, iterations):
+        """返回单次调用的中位耗时（毫秒）"""
+        timings = []
+        for iteration in range(iterations):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2]
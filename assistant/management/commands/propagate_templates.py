@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assistant.models import AssistantTemplates, Prompts, UsersAssistantTemplates
+from assistant.propagation import DEFAULT_BATCH_SIZE, propagate_template, refresh_user_templates
+
+
+class Command(BaseCommand):
+    help = "将助手模板的修改分批同步到由其生成的用户模板"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template-id', type=int, action='append', default=[],
+                            help="要同步的助手模板ID，可重复指定；不指定时同步所有模板")
+        parser.add_argument('--config-id', type=int, default=None,
+                            help="只重新渲染由该助手配置生成的用户模板（配置被修改后使用）")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="每批更新的行数")
+        parser.add_argument('--pause', type=float, default=0, help="每批之间暂停的秒数")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size 必须大于 0")
+
+        if options['config_id'] is not None:
+            queryset = UsersAssistantTemplates.objects.filter(config_id=options['config_id'])
+            stats = refresh_user_templates(queryset, options['batch_size'],
+                                           self.progress_printer(f"配置 {options['config_id']}"),
+                                           options['pause'])
+            self.stdout.write(self.style.SUCCESS(f"配置 {options['config_id']}: {stats}"))
+            self.delete_orphans()
+            return
+
+        templates = AssistantTemplates.objects.all()
+        if options['template_id']:
+            templates = templates.filter(pk__in=options['template_id'])
+
+        for template in templates.iterator():
+            stats = propagate_template(template, options['batch_size'],
+                                       self.progress_printer(f"模板 {template.pk}"),
+                                       options['pause'])
+            self.stdout.write(self.style.SUCCESS(f"模板 {template.pk}: {stats}"))
+
+        self.delete_orphans()
+
+    def delete_orphans(self):
+        deleted, _ = Prompts.delete_orphans()
+        if deleted:
+            self.stdout.write(f"已清理 {deleted} 条不再被引用的提示词")
+
+    def progress_printer(self, label):
+        started = time.monotonic()
+
+        def progress(processed, total):
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"{label}: {processed}/{total} ({elapsed:.1f}s)")
+
+        return progress
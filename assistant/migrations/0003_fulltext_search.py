@@ -0,0 +1,91 @@
+from django.db import migrations
+
+# 需要建立全文索引的表及其字段
+# 注意：SQLite 上的 FTS5 表与触发器是原生 SQL 创建的，Django 不知道它们的存在
+# 之后的迁移若对这些表执行 AlterField/RemoveField 等需要重建表的操作，触发器会被随旧表一起丢弃且没有任何提示，
+# 需要在同一迁移中调用 sqlite_backward/sqlite_forward 重建；assistant.checks 会在 check --database 时报告缺失的触发器
+FULLTEXT_INDEXES = {
+    'assistant_assistanttemplates': ['name', 'prompt_template'],
+    'assistant_assistantsconfigs': ['name', 'relationship', 'nickname', 'personality'],
+}
+
+
+def sqlite_forward(cursor, table, columns):
+    fts = f'{table}_fts'
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+
+    # trigram 分词支持中文子串匹配，外部内容表避免重复存储原文
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({column_list}, "
+        f"content='{table}', content_rowid='id', tokenize='trigram')"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+    )
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def sqlite_backward(cursor, table, columns):
+    fts = f'{table}_fts'
+    for suffix in ('ai', 'ad', 'au'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+    cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+def postgresql_forward(cursor, table, columns):
+    # 生成列由数据库自动维护，无需触发器或信号同步
+    document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+    cursor.execute(
+        f"ALTER TABLE {table} ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED"
+    )
+    cursor.execute(f"CREATE INDEX {table}_search_gin ON {table} USING gin (search_vector)")
+
+
+def postgresql_backward(cursor, table, columns):
+    cursor.execute(f"DROP INDEX IF EXISTS {table}_search_gin")
+    cursor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+
+
+def create_indexes(apps, schema_editor):
+    handlers = {'sqlite': sqlite_forward, 'postgresql': postgresql_forward}
+    handler = handlers.get(schema_editor.connection.vendor)
+    if handler is None:
+        # 其他数据库不建索引，FullTextSearchFilter 会回退到 LIKE 查询
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, columns in FULLTEXT_INDEXES.items():
+            handler(cursor, table, columns)
+
+
+def drop_indexes(apps, schema_editor):
+    handlers = {'sqlite': sqlite_backward, 'postgresql': postgresql_backward}
+    handler = handlers.get(schema_editor.connection.vendor)
+    if handler is None:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, columns in FULLTEXT_INDEXES.items():
+            handler(cursor, table, columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0002_assistanttemplates_assistantsconfigs_usersassistanttemplates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0003_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersassistanttemplates',
+            name='config',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='user_templates', to='assistant.assistantsconfigs', verbose_name='来源配置'),
+        ),
+        migrations.AddField(
+            model_name='usersassistanttemplates',
+            name='template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='user_templates', to='assistant.assistanttemplates', verbose_name='来源模板'),
+        ),
+        migrations.AddField(
+            model_name='usersassistanttemplates',
+            name='template_version',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='来源模板版本'),
+        ),
+    ]
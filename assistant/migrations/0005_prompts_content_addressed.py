@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:59
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def move_prompts_to_store(apps, schema_editor):
+    """把用户模板中的提示词原文移入按哈希去重的 Prompts 表"""
+    Prompts = apps.get_model('assistant', 'Prompts')
+    UsersAssistantTemplates = apps.get_model('assistant', 'UsersAssistantTemplates')
+
+    last_pk = 0
+    while True:
+        batch = list(
+            UsersAssistantTemplates.objects.filter(pk__gt=last_pk, prompt_template__isnull=False)
+            .order_by('pk').only('pk', 'prompt_template')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+
+        prompts = {}
+        for user_template in batch:
+            digest = hashlib.sha256(user_template.prompt_template.encode('utf-8')).hexdigest()
+            prompts[digest] = user_template.prompt_template
+            user_template.prompt_id = digest
+        Prompts.objects.bulk_create(
+            [Prompts(sha256=digest, content=content) for digest, content in prompts.items()],
+            ignore_conflicts=True
+        )
+        UsersAssistantTemplates.objects.bulk_update(batch, ['prompt'])
+
+
+def restore_prompt_templates(apps, schema_editor):
+    UsersAssistantTemplates = apps.get_model('assistant', 'UsersAssistantTemplates')
+    batch = []
+    for user_template in UsersAssistantTemplates.objects.filter(prompt__isnull=False).select_related('prompt').iterator():
+        user_template.prompt_template = user_template.prompt.content
+        batch.append(user_template)
+        if len(batch) >= BATCH_SIZE:
+            UsersAssistantTemplates.objects.bulk_update(batch, ['prompt_template'])
+            batch = []
+    if batch:
+        UsersAssistantTemplates.objects.bulk_update(batch, ['prompt_template'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0004_usersassistanttemplates_lineage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Prompts',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='内容哈希')),
+                ('content', models.TextField(verbose_name='提示词')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '提示词',
+                'verbose_name_plural': '提示词',
+            },
+        ),
+        migrations.AddField(
+            model_name='usersassistanttemplates',
+            name='prompt',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='user_templates', to='assistant.prompts', verbose_name='提示词'),
+        ),
+        migrations.RunPython(move_prompts_to_store, restore_prompt_templates),
+        migrations.RemoveField(
+            model_name='usersassistanttemplates',
+            name='prompt_template',
+        ),
+    ]
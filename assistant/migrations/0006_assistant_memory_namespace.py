@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0005_prompts_content_addressed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistant',
+            name='memory_namespace',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='记忆命名空间'),
+        ),
+    ]
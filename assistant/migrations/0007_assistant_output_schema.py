@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0006_assistant_memory_namespace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistant',
+            name='output_schema',
+            field=models.JSONField(blank=True, null=True, verbose_name='输出结构'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0007_assistant_output_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistant',
+            name='max_retries',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='失败重试次数'),
+        ),
+        migrations.AddField(
+            model_name='assistant',
+            name='max_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='最大输出token数'),
+        ),
+        migrations.AddField(
+            model_name='assistant',
+            name='request_timeout',
+            field=models.FloatField(blank=True, null=True, verbose_name='请求超时（秒）'),
+        ),
+        migrations.AddField(
+            model_name='assistant',
+            name='stop',
+            field=models.JSONField(blank=True, null=True, verbose_name='停止序列'),
+        ),
+    ]
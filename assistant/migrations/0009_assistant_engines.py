@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0008_assistant_generation_overrides'),
+        ('engines', '0004_engines_generation_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistant',
+            name='engines',
+            field=models.ManyToManyField(blank=True, related_name='assistants', to='engines.engines', verbose_name='可用模型'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# 0003 在 PostgreSQL 上使用 to_tsvector('simple')，不会切分中文，只能整段匹配
+# 改为 pg_trgm 的 GIN 三元组索引：ILIKE '%词%' 可以走索引，与 SQLite（FTS5 trigram）同样是子串匹配
+fulltext = import_module('assistant.migrations.0003_fulltext_search')
+
+
+def index_name(table, column):
+    return f'{table}_{column}_trgm'
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table, columns in fulltext.FULLTEXT_INDEXES.items():
+            fulltext.postgresql_backward(cursor, table, columns)
+            for column in columns:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index_name(table, column)} "
+                    f"ON {table} USING gin ({column} gin_trgm_ops)"
+                )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, columns in fulltext.FULLTEXT_INDEXES.items():
+            for column in columns:
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name(table, column)}")
+            fulltext.postgresql_forward(cursor, table, columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0009_assistant_engines'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistant', '0010_trigram_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prompts',
+            name='last_used_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='最近使用时间'),
+        ),
+    ]
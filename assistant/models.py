@@ -1,4 +1,12 @@
-from django.db import models
+import hashlib
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import timezone
+
+from utils.json_output import check_schema
+from .templating import compile_template
 
 # Create your models here.
 
@@ -7,7 +15,18 @@ class Assistant(models.Model):
     description = models.TextField('描述', blank=True, null=True)
     is_active = models.BooleanField('是否启用模型', default=True)
     is_memory = models.BooleanField('是否启动记忆', default=True)
+    # 相同命名空间的助手共享同一份对话记忆，留空时每个助手的记忆相互独立
+    memory_namespace = models.CharField('记忆命名空间', max_length=100, blank=True, null=True)
     prompt_template = models.TextField('提示词', blank=True, null=True)
+    # 输出为 JSON 的助手（如记账、情绪分析）的 JSON Schema，设置后使用模型的 JSON 模式并按该结构解析、校验输出
+    output_schema = models.JSONField('输出结构', blank=True, null=True)
+    # 覆盖所用模型的生成限制，留空时使用模型（Engines）上的设置
+    max_tokens = models.PositiveIntegerField('最大输出token数', blank=True, null=True)
+    request_timeout = models.FloatField('请求超时（秒）', blank=True, null=True)
+    max_retries = models.PositiveSmallIntegerField('失败重试次数', blank=True, null=True)
+    stop = models.JSONField('停止序列', blank=True, null=True)
+    # 助手可使用的模型，多于一个且开启 ENGINE_ROUTING 时，每次请求使用其中当前延迟最低的健康模型
+    engines = models.ManyToManyField('engines.Engines', verbose_name='可用模型', related_name='assistants', blank=True)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
 
@@ -19,6 +38,26 @@ class Assistant(models.Model):
     def __str__(self):
         return self.name
 
+    def client_overrides(self):
+        """需要覆盖的模型客户端参数，没有覆盖时为空字典"""
+        overrides = {}
+        for field in ('max_tokens', 'request_timeout', 'max_retries'):
+            value = getattr(self, field)
+            if value is not None:
+                overrides[field] = value
+        return overrides
+
+    def clean(self):
+        if self.stop is not None and not (isinstance(self.stop, list) and all(isinstance(s, str) for s in self.stop)):
+            raise ValidationError({'stop': '停止序列必须是字符串列表'})
+        if self.output_schema is not None:
+            if not isinstance(self.output_schema, dict):
+                raise ValidationError({'output_schema': '输出结构必须是 JSON 对象'})
+            try:
+                check_schema(self.output_schema)
+            except ValueError as e:
+                raise ValidationError({'output_schema': f'无效的 JSON Schema: {e}'})
+
 
 class AssistantTemplates(models.Model):
     name = models.CharField('助手模板名称', max_length=100)
@@ -35,6 +74,13 @@ class AssistantTemplates(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        """校验模板中的占位符，未知的占位符不会被替换，视为错误"""
+        compiled = compile_template(self.prompt_template)
+        if compiled.unknown_placeholders:
+            names = ', '.join(f'{{{name}}}' for name in sorted(compiled.unknown_placeholders))
+            raise ValidationError({'prompt_template': f'模板中包含未知的占位符: {names}'})
+
 
 class AssistantsConfigs(models.Model):
     user_id = models.IntegerField('用户ID', db_index=True, blank=True, null=True)
@@ -51,11 +97,87 @@ class AssistantsConfigs(models.Model):
         verbose_name_plural = '助手配置'
         ordering = ['-id', 'name']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录读取时是否为公共配置，保存时据此判断是否影响公共配置缓存（见 public_configs._config_saved）
+        if 'is_public' in field_names:
+            instance._loaded_is_public = instance.is_public
+        return instance
+
+
+class Prompts(models.Model):
+    """
+    按内容寻址的提示词存储，相同内容只保存一份
+    主键为内容的 SHA-256，用户模板通过外键引用
+    """
+    sha256 = models.CharField('内容哈希', max_length=64, primary_key=True)
+    content = models.TextField('提示词')
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    # 每次 intern 时刷新，清理孤儿记录以它为准，被复用的旧提示词不会在引用写入前被删除
+    last_used_at = models.DateTimeField('最近使用时间', default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = '提示词'
+        verbose_name_plural = '提示词'
+
+    def __str__(self):
+        return self.sha256
+
+    @staticmethod
+    def digest(content):
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def intern(cls, content):
+        """保存提示词内容并返回对应的实例，内容已存在时直接复用并刷新 last_used_at"""
+        digest = cls.digest(content)
+        # 先刷新再读取：刷新之后 delete_orphans 不会再选中该记录；刷新时记录已被删除则重新创建
+        if cls.objects.filter(sha256=digest).update(last_used_at=timezone.now()):
+            prompt = cls.objects.filter(sha256=digest).first()
+            if prompt is not None:
+                return prompt
+        prompt, _ = cls.objects.get_or_create(sha256=digest, defaults={'content': content})
+        return prompt
+
+    @classmethod
+    def intern_many(cls, contents):
+        """批量保存提示词内容，返回与输入一一对应的哈希列表"""
+        digests = [cls.digest(content) for content in contents]
+        unique = {digest: content for digest, content in zip(digests, contents)}
+        # 与 intern 相同，先刷新已存在的记录，再补建不存在（或刚被删除）的记录
+        cls.objects.filter(sha256__in=list(unique)).update(last_used_at=timezone.now())
+        cls.objects.bulk_create(
+            [cls(sha256=digest, content=content) for digest, content in unique.items()],
+            ignore_conflicts=True
+        )
+        return digests
+
+    @classmethod
+    def delete_orphans(cls, grace=timedelta(hours=1)):
+        """
+        删除不再被任何用户模板引用的提示词
+        刚创建或刚被复用（intern）的提示词可能还没来得及被引用，保留 grace 时间内使用过的记录
+        候选记录在同一事务中加锁后删除，期间并发的 intern 刷新会等待事务结束，随后重新创建被删除的记录
+        """
+        with transaction.atomic():
+            orphans = list(cls.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                user_templates__isnull=True,
+                last_used_at__lt=timezone.now() - grace
+            ).values_list('pk', flat=True))
+            return cls.objects.filter(pk__in=orphans, user_templates__isnull=True).delete()
+
 
 class UsersAssistantTemplates(models.Model):
     user_id = models.IntegerField('用户ID', db_index=True, blank=True, null=True)
     name = models.CharField('助手模板名称', max_length=100)
-    prompt_template = models.TextField('提示词', blank=True, null=True)
+    prompt = models.ForeignKey(Prompts, verbose_name='提示词', on_delete=models.PROTECT,
+                               related_name='user_templates', blank=True, null=True)
+    template = models.ForeignKey(AssistantTemplates, verbose_name='来源模板', on_delete=models.SET_NULL,
+                                 related_name='user_templates', blank=True, null=True)
+    config = models.ForeignKey(AssistantsConfigs, verbose_name='来源配置', on_delete=models.SET_NULL,
+                               related_name='user_templates', blank=True, null=True)
+    template_version = models.DateTimeField('来源模板版本', blank=True, null=True)
     is_premium_template = models.BooleanField('是否付费模版', default=False)
     is_default = models.BooleanField('是否是默认模版', default=True)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
@@ -67,4 +189,9 @@ class UsersAssistantTemplates(models.Model):
         ordering = ['-id', 'name']
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+    @property
+    def prompt_template(self):
+        """渲染后的提示词内容，查询时建议 select_related('prompt')"""
+        return self.prompt.content if self.prompt_id else None
\ No newline at end of file
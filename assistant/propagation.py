@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Prompts, UsersAssistantTemplates
+from .templating import config_variables, get_compiled_template
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def stale_user_templates(template):
+    """由该模板生成、且渲染时使用的不是最新版本的用户模板"""
+    return UsersAssistantTemplates.objects.filter(template=template).exclude(template_version=template.updated_at)
+
+
+def refresh_user_templates(queryset, batch_size=DEFAULT_BATCH_SIZE, progress=None, pause=0):
+    """
+    按主键分批重新渲染用户模板
+    - 每批使用 id > 上一批最大 id 的 keyset 查询，不使用 OFFSET
+    - 每批在独立的短事务中 bulk_update，单次持锁时间只与 batch_size 有关
+    - 来源模板或来源配置已被删除的行无法重新渲染，计入 skipped
+    progress(processed, total) 在每批完成后回调
+    返回 {'total', 'updated', 'skipped'}
+    """
+    total = queryset.count()
+    stats = {'total': total, 'updated': 0, 'skipped': 0}
+    last_pk = 0
+
+    while True:
+        batch = list(
+            queryset.filter(pk__gt=last_pk)
+            .select_related('template', 'config')
+            .defer('template__prompt_template')
+            .order_by('pk')[:batch_size]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+
+        now = timezone.now()
+        changed = []
+        contents = []
+        for user_template in batch:
+            if user_template.template is None or user_template.config is None:
+                stats['skipped'] += 1
+                continue
+            compiled = get_compiled_template(user_template.template)
+            contents.append(compiled.render(config_variables(user_template.config)))
+            user_template.template_version = user_template.template.updated_at
+            user_template.updated_at = now
+            changed.append(user_template)
+
+        if changed:
+            with transaction.atomic():
+                # 相同配置渲染出的提示词只存一份
+                for user_template, digest in zip(changed, Prompts.intern_many(contents)):
+                    user_template.prompt_id = digest
+                UsersAssistantTemplates.objects.bulk_update(
+                    changed, ['prompt', 'template_version', 'updated_at']
+                )
+            stats['updated'] += len(changed)
+
+        if progress:
+            progress(stats['updated'] + stats['skipped'], total)
+        if pause:
+            # 给其他写入让出数据库
+            time.sleep(pause)
+
+    return stats
+
+
+def propagate_template(template, batch_size=DEFAULT_BATCH_SIZE, progress=None, pause=0):
+    """将模板的修改同步到由它生成的所有用户模板"""
+    return refresh_user_templates(stale_user_templates(template), batch_size, progress, pause)
+
+
+def propagate_template_in_background(template_id, batch_size=DEFAULT_BATCH_SIZE):
+    """在后台线程中同步模板修改，进度写入日志"""
+    from .models import AssistantTemplates
+
+    def run():
+        try:
+            template = AssistantTemplates.objects.get(pk=template_id)
+
+            def progress(processed, total):
+                logger.info("模板 %s 同步进度: %s/%s", template_id, processed, total)
+
+            stats = propagate_template(template, batch_size=batch_size, progress=progress)
+            Prompts.delete_orphans()
+            logger.info("模板 %s 同步完成: %s", template_id, stats)
+        except Exception:
+            logger.exception("模板 %s 同步失败", template_id)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name=f'propagate-template-{template_id}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,150 @@
+import bisect
+import heapq
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from utils.invalidation import get_bus, publish_on_commit
+from .constants import FREE_OPTION_SETS
+from .models import AssistantsConfigs
+
+# 公共配置集合的版本号保存在进程内，由缓存失效广播递增：
+# 本进程的修改在事务提交后直接递增，其他进程（及其他节点）的修改经由 INVALIDATION_TRANSPORT 送达
+# 版本号之外再以 PUBLIC_CONFIGS_TTL 作为兜底，广播丢失或不发出信号的修改（如 queryset.update）最多延迟这么久
+_version = 1
+_cache = None  # PublicConfigSet
+_cache_lock = threading.Lock()
+
+
+def current_version():
+    return _version
+
+
+def invalidate(event=None):
+    """公共配置发生变化，递增本进程的版本号，下一次读取时重新加载；作为失效广播的订阅者时 event 为收到的事件"""
+    global _version
+    with _cache_lock:
+        _version += 1
+
+
+def invalidate_on_commit():
+    """在当前事务提交后广播失效，避免其他进程在提交前重新加载到旧数据"""
+    publish_on_commit(AssistantsConfigs, None)
+
+
+def is_free_config(config):
+    """配置的关系、昵称、性格是否都属于免费选项"""
+    return all(getattr(config, field) in options for field, options in FREE_OPTION_SETS.items())
+
+
+class PublicConfigSet:
+    """
+    某个版本的公共配置快照，按 -id 排序
+    付费/免费两个视图在加载时各计算一次，keys 为 -id 的升序列表，用于二分定位游标位置
+    """
+    __slots__ = ('version', 'loaded_at', 'ids', 'tiers')
+
+    def __init__(self, version, configs):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.ids = frozenset(config.pk for config in configs)
+        free = tuple(config for config in configs if is_free_config(config))
+        self.tiers = {
+            True: (configs, [-config.pk for config in configs]),
+            False: (free, [-config.pk for config in free]),
+        }
+
+    def slice(self, is_premium, position, reverse, limit):
+        """与 visible_configs 相同的语义，只在公共配置中取"""
+        configs, keys = self.tiers[bool(is_premium)]
+        if reverse:
+            end = bisect.bisect_left(keys, -position)
+            start = max(0, end - limit) if limit is not None else 0
+            return configs[start:end][::-1]
+        start = bisect.bisect_right(keys, -position) if position is not None else 0
+        return configs[start:start + limit] if limit is not None else configs[start:]
+
+
+def get_public_config_set():
+    global _cache
+    get_bus().ensure_started()
+    # 先读版本号再查询，查询期间发生的修改会使版本号变大，下一次读取时重新加载
+    version = current_version()
+    with _cache_lock:
+        cached = _cache
+    ttl = getattr(settings, 'PUBLIC_CONFIGS_TTL', 300)
+    if cached is not None and cached.version == version and time.monotonic() - cached.loaded_at < ttl:
+        return cached
+
+    loaded = PublicConfigSet(version, tuple(AssistantsConfigs.objects.filter(is_public=True).order_by('-id')))
+    with _cache_lock:
+        _cache = loaded
+    return loaded
+
+
+def get_public_configs():
+    """当前进程缓存的公共配置，按 -id 排序，调用方不应修改返回的实例"""
+    return get_public_config_set().tiers[True][0]
+
+
+def is_public_config_id(pk):
+    return pk in get_public_config_set().ids
+
+
+def own_configs(user_id, is_premium):
+    """用户自己的非公共配置（公共的已包含在缓存中），非付费用户只保留全部使用免费选项的配置"""
+    queryset = AssistantsConfigs.objects.filter(user_id=user_id, is_public=False)
+    if not is_premium:
+        queryset = queryset.filter(**{f'{field}__in': options for field, options in FREE_OPTION_SETS.items()})
+    return queryset
+
+
+def visible_configs(user_id, is_premium, position=None, reverse=False, limit=None):
+    """
+    用户可见的配置：自己的配置 + 公共配置
+    只查询用户自己的行，公共配置来自进程内缓存，两者在内存中归并
+    - reverse 为 False 时按 id 倒序返回 id < position 的配置
+    - reverse 为 True 时按 id 正序返回 id > position 的配置
+    position 为 None 表示从头开始，limit 为 None 表示不限制数量
+    """
+    public = get_public_config_set().slice(is_premium, position, reverse, limit)
+    # user_id 为 None 时与原查询 Q(user_id=None) 一致，包含 user_id 为空的非公共配置
+    own = own_configs(user_id, is_premium)
+    if reverse:
+        own = own.order_by('id')
+        if position is not None:
+            own = own.filter(id__gt=position)
+    else:
+        own = own.order_by('-id')
+        if position is not None:
+            own = own.filter(id__lt=position)
+    if limit is not None:
+        own = own[:limit]
+
+    merged = heapq.merge(own, public, key=(lambda config: config.pk) if reverse else (lambda config: -config.pk))
+    return list(itertools.islice(merged, limit))
+
+
+def _config_saved(sender, instance, created, update_fields=None, **kwargs):
+    """保存前或保存后是公共配置时失效缓存，保存前后都是非公共配置时不影响缓存"""
+    was_public = False if created else getattr(instance, '_loaded_is_public', None)
+    if was_public is None:
+        # 不是从数据库读取的实例（如手动构造后保存），不知道保存前的值，按缓存中的ID判断
+        was_public = is_public_config_id(instance.pk)
+    # update_fields 不含 is_public 时数据库中的值没有变化
+    is_public = instance.is_public if update_fields is None or 'is_public' in update_fields else was_public
+    instance._loaded_is_public = is_public
+    if was_public or is_public:
+        invalidate_on_commit()
+
+
+def _config_deleted(sender, instance, **kwargs):
+    if instance.is_public:
+        invalidate_on_commit()
+
+
+post_save.connect(_config_saved, sender=AssistantsConfigs, dispatch_uid='public_configs_saved')
+post_delete.connect(_config_deleted, sender=AssistantsConfigs, dispatch_uid='public_configs_deleted')
@@ -1,9 +1,17 @@
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
 
+from utils.json_output import check_schema
 from utils.serializers_fields import TimestampField
 from .models import Assistant, AssistantTemplates, AssistantsConfigs, UsersAssistantTemplates
-from .constants import RELATIONSHIP_OPTIONS, NICKNAME_OPTIONS, PERSONALITY_OPTIONS, is_custom_value
+from .constants import FREE_OPTION_SETS, is_custom_value
+
+# 需要校验付费选项的字段及其中文名称
+PREMIUM_CHECKED_FIELDS = (
+    ('relationship', '关系'),
+    ('nickname', '昵称'),
+    ('personality', '性格'),
+)
 
 
 class AssistantSerializer(serializers.ModelSerializer):
@@ -15,7 +23,8 @@ class AssistantSerializer(serializers.ModelSerializer):
         model = Assistant
         fields = [
             'id', 'name', 'description', 'is_active',
-            'is_memory', 'created_at', 'updated_at'
+            'is_memory', 'memory_namespace', 'output_schema',
+            'max_tokens', 'request_timeout', 'max_retries', 'stop', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
         swagger_schema_fields = {
@@ -23,17 +32,41 @@ class AssistantSerializer(serializers.ModelSerializer):
             'description': '助手模型的序列化表示'
         }
 
+    def validate_output_schema(self, value):
+        if value is None:
+            return value
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("输出结构必须是 JSON 对象")
+        try:
+            check_schema(value)
+        except ValueError as e:
+            raise serializers.ValidationError(f"无效的 JSON Schema: {e}")
+        return value
+
+    def validate_stop(self, value):
+        if value is not None and not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+            raise serializers.ValidationError("停止序列必须是字符串列表")
+        return value
+
 
 class AssistantTemplatesSerializer(serializers.ModelSerializer):
     class Meta:
         model = AssistantTemplates
-        fields = '__all__'
+        fields = ['id', 'name', 'prompt_template', 'is_default', 'created_at', 'updated_at']
+
+
+class AssistantTemplatesListSerializer(AssistantTemplatesSerializer):
+    """模板列表不返回提示词，列表查询也就不加载该列；提示词通过详情接口或 ?fields=prompt_template 获取"""
+
+    class Meta(AssistantTemplatesSerializer.Meta):
+        fields = ['id', 'name', 'is_default', 'created_at', 'updated_at']
 
 
 class AssistantsConfigsSerializer(serializers.ModelSerializer):
     class Meta:
         model = AssistantsConfigs
-        fields = '__all__'
+        fields = ['id', 'user_id', 'name', 'relationship', 'nickname', 'personality',
+                  'greeting', 'dialogue_style', 'is_public']
         
     def validate_is_public(self, value):
         """
@@ -52,48 +85,27 @@ class AssistantsConfigsSerializer(serializers.ModelSerializer):
             return data
             
         is_premium = request.remote_user.get('is_premium', False)
-        
-        # 检查关系字段
-        if 'relationship' in data:
-            relationship = data['relationship']
-            if not is_premium:
-                # 非付费用户只能使用免费选项
-                if relationship not in RELATIONSHIP_OPTIONS['free']:
-                    if is_custom_value('relationship', relationship):
-                        raise PermissionDenied("自定义关系仅对付费用户开放")
-                    elif relationship in RELATIONSHIP_OPTIONS['premium']:
-                        raise PermissionDenied(f"关系选项 '{relationship}' 仅对付费用户开放")
-        
-        # 检查昵称字段
-        if 'nickname' in data:
-            nickname = data['nickname']
-            if not is_premium:
-                # 非付费用户只能使用免费选项
-                if nickname not in NICKNAME_OPTIONS['free']:
-                    if is_custom_value('nickname', nickname):
-                        raise PermissionDenied("自定义昵称仅对付费用户开放")
-                    elif nickname in NICKNAME_OPTIONS['premium']:
-                        raise PermissionDenied(f"昵称选项 '{nickname}' 仅对付费用户开放")
-        
-        # 检查性格字段
-        if 'personality' in data:
-            personality = data['personality']
-            if not is_premium:
-                # 非付费用户只能使用免费选项
-                if personality not in PERSONALITY_OPTIONS['free']:
-                    if is_custom_value('personality', personality):
-                        raise PermissionDenied("自定义性格仅对付费用户开放")
-                    elif personality in PERSONALITY_OPTIONS['premium']:
-                        raise PermissionDenied(f"性格选项 '{personality}' 仅对付费用户开放")
-        
+        if not is_premium:
+            # 非付费用户只能使用免费选项
+            for field, label in PREMIUM_CHECKED_FIELDS:
+                if field not in data:
+                    continue
+                value = data[field]
+                if value in FREE_OPTION_SETS[field]:
+                    continue
+                if is_custom_value(field, value):
+                    raise PermissionDenied(f"自定义{label}仅对付费用户开放")
+                raise PermissionDenied(f"{label}选项 '{value}' 仅对付费用户开放")
+
         return data
 
 
 class UsersAssistantTemplatesSerializer(serializers.ModelSerializer):
     class Meta:
         model = UsersAssistantTemplates
-        fields = ['id', 'user_id', 'name', 'prompt_template', 'is_default', 'is_premium_template', 'created_at', 'updated_at']
-        read_only_fields = ['prompt_template', 'created_at', 'updated_at', 'is_premium_template']
+        fields = ['id', 'user_id', 'name', 'prompt_template', 'is_default', 'is_premium_template',
+                  'template', 'config', 'created_at', 'updated_at']
+        read_only_fields = ['prompt_template', 'created_at', 'updated_at', 'is_premium_template', 'template', 'config']
 
 
 class GenerateTemplateSerializer(serializers.Serializer):
@@ -126,4 +138,12 @@ class GenerateTemplateSerializer(serializers.Serializer):
             AssistantsConfigs.objects.get(pk=value)
         except AssistantsConfigs.DoesNotExist:
             raise serializers.ValidationError(f"找不到ID为 {value} 的助手配置")
-        return value
\ No newline at end of file
+        return value
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        help_text="要删除的助手配置ID列表"
+    )
@@ -0,0 +1,103 @@
+import re
+import threading
+
+# 模板中可用的占位符，对应 AssistantsConfigs 的同名字段
+PLACEHOLDERS = ('relationship', 'nickname', 'personality', 'greeting', 'dialogue_style')
+
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+
+class CompiledTemplate:
+    """
+    预编译的提示词模板
+    segments 中偶数位是原样输出的文本，奇数位是占位符名称，渲染时一次拼接完成
+    不认识的 {xxx} 按原文保留（与旧的 str.replace 行为一致），但会记录在 unknown_placeholders 中
+    """
+    __slots__ = ('segments', 'placeholders', 'unknown_placeholders')
+
+    def __init__(self, template):
+        template = template or ''
+        segments = []
+        placeholders = set()
+        unknown = set()
+        literal_start = 0
+        for match in PLACEHOLDER_PATTERN.finditer(template):
+            name = match.group(1)
+            if name not in PLACEHOLDERS:
+                unknown.add(name)
+                continue
+            segments.append(template[literal_start:match.start()])
+            segments.append(name)
+            placeholders.add(name)
+            literal_start = match.end()
+        segments.append(template[literal_start:])
+
+        self.segments = tuple(segments)
+        self.placeholders = frozenset(placeholders)
+        self.unknown_placeholders = frozenset(unknown)
+
+    @property
+    def missing_placeholders(self):
+        return frozenset(PLACEHOLDERS) - self.placeholders
+
+    def render(self, variables):
+        parts = list(self.segments)
+        for index in range(1, len(parts), 2):
+            parts[index] = variables.get(parts[index]) or ''
+        return ''.join(parts)
+
+    def render_many(self, variables_list):
+        """批量渲染多组变量"""
+        return [self.render(variables) for variables in variables_list]
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def compile_template(template):
+    """编译模板文本（不使用缓存）"""
+    return CompiledTemplate(template)
+
+
+def get_compiled_template(assistant_template):
+    """
+    获取 AssistantTemplates 对应的编译结果
+    以模板ID和 updated_at 作为缓存键，模板被编辑后自动重新编译
+    """
+    key = assistant_template.pk
+    version = assistant_template.updated_at
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    compiled = CompiledTemplate(assistant_template.prompt_template)
+    with _cache_lock:
+        _cache[key] = (version, compiled)
+    return compiled
+
+
+def evict_template(template_id):
+    """从缓存中移除指定模板，template_id 为 None 时清空缓存"""
+    with _cache_lock:
+        if template_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(template_id, None)
+
+
+def config_variables(config):
+    """从 AssistantsConfigs 中提取模板变量"""
+    return {name: getattr(config, name) or '' for name in PLACEHOLDERS}
+
+
+def render_template(assistant_template, config):
+    """用一个助手配置渲染模板"""
+    return get_compiled_template(assistant_template).render(config_variables(config))
+
+
+def render_many(assistant_template, configs):
+    """用多个助手配置批量渲染同一个模板，模板只编译一次"""
+    compiled = get_compiled_template(assistant_template)
+    return compiled.render_many(config_variables(config) for config in configs)
@@ -1,3 +1,438 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import AdminSite
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from utils.invalidation import get_bus, model_label
+from . import propagation, public_configs
+from .admin import AssistantTemplatesAdmin
+from .models import AssistantTemplates, AssistantsConfigs, Prompts, UsersAssistantTemplates
+from .templating import PLACEHOLDERS, compile_template, evict_template, get_compiled_template
+from .views import AssistantTemplatesViewSet, AssistantsConfigsViewSet
+
+PREMIUM_USER = {'id': 1, 'is_premium': True}
+
+
+class ViewSetTestMixin:
+    factory = APIRequestFactory()
+
+    def call(self, viewset, actions, method, path, data=None, user=PREMIUM_USER, **kwargs):
+        request = getattr(self.factory, method)(path, data, format='json')
+        request.remote_user = user
+        return viewset.as_view(actions)(request, **kwargs)
+
+
+class SparseListTest(ViewSetTestMixin, TestCase):
+    """列表默认不加载提示词，?fields= 只裁剪安全方法的输出"""
+
+    def setUp(self):
+        AssistantTemplates.objects.create(name='标准模板', prompt_template='很长的提示词' * 100)
+
+    def test_template_list_skips_prompt_template(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.call(AssistantTemplatesViewSet, {'get': 'list'}, 'get', '/api/assistant/templates/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('prompt_template', response.data['data']['results'][0])
+        self.assertNotIn('prompt_template', queries.captured_queries[-1]['sql'])
+
+        response = self.call(AssistantTemplatesViewSet, {'get': 'list'}, 'get',
+                             '/api/assistant/templates/?fields=id,prompt_template')
+        self.assertEqual(set(response.data['data']['results'][0]), {'id', 'prompt_template'})
+
+    def test_fields_ignored_on_writes(self):
+        response = self.call(AssistantsConfigsViewSet, {'post': 'create'}, 'post', '/api/assistant/configs/?fields=id', {
+            'name': '我的配置', 'relationship': 'Buddy', 'nickname': 'Friend', 'personality': 'Cheerful',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['relationship'], 'Buddy')
+        self.assertEqual(AssistantsConfigs.objects.get().personality, 'Cheerful')
+
+
+class PublicConfigCacheTest(TestCase):
+    """公共配置的进程内缓存由失效广播和有效期共同失效，其他进程的修改不会一直读不到"""
+
+    def setUp(self):
+        public_configs.invalidate()
+        AssistantsConfigs.objects.create(name='公共配置', relationship='Buddy', nickname='Friend',
+                                         personality='Cheerful', is_public=True)
+
+    def test_event_from_other_process(self):
+        cached = public_configs.get_public_config_set()
+        self.assertIs(public_configs.get_public_config_set(), cached)
+
+        # 模拟其他进程直接写入后广播的事件（不经过本进程的信号）
+        AssistantsConfigs.objects.filter(is_public=True).update(name='已修改')
+        get_bus().deliver({'model': model_label(AssistantsConfigs), 'pk': None, 'origin': 'other:1'})
+        self.assertEqual(public_configs.get_public_configs()[0].name, '已修改')
+
+    @override_settings(PUBLIC_CONFIGS_TTL=10)
+    def test_ttl_expiry(self):
+        cached = public_configs.get_public_config_set()
+        with mock.patch('assistant.public_configs.time.monotonic', return_value=cached.loaded_at + 11):
+            self.assertIsNot(public_configs.get_public_config_set(), cached)
+
+
+class PublicConfigSignalTest(TestCase):
+    """只有保存前或保存后为公共配置的修改才失效缓存，私有配置的保存不读取也不失效缓存"""
+
+    def setUp(self):
+        self.private = AssistantsConfigs.objects.create(user_id=1, name='私有', relationship='Buddy',
+                                                        nickname='Friend', personality='Cheerful')
+        self.public = AssistantsConfigs.objects.create(name='公共', relationship='Buddy', nickname='Friend',
+                                                       personality='Cheerful', is_public=True)
+        # 保存前的值已知时不需要读取公共配置缓存
+        for target, options in (('invalidate_on_commit', {}), ('is_public_config_id', {'side_effect': AssertionError})):
+            patcher = mock.patch(f'assistant.public_configs.{target}', **options)
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.invalidate = self.invalidate_on_commit
+
+    def save(self, pk, update_fields=None, **changes):
+        instance = AssistantsConfigs.objects.get(pk=pk)
+        for field, value in changes.items():
+            setattr(instance, field, value)
+        self.invalidate.reset_mock()
+        instance.save(update_fields=update_fields)
+        return self.invalidate.called
+
+    def test_private_save(self):
+        self.assertFalse(self.save(self.private.pk, name='改名'))
+        self.invalidate.reset_mock()
+        AssistantsConfigs.objects.create(user_id=1, name='新的私有', relationship='Buddy', nickname='Friend',
+                                         personality='Cheerful')
+        self.invalidate.assert_not_called()
+
+    def test_public_changes(self):
+        self.assertTrue(self.save(self.public.pk, name='改名'))
+        self.assertTrue(self.save(self.private.pk, is_public=True))
+        self.assertTrue(self.save(self.public.pk, is_public=False))
+        # 未写入 is_public，数据库中仍是公共配置
+        self.assertTrue(self.save(self.private.pk, update_fields=['name'], name='改名', is_public=False))
+        self.assertFalse(self.save(self.public.pk, update_fields=['name'], name='改名'))
+
+    def test_unknown_previous_value(self):
+        instance = AssistantsConfigs(pk=self.public.pk, name='公共', relationship='Buddy', nickname='Friend',
+                                     personality='Cheerful', is_public=False)
+        with mock.patch('assistant.public_configs.is_public_config_id', return_value=True) as is_public_config_id:
+            instance.save()
+        is_public_config_id.assert_called_once_with(self.public.pk)
+        self.invalidate.assert_called_once()
+
+
+class VisibleConfigsTest(TestCase):
+    """内存归并的结果与原查询 Q(is_public=True) | Q(user_id=user_id) 一致"""
+
+    def test_matches_queryset(self):
+        public_configs.invalidate()
+        fields = {'relationship': 'Buddy', 'nickname': 'Friend', 'personality': 'Cheerful'}
+        for user_id, is_public in ((None, False), (None, True), (1, False), (2, False), (1, True)):
+            AssistantsConfigs.objects.create(user_id=user_id, name='配置', is_public=is_public, **fields)
+        for user_id in (None, 1, 2):
+            expected = list(AssistantsConfigs.objects.filter(Q(is_public=True) | Q(user_id=user_id))
+                            .order_by('-id').values_list('pk', flat=True))
+            self.assertEqual([config.pk for config in public_configs.visible_configs(user_id, True)], expected)
+
+
+class PromptOrphansTest(TestCase):
+    """清理孤儿提示词以最近一次使用为准，刚被复用的旧提示词不会在引用写入前被删除"""
+
+    def test_reused_prompt_is_kept(self):
+        long_ago = timezone.now() - timedelta(days=1)
+        reused, orphan = Prompts.intern('复用的提示词'), Prompts.intern('无人引用的提示词')
+        Prompts.objects.update(created_at=long_ago, last_used_at=long_ago)
+
+        self.assertEqual(Prompts.intern('复用的提示词').pk, reused.pk)
+        Prompts.intern_many(['复用的提示词'])
+        Prompts.delete_orphans()
+        self.assertEqual(list(Prompts.objects.values_list('pk', flat=True)), [reused.pk])
+        self.assertFalse(Prompts.objects.filter(pk=orphan.pk).exists())
+
+
+class BulkConfigsTest(ViewSetTestMixin, TestCase):
+    """批量接口逐条返回结果，单条失败不影响其他条目，也不会产生 500"""
+    path = '/api/assistant/configs/'
+
+    def config(self, **overrides):
+        data = {'name': '我的配置', 'relationship': 'Buddy', 'nickname': 'Friend', 'personality': 'Cheerful'}
+        data.update(overrides)
+        return data
+
+    def bulk(self, action, method, data, user=PREMIUM_USER):
+        response = self.call(AssistantsConfigsViewSet, {method: action}, method,
+                             f'{self.path}{action.replace("_", "-")}/', data, user=user)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+
+    def test_bulk_create_partial_failure(self):
+        data = self.bulk('bulk_create', 'post', {'items': [
+            self.config(name='配置一'),
+            self.config(relationship='BF'),
+            self.config(name='配置三'),
+            'not an object',
+        ]}, user={'id': 1, 'is_premium': False})
+        self.assertEqual((data['succeeded'], data['failed']), (2, 2))
+        self.assertEqual([result['status'] for result in data['results']], ['created', 'error', 'created', 'error'])
+        self.assertIn('non_field_errors', data['results'][1]['errors'])
+        self.assertEqual(sorted(AssistantsConfigs.objects.values_list('name', flat=True)), ['配置一', '配置三'])
+
+    def test_bulk_update_partial_failure(self):
+        first = AssistantsConfigs.objects.create(user_id=1, **self.config(name='配置一'))
+        other = AssistantsConfigs.objects.create(user_id=2, **self.config(name='他人的配置'))
+        data = self.bulk('bulk_update', 'patch', [
+            {'id': first.pk, 'name': '已修改'},
+            {'id': first.pk, 'name': '重复'},
+            {'id': other.pk, 'name': '越权'},
+            {'id': [first.pk], 'name': '列表ID'},
+            {'id': {'pk': first.pk}, 'name': '对象ID'},
+            {'id': str(first.pk), 'name': '字符串ID'},
+            {'name': '缺少ID'},
+        ])
+        self.assertEqual((data['succeeded'], data['failed']), (1, 6))
+        self.assertEqual(data['results'][0]['status'], 'updated')
+        self.assertIn('重复', data['results'][1]['errors']['id'][0])
+        for result in data['results'][1:]:
+            self.assertEqual(result['status'], 'error')
+            self.assertIn('id', result['errors'])
+        first.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((first.name, other.name), ('已修改', '他人的配置'))
+
+    def test_bulk_update_invalidates_public_configs(self):
+        config = AssistantsConfigs.objects.create(user_id=1, **self.config())
+        with mock.patch('assistant.public_configs.invalidate_on_commit') as invalidate:
+            self.bulk('bulk_update', 'patch', [{'id': config.pk, 'name': '私有'}])
+            invalidate.assert_not_called()
+            # 由私有改为公共，以及公共配置的修改，都需要失效缓存
+            for item in ({'is_public': True}, {'name': '公共'}, {'is_public': False}):
+                invalidate.reset_mock()
+                self.bulk('bulk_update', 'patch', [{'id': config.pk, **item}])
+                invalidate.assert_called_once()
+
+    def test_bulk_delete_partial_failure(self):
+        mine = AssistantsConfigs.objects.create(user_id=1, **self.config())
+        other = AssistantsConfigs.objects.create(user_id=2, **self.config())
+        data = self.bulk('bulk_delete', 'post', {'ids': [mine.pk, other.pk, 999999]})
+        self.assertEqual((data['succeeded'], data['failed']), (1, 2))
+        self.assertEqual([result['status'] for result in data['results']], ['deleted', 'error', 'error'])
+        self.assertEqual(list(AssistantsConfigs.objects.values_list('pk', flat=True)), [other.pk])
+
+    def test_bulk_delete_invalid_ids(self):
+        response = self.call(AssistantsConfigsViewSet, {'post': 'bulk_delete'}, 'post',
+                             f'{self.path}bulk-delete/', {'ids': [[1], {'pk': 2}]})
+        self.assertEqual(response.status_code, 400)
+
+
+class FullTextSearchTest(ViewSetTestMixin, TestCase):
+    """SQLite 全文索引由触发器维护：增删改后的搜索结果与数据一致；相关度相同的结果翻页不重复不遗漏"""
+
+    def search(self, term, **params):
+        query = '&'.join(f'{key}={value}' for key, value in {'search': term, **params}.items())
+        response = self.call(AssistantTemplatesViewSet, {'get': 'list'}, 'get', f'/api/assistant/templates/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+
+    def names(self, term):
+        return {row['name'] for row in self.search(term)['results']}
+
+    def test_index_follows_writes(self):
+        kept = AssistantTemplates.objects.create(name='温柔的助手', prompt_template='陪伴聊天')
+        changed = AssistantTemplates.objects.create(name='严厉的教练', prompt_template='督促锻炼')
+        deleted = AssistantTemplates.objects.create(name='温柔的老师', prompt_template='讲解题目')
+        self.assertEqual(self.names('温柔的'), {'温柔的助手', '温柔的老师'})
+
+        changed.name = '温柔的教练'
+        changed.save()
+        deleted.delete()
+        AssistantTemplates.objects.filter(pk=kept.pk).update(prompt_template='安静倾听')
+        self.assertEqual(self.names('温柔的'), {'温柔的助手', '温柔的教练'})
+        self.assertEqual(self.names('严厉的'), set())
+        self.assertEqual(self.names('讲解题'), set())
+        self.assertEqual(self.names('安静倾'), {'温柔的助手'})
+        self.assertEqual(self.names('陪伴聊'), set())
+
+    def test_ranked_pagination(self):
+        # 内容相同，相关度完全相同
+        ids = {AssistantTemplates.objects.create(name='同样的助手', prompt_template='同样的提示词').pk
+               for _ in range(5)}
+        seen, params = [], {'page_size': 2}
+        for _ in range(5):
+            data = self.search('同样的', **params)
+            seen += [row['id'] for row in data['results']]
+            if not data['next']:
+                break
+            params = {'page_size': 2, 'cursor': data['next'].split('cursor=')[1].split('&')[0]}
+        self.assertEqual(sorted(seen), sorted(ids))
+        self.assertEqual(len(seen), len(ids))
+        self.assertIsNotNone(data['previous'])
+
+    def test_trigger_check(self):
+        from .checks import check_fulltext_triggers
+        self.assertEqual(check_fulltext_triggers(None, databases=['default']), [])
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER assistant_assistanttemplates_fts_au')
+        errors = check_fulltext_triggers(None, databases=['default'])
+        self.assertEqual([error.id for error in errors], ['assistant.E001'])
+        self.assertIn('assistant_assistanttemplates_fts_au', errors[0].msg)
+
+
+class CompiledTemplateTest(SimpleTestCase):
+    """已知占位符被替换，其他花括号（包括未知占位符）原样保留"""
+
+    def test_known_placeholders(self):
+        compiled = compile_template('你是{nickname}的{relationship}，性格{personality}。{greeting}')
+        self.assertEqual(compiled.placeholders, {'nickname', 'relationship', 'personality', 'greeting'})
+        self.assertEqual(compiled.missing_placeholders, {'dialogue_style'})
+        self.assertEqual(
+            compiled.render({'nickname': '小明', 'relationship': '朋友', 'personality': '开朗', 'greeting': None}),
+            '你是小明的朋友，性格开朗。',
+        )
+        self.assertEqual(compiled.render_many([{'nickname': 'A'}, {'nickname': 'B'}])[1], '你是B的，性格。')
+
+    def test_literal_braces(self):
+        template = '按 JSON 输出 {"reply": "..."}，空括号 {} 与 { nickname } 不是占位符'
+        compiled = compile_template(template)
+        self.assertEqual(compiled.placeholders, frozenset())
+        self.assertEqual(compiled.unknown_placeholders, frozenset())
+        self.assertEqual(compiled.render({'nickname': '小明'}), template)
+        self.assertEqual(compile_template('{{nickname}}').render({'nickname': '小明'}), '{小明}')
+        self.assertEqual(compile_template(None).render({}), '')
+
+    def test_unknown_placeholders_kept(self):
+        compiled = compile_template('{nickname}今天{weather}，{user_name}')
+        self.assertEqual(compiled.unknown_placeholders, {'weather', 'user_name'})
+        self.assertEqual(compiled.render({'nickname': '小明', 'weather': '晴'}), '小明今天{weather}，{user_name}')
+
+
+class TemplateValidationTest(TestCase):
+    """clean() 拒绝未知占位符；编译结果按 updated_at 缓存"""
+
+    def test_clean(self):
+        template = AssistantTemplates(name='模板', prompt_template=''.join(f'{{{name}}}' for name in PLACEHOLDERS))
+        template.clean()
+        AssistantTemplates(name='模板', prompt_template=None).clean()
+
+        template.prompt_template = '{nickname} {weather} {mood}'
+        with self.assertRaises(ValidationError) as raised:
+            template.clean()
+        self.assertEqual(raised.exception.message_dict['prompt_template'], ['模板中包含未知的占位符: {mood}, {weather}'])
+
+    def test_compiled_cache(self):
+        template = AssistantTemplates.objects.create(name='模板', prompt_template='{nickname}')
+        self.addCleanup(evict_template, template.pk)
+        compiled = get_compiled_template(template)
+        self.assertIs(get_compiled_template(template), compiled)
+
+        template.prompt_template = '{nickname}!'
+        template.save()
+        self.assertEqual(get_compiled_template(template).render({'nickname': 'A'}), 'A!')
+
+
+class PropagationTest(TestCase):
+    """编辑助手模板后，由它生成的用户模板重新渲染并记录模板版本，已是最新版本的行不处理"""
+
+    def setUp(self):
+        self.template = AssistantTemplates.objects.create(name='模板', prompt_template='你好，{nickname}')
+        self.config = AssistantsConfigs.objects.create(name='配置', relationship='Buddy', nickname='Friend',
+                                                       personality='Cheerful')
+        self.user_templates = [
+            UsersAssistantTemplates.objects.create(
+                user_id=user_id, name='模板', template=self.template, config=self.config,
+                template_version=self.template.updated_at, prompt=Prompts.intern('你好，Friend'),
+            )
+            for user_id in (1, 2)
+        ]
+        self.addCleanup(evict_template, self.template.pk)
+
+    def edit_template(self):
+        self.template.prompt_template = '再见，{nickname}'
+        self.template.save()
+
+    def test_propagate(self):
+        self.edit_template()
+        up_to_date = self.user_templates[1]
+        UsersAssistantTemplates.objects.filter(pk=up_to_date.pk).update(template_version=self.template.updated_at)
+
+        stats = propagation.propagate_template(self.template, batch_size=1)
+        self.assertEqual(stats, {'total': 1, 'updated': 1, 'skipped': 0})
+        stale, up_to_date = (UsersAssistantTemplates.objects.select_related('prompt').get(pk=user_template.pk)
+                             for user_template in self.user_templates)
+        self.assertEqual(stale.prompt_template, '再见，Friend')
+        self.assertEqual(stale.prompt_id, Prompts.digest('再见，Friend'))
+        self.assertEqual(stale.template_version, self.template.updated_at)
+        self.assertEqual(up_to_date.prompt_template, '你好，Friend')
+
+        self.assertEqual(propagation.propagate_template(self.template)['total'], 0)
+
+    def test_admin_propagates_after_commit(self):
+        self.edit_template()
+        form = mock.Mock(changed_data=['prompt_template'])
+        model_admin = AssistantTemplatesAdmin(AssistantTemplates, AdminSite())
+        with mock.patch.object(model_admin, 'message_user'), \
+                mock.patch('assistant.admin.propagate_template_in_background') as background:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                model_admin.save_model(mock.Mock(), self.template, form, change=True)
+            background.assert_not_called()  # 提交之前不启动
+            for callback in callbacks:
+                callback()
+        background.assert_called_once_with(self.template.pk)
+
+    def test_background_thread(self):
+        self.edit_template()
+        # 在当前线程中执行后台任务；测试运行在事务中，不能关闭连接
+        with mock.patch('assistant.propagation.threading.Thread') as thread, \
+                mock.patch('assistant.propagation.connection'):
+            propagation.propagate_template_in_background(self.template.pk)
+            self.assertTrue(thread.call_args.kwargs['daemon'])
+            thread.call_args.kwargs['target']()
+        self.assertEqual(
+            set(UsersAssistantTemplates.objects.values_list('prompt__content', flat=True)), {'再见，Friend'}
+        )
+
+    def test_command(self):
+        self.edit_template()
+        call_command('propagate_templates', '--template-id', str(self.template.pk), stdout=mock.Mock())
+        self.assertEqual(
+            set(UsersAssistantTemplates.objects.values_list('template_version', flat=True)), {self.template.updated_at}
+        )
+
+
+class PromptMigrationTest(TransactionTestCase):
+    """0005 把用户模板中的提示词原文移入 Prompts，内容不变，相同内容只保存一份；回滚时恢复原文"""
+    before = [('assistant', '0004_usersassistanttemplates_lineage')]
+    after = [('assistant', '0005_prompts_content_addressed')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_move_prompts(self):
+        apps = self.migrate(self.before)
+        OldUsersAssistantTemplates = apps.get_model('assistant', 'UsersAssistantTemplates')
+        texts = ['你好，Friend {未知}', '你好，Friend {未知}', 'Hello', None]
+        ids = [OldUsersAssistantTemplates.objects.create(user_id=1, name='模板', prompt_template=text).pk
+               for text in texts]
+
+        apps = self.migrate(self.after)
+        NewUsersAssistantTemplates = apps.get_model('assistant', 'UsersAssistantTemplates')
+        rows = {row.pk: row for row in NewUsersAssistantTemplates.objects.select_related('prompt')}
+        self.assertEqual([rows[pk].prompt.content if rows[pk].prompt_id else None for pk in ids], texts)
+        self.assertEqual(rows[ids[0]].prompt_id, Prompts.digest(texts[0]))
+        self.assertEqual(apps.get_model('assistant', 'Prompts').objects.count(), 2)
+
+        apps = self.migrate(self.before)
+        OldUsersAssistantTemplates = apps.get_model('assistant', 'UsersAssistantTemplates')
+        self.assertEqual([OldUsersAssistantTemplates.objects.get(pk=pk).prompt_template for pk in ids], texts)
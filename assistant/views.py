@@ -1,20 +1,25 @@
-from django.db import models
+from django.db import models, transaction
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 from utils.mixins import *
-from .models import Assistant, AssistantTemplates, AssistantsConfigs, UsersAssistantTemplates
+from .models import Assistant, AssistantTemplates, AssistantsConfigs, UsersAssistantTemplates, Prompts
 from .serializers import (
-    AssistantSerializer, AssistantTemplatesSerializer,
+    AssistantSerializer, AssistantTemplatesSerializer, AssistantTemplatesListSerializer,
     AssistantsConfigsSerializer, UsersAssistantTemplatesSerializer,
-    GenerateTemplateSerializer
+    GenerateTemplateSerializer, BulkDeleteSerializer
 )
+from utils.pagination import StandardCursorPagination
 from utils.permissions import IsAuthenticatedExternal
+from utils.search import FullTextSearchFilter
 from rest_framework.viewsets import GenericViewSet
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 from .constants import RELATIONSHIP_OPTIONS, NICKNAME_OPTIONS, PERSONALITY_OPTIONS, is_custom_value
+from .templating import render_template
+from . import public_configs
 
 
 def api_response(code=200, msg="success", data=None):
@@ -76,13 +81,15 @@ class AssistantViewSet(ListModelMixin,
         return queryset
 
 
-class AssistantTemplatesViewSet(ListModelMixin,
+class AssistantTemplatesViewSet(SparseFieldsMixin,
+                                ListModelMixin,
                                 RetrieveModelMixin,
                                 GenericViewSet):
     queryset = AssistantTemplates.objects.all()
     serializer_class = AssistantTemplatesSerializer
     permission_classes = [IsAuthenticatedExternal]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = StandardCursorPagination
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['is_default']
     search_fields = ['name', 'prompt_template']
     ordering_fields = ['name', 'created_at', 'updated_at']
@@ -102,6 +109,12 @@ class AssistantTemplatesViewSet(ListModelMixin,
         serializer = self.get_serializer(queryset, many=True)
         return api_response(data=serializer.data)
 
+    def get_serializer_class(self):
+        # 列表默认使用不含提示词的序列化器，?fields= 明确要求提示词时才加载
+        if self.action == 'list' and 'prompt_template' not in (self.get_requested_fields() or ()):
+            return AssistantTemplatesListSerializer
+        return super().get_serializer_class()
+
     @swagger_auto_schema(
         operation_summary="获取助手模板详情",
         operation_description="根据ID获取特定助手模板的详细信息"
@@ -112,7 +125,8 @@ class AssistantTemplatesViewSet(ListModelMixin,
         return api_response(data=serializer.data)
 
 
-class AssistantsConfigsViewSet(ListModelMixin,
+class AssistantsConfigsViewSet(SparseFieldsMixin,
+                               ListModelMixin,
                                CreateModelMixin,
                                RetrieveModelMixin,
                                UpdateModelMixin,
@@ -121,12 +135,38 @@ class AssistantsConfigsViewSet(ListModelMixin,
     queryset = AssistantsConfigs.objects.all()
     serializer_class = AssistantsConfigsSerializer
     permission_classes = [IsAuthenticatedExternal]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = StandardCursorPagination
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['user_id', 'name', 'is_public']
     search_fields = ['name', 'relationship', 'nickname', 'personality']
     ordering_fields = ['name', 'id']
+    bulk_max_items = 1000
+    bulk_batch_size = 500
+    # 只带这些参数的列表请求走内存归并，不查询公共配置
+    in_memory_list_params = frozenset({'cursor', 'page_size', 'fields'})
+
+    def can_list_in_memory(self):
+        return (
+            set(self.request.query_params) <= self.in_memory_list_params
+            and hasattr(self.paginator, 'paginate_keyset')
+        )
 
     def list(self, request, *args, **kwargs):
+        if self.can_list_in_memory():
+            user_id = request.remote_user.get('id')
+            is_premium = request.remote_user.get('is_premium', False)
+            page = self.paginator.paginate_keyset(
+                lambda position, reverse, limit: public_configs.visible_configs(
+                    user_id, is_premium, position, reverse, limit
+                ),
+                request, view=self
+            )
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
+            serializer = self.get_serializer(public_configs.visible_configs(user_id, is_premium), many=True)
+            return api_response(data=serializer.data)
+
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
         
@@ -199,12 +239,173 @@ class AssistantsConfigsViewSet(ListModelMixin,
         context['request'] = self.request
         return context
 
+    def get_bulk_items(self, request, key='items'):
+        """
+        读取批量请求体，支持直接提交列表或 {"items": [...]}
+        返回 (items, error_response)
+        """
+        items = request.data.get(key) if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return None, api_response(code=status.HTTP_400_BAD_REQUEST, msg="请求体必须是非空列表")
+        if len(items) > self.bulk_max_items:
+            return None, api_response(
+                code=status.HTTP_400_BAD_REQUEST,
+                msg=f"单次最多提交 {self.bulk_max_items} 条"
+            )
+        return items, None
+
+    def validate_bulk_item(self, serializer):
+        """校验单条数据，返回错误信息，校验通过时返回 None"""
+        try:
+            serializer.is_valid(raise_exception=True)
+        except ValidationError as e:
+            return e.detail
+        except PermissionDenied as e:
+            return {'non_field_errors': [e.detail]}
+        return None
+
+    def bulk_response(self, results):
+        results.sort(key=lambda result: result['index'])
+        failed = sum(1 for result in results if result['status'] == 'error')
+        return api_response(data={
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'results': results,
+        })
+
+    @swagger_auto_schema(
+        operation_summary="批量创建助手配置",
+        operation_description="逐条校验后在一个事务内批量写入，返回每一条的处理结果",
+        request_body=AssistantsConfigsSerializer(many=True)
+    )
+    @action(detail=False, methods=['post'], url_path='bulk-create')
+    def bulk_create(self, request):
+        items, error_response = self.get_bulk_items(request)
+        if error_response:
+            return error_response
+
+        results = []
+        pending = []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            errors = self.validate_bulk_item(serializer)
+            if errors:
+                results.append({'index': index, 'status': 'error', 'errors': errors})
+            else:
+                pending.append((index, AssistantsConfigs(**serializer.validated_data)))
+
+        if pending:
+            with transaction.atomic():
+                created = AssistantsConfigs.objects.bulk_create(
+                    [instance for _, instance in pending], batch_size=self.bulk_batch_size
+                )
+                # bulk_create 不发送 post_save 信号，需要手动失效公共配置缓存
+                if any(instance.is_public for instance in created):
+                    public_configs.invalidate_on_commit()
+            data = self.get_serializer(created, many=True).data
+            for (index, _), item_data in zip(pending, data):
+                results.append({'index': index, 'status': 'created', 'data': item_data})
+
+        return self.bulk_response(results)
+
+    @swagger_auto_schema(
+        operation_summary="批量更新助手配置",
+        operation_description="每条数据需包含 id，按部分更新处理，在一个事务内批量写入，返回每一条的处理结果",
+        request_body=AssistantsConfigsSerializer(many=True)
+    )
+    @action(detail=False, methods=['patch'], url_path='bulk-update')
+    def bulk_update(self, request):
+        items, error_response = self.get_bulk_items(request)
+        if error_response:
+            return error_response
+
+        ids = [item.get('id') for item in items if isinstance(item, dict)]
+        instances = self.get_queryset().in_bulk([pk for pk in ids if isinstance(pk, int)])
+
+        results = []
+        pending = []
+        updated_fields = set()
+        touches_public = False
+        seen = set()
+        for index, item in enumerate(items):
+            pk = item.get('id') if isinstance(item, dict) else None
+            # 列表、对象等不可哈希的值不能参与去重，作为该条的错误返回
+            if not isinstance(pk, int) or isinstance(pk, bool):
+                results.append({'index': index, 'status': 'error', 'errors': {'id': ["配置ID必须是整数"]}})
+                continue
+            if pk in seen:
+                results.append({'index': index, 'status': 'error', 'errors': {'id': ["同一请求中重复的配置ID"]}})
+                continue
+            seen.add(pk)
+            instance = instances.get(pk)
+            if instance is None:
+                results.append({'index': index, 'status': 'error', 'errors': {'id': [f"找不到ID为 {pk} 的助手配置"]}})
+                continue
+
+            serializer = self.get_serializer(instance, data=item, partial=True)
+            errors = self.validate_bulk_item(serializer)
+            if errors:
+                results.append({'index': index, 'status': 'error', 'errors': errors})
+                continue
+            # 修改前或修改后是公共配置，都需要失效公共配置缓存
+            touches_public = touches_public or instance.is_public or serializer.validated_data.get('is_public', False)
+            for field, value in serializer.validated_data.items():
+                setattr(instance, field, value)
+            updated_fields.update(serializer.validated_data)
+            pending.append((index, instance))
+
+        if pending and updated_fields:
+            with transaction.atomic():
+                AssistantsConfigs.objects.bulk_update(
+                    [instance for _, instance in pending], sorted(updated_fields), batch_size=self.bulk_batch_size
+                )
+                # bulk_update 不发送 post_save 信号，需要手动失效公共配置缓存
+                if touches_public:
+                    public_configs.invalidate_on_commit()
+        if pending:
+            data = self.get_serializer([instance for _, instance in pending], many=True).data
+            for (index, _), item_data in zip(pending, data):
+                results.append({'index': index, 'status': 'updated', 'data': item_data})
+
+        return self.bulk_response(results)
+
+    @swagger_auto_schema(
+        operation_summary="批量删除助手配置",
+        operation_description="在一个事务内删除，返回每一个ID的处理结果",
+        request_body=BulkDeleteSerializer
+    )
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request):
+        ids, error_response = self.get_bulk_items(request, key='ids')
+        if error_response:
+            return error_response
+
+        serializer = BulkDeleteSerializer(data={'ids': ids})
+        if not serializer.is_valid():
+            return api_response(code=status.HTTP_400_BAD_REQUEST, msg=serializer.errors)
+        ids = serializer.validated_data['ids']
+
+        with transaction.atomic():
+            queryset = self.get_queryset().filter(pk__in=ids)
+            existing = set(queryset.values_list('pk', flat=True))
+            # 不经过 get_queryset 的过滤条件直接按主键删除，避免在 DELETE 中带上 OR 条件
+            AssistantsConfigs.objects.filter(pk__in=existing).delete()
+
+        results = []
+        for index, pk in enumerate(ids):
+            if pk in existing:
+                results.append({'index': index, 'id': pk, 'status': 'deleted'})
+            else:
+                results.append({'index': index, 'id': pk, 'status': 'error',
+                                'errors': {'id': [f"找不到ID为 {pk} 的助手配置"]}})
+        return self.bulk_response(results)
+
 
 class UsersAssistantTemplatesViewSet(ListModelMixin,
                                      RetrieveModelMixin,
                                      UpdateModelMixin,
                                      GenericViewSet):
-    queryset = UsersAssistantTemplates.objects.all()
+    queryset = UsersAssistantTemplates.objects.select_related('prompt')
     serializer_class = UsersAssistantTemplatesSerializer
     permission_classes = [IsAuthenticatedExternal]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -226,7 +427,7 @@ class UsersAssistantTemplatesViewSet(ListModelMixin,
         获取当前用户的模板，如果不存在则返回空列表
         """
         user_id = request.remote_user.get('id')
-        template = UsersAssistantTemplates.objects.filter(user_id=user_id).first()
+        template = self.get_queryset().first()
         
         if template:
             serializer = self.get_serializer(template)
@@ -296,7 +497,7 @@ class UsersAssistantTemplatesViewSet(ListModelMixin,
                 is_premium = True
 
             # 生成提示词
-            prompt = self.generate_prompt(template.prompt_template, config)
+            prompt = self.generate_prompt(template, config)
 
             # 创建用户模板
             user_id = request.remote_user.get('id')
@@ -305,14 +506,18 @@ class UsersAssistantTemplatesViewSet(ListModelMixin,
             if is_default:
                 UsersAssistantTemplates.objects.filter(user_id=user_id).update(is_default=False)
 
-            # 创建新模板
-            user_template = UsersAssistantTemplates.objects.create(
-                user_id=user_id,
-                name=name,
-                prompt_template=prompt,
-                is_default=is_default,
-                is_premium_template=is_premium  # 设置是否为付费模板
-            )
+            # 创建新模板，相同内容的提示词只保存一份
+            with transaction.atomic():
+                user_template = UsersAssistantTemplates.objects.create(
+                    user_id=user_id,
+                    name=name,
+                    prompt=Prompts.intern(prompt),
+                    template=template,
+                    config=config,
+                    template_version=template.updated_at,
+                    is_default=is_default,
+                    is_premium_template=is_premium  # 设置是否为付费模板
+                )
 
             return api_response(
                 code=status.HTTP_201_CREATED,
@@ -337,23 +542,9 @@ class UsersAssistantTemplatesViewSet(ListModelMixin,
     def generate_prompt(self, template, config):
         """
         将配置信息嵌入到模板中
+        模板按ID和更新时间缓存编译结果，渲染一次完成
         """
-        # 获取配置中的变量
-        variables = {
-            'relationship': config.relationship,
-            'nickname': config.nickname,
-            'personality': config.personality,
-            'greeting': config.greeting or '',
-            'dialogue_style': config.dialogue_style or ''
-        }
-        
-        # 替换模板中的变量
-        prompt = template
-        for key, value in variables.items():
-            placeholder = f"{{{key}}}"
-            prompt = prompt.replace(placeholder, value)
-        
-        return prompt
+        return render_template(template, config)
 
 
 class OptionsViewSet(ListModelMixin, GenericViewSet):
@@ -12,7 +12,10 @@ class EnginesAdmin(admin.ModelAdmin):
             'fields': ('name', 'description')
         }),
         ('模型配置', {
-            'fields': ('temperature', 'base_url', 'is_active', 'api_key')
+            'fields': ('temperature', 'base_url', 'is_active', 'supports_json_mode', 'api_key')
+        }),
+        ('生成限制', {
+            'fields': ('max_tokens', 'request_timeout', 'max_retries', 'stop')
         }),
         ('时间信息', {
             'fields': ('created_at', 'updated_at'),
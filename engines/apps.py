@@ -5,3 +5,9 @@ class EnginesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'engines'
     verbose_name = 'AI引擎管理'
+
+    def ready(self):
+        # 模型被修改时广播失效事件，各工作进程移除对应的配置与客户端
+        from utils.invalidation import track
+        from .models import Engines
+        track(Engines)
@@ -0,0 +1,220 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+import openai
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Engines
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_http_client(base_url):
+    """
+    同一个服务地址（scheme + host + port）的模型客户端共用一个 HTTP 连接池
+    管理器重建时不必重新进行 DNS 解析和 TLS 握手，探测请求保持的连接也能被真实调用复用
+    超时由每次调用单独指定，这里只设置连接池的大小与空闲连接的保持时间
+    """
+    parts = urlsplit(base_url or 'https://api.openai.com/v1')
+    key = (parts.scheme, parts.netloc)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=getattr(settings, 'ENGINE_HTTP_MAX_CONNECTIONS', 100),
+                        max_keepalive_connections=getattr(settings, 'ENGINE_HTTP_MAX_KEEPALIVE', 20),
+                        keepalive_expiry=getattr(settings, 'ENGINE_HTTP_KEEPALIVE_EXPIRY', 120),
+                    ),
+                    follow_redirects=True,
+                )
+    return client
+
+
+def chat_completions_client(base_url, api_key, timeout=None, max_retries=2):
+    """
+    使用共享连接池的同步 chat.completions 客户端，作为 ChatOpenAI 的 client 传入
+    （ChatOpenAI 的 http_client 会同时用于同步和异步客户端，不能直接传入同步的连接池）
+    """
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url or None,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=shared_http_client(base_url),
+    ).chat.completions
+
+
+class EngineStats:
+    """单个模型的健康状态：延迟与错误率为指数移动平均，连续失败达到阈值时视为不健康"""
+    __slots__ = ('latency', 'error_rate', 'failures', 'checked_at', 'last_error', 'samples')
+
+    def __init__(self):
+        self.latency = None  # 毫秒
+        self.error_rate = 0.0
+        self.failures = 0
+        self.checked_at = None
+        self.last_error = None
+        self.samples = 0
+
+    def to_dict(self, unhealthy_after):
+        return {
+            'healthy': self.failures < unhealthy_after,
+            'latency_ms': round(self.latency, 1) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 4),
+            'consecutive_failures': self.failures,
+            'checked_at': self.checked_at,
+            'last_error': self.last_error,
+            'samples': self.samples,
+        }
+
+
+class EngineHealth:
+    """
+    按模型名称记录的延迟与错误率，来源为后台探测和真实调用
+    - 探测：定期请求各模型服务的 /models，保持连接池中的连接，测量往返延迟
+    - 真实调用：管理器在每次调用模型后记录耗时与是否出错
+    """
+
+    def __init__(self, interval=30, timeout=5, unhealthy_after=3, alpha=0.3):
+        self.interval = interval
+        self.timeout = timeout
+        self.unhealthy_after = unhealthy_after
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.rounds = 0  # 已完成的探测轮数
+        self.thread = None
+        self.pid = None
+        self.stopped = threading.Event()
+
+    def record(self, name, latency_ms=None, error=None):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = EngineStats()
+            stats.samples += 1
+            stats.checked_at = time.time()
+            stats.error_rate += self.alpha * ((1.0 if error else 0.0) - stats.error_rate)
+            if error:
+                stats.failures += 1
+                stats.last_error = str(error)[:200]
+                return
+            stats.failures = 0
+            if latency_ms is not None:
+                stats.latency = latency_ms if stats.latency is None else stats.latency + self.alpha * (latency_ms - stats.latency)
+
+    def is_healthy(self, name):
+        with self.lock:
+            stats = self.stats.get(name)
+            return stats is not None and stats.failures < self.unhealthy_after
+
+    def fastest(self, names):
+        """候选模型中当前延迟最低的健康模型，都没有探测数据或都不健康时返回 None"""
+        with self.lock:
+            candidates = [
+                (stats.latency, name) for name in names
+                for stats in [self.stats.get(name)]
+                if stats is not None and stats.latency is not None and stats.failures < self.unhealthy_after
+            ]
+        return min(candidates)[1] if candidates else None
+
+    def snapshot(self):
+        with self.lock:
+            return {name: stats.to_dict(self.unhealthy_after) for name, stats in self.stats.items()}
+
+    def probe(self, engine):
+        url = f"{(engine.base_url or 'https://api.openai.com/v1').rstrip('/')}/models"
+        headers = {'Authorization': f'Bearer {engine.api_key}'} if engine.api_key else {}
+        started = time.perf_counter()
+        try:
+            response = shared_http_client(engine.base_url).get(url, headers=headers, timeout=self.timeout)
+        except httpx.HTTPError as e:
+            self.record(engine.name, error=f'{type(e).__name__}: {e}')
+            return
+        latency_ms = (time.perf_counter() - started) * 1000
+        # 部分兼容服务没有 /models 接口（404），连接本身是通的
+        if response.status_code < 400 or response.status_code == 404:
+            self.record(engine.name, latency_ms)
+        else:
+            self.record(engine.name, error=f'HTTP {response.status_code}')
+
+    def probe_all(self):
+        """探测所有启用的模型，每轮重新读取模型列表，新增或修改的模型在下一轮生效"""
+        try:
+            engines = list(Engines.objects.filter(is_active=True).only('name', 'base_url', 'api_key'))
+        finally:
+            close_old_connections()
+        for engine in engines:
+            self.probe(engine)
+        with self.lock:
+            active = {engine.name for engine in engines}
+            for name in list(self.stats):
+                if name not in active:
+                    del self.stats[name]
+            self.rounds += 1
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.probe_all()
+            except Exception:
+                logger.warning("模型健康探测失败", exc_info=True)
+            self.stopped.wait(self.interval)
+
+    def ensure_started(self):
+        """
+        启动后台探测线程，已在运行时不做任何事
+        按进程号判断：预加载应用后 fork 出的工作进程中线程不存在，需要重新启动
+        """
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='engine-health-prober', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    @property
+    def ready(self):
+        """至少完成一轮探测，且至少有一个健康的模型"""
+        with self.lock:
+            return self.rounds > 0 and any(stats.failures < self.unhealthy_after for stats in self.stats.values())
+
+
+_health = None
+_health_lock = threading.Lock()
+
+
+def get_engine_health():
+    global _health
+    if _health is None:
+        with _health_lock:
+            if _health is None:
+                _health = EngineHealth(
+                    interval=getattr(settings, 'ENGINE_PROBE_INTERVAL', 30),
+                    timeout=getattr(settings, 'ENGINE_PROBE_TIMEOUT', 5),
+                    unhealthy_after=getattr(settings, 'ENGINE_UNHEALTHY_AFTER', 3),
+                )
+    return _health
+
+
+def start_prober():
+    """开启 ENGINE_HEALTH_PROBE 时启动后台探测，工作进程启动和管理器重建时调用"""
+    if getattr(settings, 'ENGINE_HEALTH_PROBE', False):
+        get_engine_health().ensure_started()
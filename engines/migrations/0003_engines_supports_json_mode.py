@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engines', '0002_engines_api_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='engines',
+            name='supports_json_mode',
+            field=models.BooleanField(default=False, verbose_name='支持JSON模式'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engines', '0003_engines_supports_json_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='engines',
+            name='max_retries',
+            field=models.PositiveSmallIntegerField(default=2, verbose_name='失败重试次数'),
+        ),
+        migrations.AddField(
+            model_name='engines',
+            name='max_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='最大输出token数'),
+        ),
+        migrations.AddField(
+            model_name='engines',
+            name='request_timeout',
+            field=models.FloatField(blank=True, help_text='留空时使用 ENGINE_DEFAULT_REQUEST_TIMEOUT', null=True, verbose_name='请求超时（秒）'),
+        ),
+        migrations.AddField(
+            model_name='engines',
+            name='stop',
+            field=models.JSONField(blank=True, help_text='字符串列表，生成遇到其中任一时停止', null=True, verbose_name='停止序列'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 
 # Create your models here.
@@ -9,6 +11,14 @@ class Engines(models.Model):
     base_url = models.URLField('模型URL', blank=True)
     api_key = models.CharField('模型密钥', max_length=255, blank=True, null=True)
     is_active = models.BooleanField('是否启用模型', default=True)
+    # 兼容 OpenAI 的 response_format={"type": "json_object"}，设置了输出结构的助手使用该模式
+    supports_json_mode = models.BooleanField('支持JSON模式', default=False)
+    # 生成限制，在模型客户端上生效，避免失控的生成长时间占用工作进程；助手可以单独覆盖
+    max_tokens = models.PositiveIntegerField('最大输出token数', blank=True, null=True)
+    request_timeout = models.FloatField('请求超时（秒）', blank=True, null=True,
+                                        help_text='留空时使用 ENGINE_DEFAULT_REQUEST_TIMEOUT')
+    max_retries = models.PositiveSmallIntegerField('失败重试次数', default=2)
+    stop = models.JSONField('停止序列', blank=True, null=True, help_text='字符串列表，生成遇到其中任一时停止')
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
 
@@ -19,4 +29,19 @@ class Engines(models.Model):
         ordering = ['-is_active', 'name']
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+    def clean(self):
+        if self.stop is not None and not (isinstance(self.stop, list) and all(isinstance(s, str) for s in self.stop)):
+            raise ValidationError({'stop': '停止序列必须是字符串列表'})
+
+    def client_options(self):
+        """创建模型客户端（ChatOpenAI）时使用的生成参数"""
+        options = {
+            'temperature': self.temperature,
+            'request_timeout': self.request_timeout or getattr(settings, 'ENGINE_DEFAULT_REQUEST_TIMEOUT', 60),
+            'max_retries': self.max_retries,
+        }
+        if self.max_tokens:
+            options['max_tokens'] = self.max_tokens
+        return options
\ No newline at end of file
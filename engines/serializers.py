@@ -13,6 +13,12 @@ class EnginesSerializer(serializers.ModelSerializer):
         model = Engines
         fields = [
             'id', 'name', 'description', 'temperature',
-            'base_url', 'is_active', 'created_at', 'updated_at'
+            'base_url', 'is_active', 'supports_json_mode',
+            'max_tokens', 'request_timeout', 'max_retries', 'stop', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def validate_stop(self, value):
+        if value is not None and not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+            raise serializers.ValidationError("停止序列必须是字符串列表")
+        return value
@@ -1,3 +1,101 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from middleware.auth import TokenAuthMiddleware
+from .health import EngineHealth
+from .views import EnginesViewSet
+
+
+class EngineHealthTest(TestCase):
+    """延迟为指数移动平均，连续失败达到阈值时不健康，成功后恢复"""
+
+    def setUp(self):
+        self.health = EngineHealth(unhealthy_after=2, alpha=0.5)
+
+    def test_record(self):
+        self.health.record('a', latency_ms=100)
+        self.health.record('a', latency_ms=200)
+        stats = self.health.snapshot()['a']
+        self.assertEqual(stats['latency_ms'], 150)
+        self.assertEqual((stats['samples'], stats['error_rate'], stats['healthy']), (2, 0, True))
+
+        self.health.record('a', error=ValueError('boom'))
+        self.assertTrue(self.health.is_healthy('a'))
+        self.health.record('a', error=ValueError('boom'))
+        self.assertFalse(self.health.is_healthy('a'))
+        stats = self.health.snapshot()['a']
+        self.assertEqual((stats['consecutive_failures'], stats['last_error']), (2, 'boom'))
+        self.assertEqual(stats['latency_ms'], 150)  # 失败不计入延迟
+
+        self.health.record('a', latency_ms=150)
+        self.assertTrue(self.health.is_healthy('a'))
+
+    def test_fastest(self):
+        self.assertIsNone(self.health.fastest(['a', 'b']))
+        self.health.record('a', latency_ms=300)
+        self.health.record('b', latency_ms=100)
+        self.health.record('c')  # 没有延迟数据
+        self.assertEqual(self.health.fastest(['a', 'b', 'c']), 'b')
+        for _ in range(2):
+            self.health.record('b', error='timeout')
+        self.assertEqual(self.health.fastest(['a', 'b']), 'a')
+
+    def test_ready(self):
+        self.health.record('a', latency_ms=100)
+        self.assertFalse(self.health.ready)  # 还没有完成一轮探测
+        self.health.rounds = 1
+        self.assertTrue(self.health.ready)
+        for _ in range(2):
+            self.health.record('a', error='timeout')
+        self.assertFalse(self.health.ready)
+
+
+class HealthViewTest(TestCase):
+    """就绪检查不需要认证且只返回是否就绪，健康状态（含模型名称与错误信息）需要认证"""
+
+    def setUp(self):
+        self.health = EngineHealth(unhealthy_after=1)
+        self.health.ensure_started = mock.Mock()
+        patcher = mock.patch('engines.views.get_engine_health', return_value=self.health)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+
+    def get(self, action, user=None):
+        request = self.factory.get(f'/api/engines/{action}/')
+        request.remote_user = user
+        # 与路由一致，使用 @action 上的 permission_classes 等参数
+        return EnginesViewSet.as_view({'get': action}, **getattr(EnginesViewSet, action).kwargs)(request)
+
+    @override_settings(ENGINE_HEALTH_PROBE=True)
+    def test_ready(self):
+        self.assertEqual(self.get('ready').status_code, 503)
+        self.health.ensure_started.assert_called_once()
+
+        self.health.record('qwen-max', error='https://internal-host/v1: 401 invalid key sk-123')
+        self.health.rounds = 1
+        response = self.get('ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('internal-host', str(response.data))
+
+        self.health.record('qwen-max', latency_ms=50)
+        response = self.get('ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['data'])
+
+    @override_settings(ENGINE_HEALTH_PROBE=False)
+    def test_ready_without_probe(self):
+        self.assertEqual(self.get('ready').status_code, 200)
+
+    def test_health_requires_authentication(self):
+        middleware = TokenAuthMiddleware(lambda request: None)
+        self.assertTrue(middleware.should_authenticate(self.factory.get('/api/engines/health/')))
+        self.assertFalse(middleware.should_authenticate(self.factory.get('/api/engines/ready/')))
+
+        self.health.record('qwen-max', error='https://internal-host/v1: 401')
+        self.assertEqual(self.get('health').status_code, 403)
+        response = self.get('health', user={'id': 1, 'is_premium': False})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('qwen-max', response.data['data']['engines'])
@@ -1,14 +1,64 @@
+from django.conf import settings
+from django.db import connection
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
 from utils.mixins import *
+from .health import get_engine_health
 from .models import Engines
 from .serializers import EnginesSerializer
+from utils.pagination import StandardCursorPagination
 from utils.permissions import IsAuthenticatedExternal
 from rest_framework.viewsets import GenericViewSet
 
 
-class EnginesViewSet(ListModelMixin,
+class EnginesViewSet(SparseFieldsMixin,
+                       ListModelMixin,
                        RetrieveModelMixin,
                        GenericViewSet):
 
     queryset = Engines.objects.all()
     serializer_class = EnginesSerializer
-    permission_classes = [IsAuthenticatedExternal]
\ No newline at end of file
+    permission_classes = [IsAuthenticatedExternal]
+    pagination_class = StandardCursorPagination
+
+    @swagger_auto_schema(
+        operation_summary="模型健康状态",
+        operation_description="当前进程记录的各模型延迟（毫秒）、错误率与连续失败次数，来源为后台探测和真实调用；"
+                              "包含模型名称与上游错误信息，需要认证"
+    )
+    @action(detail=False, methods=['get'])
+    def health(self, request):
+        health = get_engine_health()
+        return Response({
+            "status": "success",
+            "message": "请求已接收",
+            "data": {
+                "probing": getattr(settings, 'ENGINE_HEALTH_PROBE', False),
+                "rounds": health.rounds,
+                "engines": health.snapshot(),
+            }
+        })
+
+    @swagger_auto_schema(
+        operation_summary="就绪检查",
+        operation_description="数据库可用，且（开启健康探测时）已完成一轮探测并至少有一个健康的模型时返回 200，否则返回 503；不需要认证"
+    )
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny], authentication_classes=[])
+    def ready(self, request):
+        try:
+            connection.ensure_connection()
+        except Exception:
+            return Response({"status": "error", "message": "数据库不可用", "data": None},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if getattr(settings, 'ENGINE_HEALTH_PROBE', False):
+            health = get_engine_health()
+            # 就绪检查通常早于第一个业务请求，在这里启动探测，连接在接收流量前就已建立
+            health.ensure_started()
+            if not health.ready:
+                return Response({"status": "error", "message": "模型尚未就绪", "data": None},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"status": "success", "message": "就绪", "data": None})
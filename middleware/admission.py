@@ -0,0 +1,170 @@
+# middleware/admission.py
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from utils import deadline
+
+PREMIUM = 'premium'
+FREE = 'free'
+
+# acquire 的拒绝原因
+USER_LIMIT = 'user_limit'
+OVERLOADED = 'overloaded'
+TIMEOUT = 'timeout'
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'event', 'granted')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    进程内的并发准入控制
+    - 同时执行的请求数不超过 capacity，超出的请求按等级进入各自的等待队列
+    - 有空位时按平滑加权轮询从各等级队列中选出下一个请求，付费用户权重更高
+    - 队列已满、等待超时、或单个用户的并发（含排队）超过上限时拒绝
+    """
+
+    def __init__(self, capacity, weights, max_queued, per_user_limit):
+        self.capacity = capacity
+        self.weights = dict(weights)
+        self.max_queued = dict(max_queued)
+        self.per_user_limit = dict(per_user_limit)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.per_user = {}
+        self.queues = {tier: deque() for tier in self.weights}
+        self.current_weights = {tier: 0 for tier in self.weights}
+        self.avg_duration = 1.0  # 请求耗时的指数移动平均（秒），用于估算 Retry-After
+
+    def acquire(self, user_id, tier, timeout):
+        """获得执行许可返回 None，否则返回拒绝原因"""
+        with self.lock:
+            if self.per_user.get(user_id, 0) >= self.per_user_limit[tier]:
+                return USER_LIMIT
+            if self.in_flight < self.capacity and not any(self.queues.values()):
+                self.in_flight += 1
+                self.per_user[user_id] = self.per_user.get(user_id, 0) + 1
+                return None
+            if len(self.queues[tier]) >= self.max_queued[tier]:
+                return OVERLOADED
+            waiter = _Waiter(user_id)
+            self.queues[tier].append(waiter)
+            self.per_user[user_id] = self.per_user.get(user_id, 0) + 1
+
+        if waiter.event.wait(timeout):
+            return None
+        with self.lock:
+            # 超时与被唤醒可能同时发生
+            if waiter.granted:
+                return None
+            self.queues[tier].remove(waiter)
+            self._decrement_user(user_id)
+        return TIMEOUT
+
+    def release(self, user_id, duration=None):
+        with self.lock:
+            self._decrement_user(user_id)
+            if duration is not None:
+                self.avg_duration = self.avg_duration * 0.9 + duration * 0.1
+            waiter = self._next_waiter()
+            if waiter is None:
+                self.in_flight -= 1
+            else:
+                # 名额直接转给等待者，in_flight 不变
+                waiter.granted = True
+                waiter.event.set()
+
+    def retry_after(self):
+        """按当前排队长度和平均耗时估算的重试等待秒数"""
+        with self.lock:
+            queued = sum(len(queue) for queue in self.queues.values())
+            estimate = self.avg_duration * (queued + self.in_flight) / max(self.capacity, 1)
+        return max(1, math.ceil(estimate))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': self.in_flight,
+                'capacity': self.capacity,
+                'queued': {tier: len(queue) for tier, queue in self.queues.items()},
+                'avg_duration': self.avg_duration,
+            }
+
+    def _decrement_user(self, user_id):
+        count = self.per_user.get(user_id, 0) - 1
+        if count > 0:
+            self.per_user[user_id] = count
+        else:
+            self.per_user.pop(user_id, None)
+
+    def _next_waiter(self):
+        """平滑加权轮询：只在非空队列之间分配，权重之比即出队次数之比"""
+        active = [tier for tier, queue in self.queues.items() if queue]
+        if not active:
+            return None
+        total = 0
+        for tier in active:
+            self.current_weights[tier] += self.weights[tier]
+            total += self.weights[tier]
+        chosen = max(active, key=lambda tier: self.current_weights[tier])
+        self.current_weights[chosen] -= total
+        return self.queues[chosen].popleft()
+
+
+class AdmissionControlMiddleware:
+    """
+    对聊天等调用大模型的接口做准入控制，过载时尽早返回 503 和 Retry-After
+    需放在 TokenAuthMiddleware 之后，根据 remote_user['is_premium'] 区分队列
+    限制以进程为单位，总并发约为 ADMISSION_MAX_IN_FLIGHT × 进程数
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(getattr(settings, 'ADMISSION_CONTROL_PATHS', ['/api/agent/chat/']))
+        self.queue_timeout = dict(getattr(settings, 'ADMISSION_QUEUE_TIMEOUT', {PREMIUM: 10, FREE: 3}))
+        self.controller = AdmissionController(
+            capacity=getattr(settings, 'ADMISSION_MAX_IN_FLIGHT', 32),
+            weights=getattr(settings, 'ADMISSION_QUEUE_WEIGHTS', {PREMIUM: 4, FREE: 1}),
+            max_queued=getattr(settings, 'ADMISSION_MAX_QUEUED', {PREMIUM: 64, FREE: 16}),
+            per_user_limit=getattr(settings, 'ADMISSION_PER_USER_LIMIT', {PREMIUM: 4, FREE: 2}),
+        )
+
+    def __call__(self, request):
+        remote_user = getattr(request, 'remote_user', None)
+        if request.method == 'OPTIONS' or remote_user is None or not request.path_info.startswith(self.paths):
+            return self.get_response(request)
+
+        user_id = remote_user.get('id')
+        tier = PREMIUM if remote_user.get('is_premium', False) else FREE
+        # 排队时间不超过请求剩余的时间
+        try:
+            queue_timeout = deadline.timeout(self.queue_timeout[tier])
+        except deadline.DeadlineExceeded as e:
+            return JsonResponse({'detail': e.detail}, status=e.status_code)
+        rejected = self.controller.acquire(user_id, tier, queue_timeout)
+        if rejected == USER_LIMIT:
+            return self.reject('Too many concurrent requests', 429)
+        if rejected:
+            return self.reject('Service overloaded, please retry later', 503)
+
+        started = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            self.controller.release(user_id, time.monotonic() - started)
+
+    def reject(self, detail, status):
+        response = JsonResponse({'detail': detail}, status=status)
+        response['Retry-After'] = str(self.controller.retry_after())
+        return response
@@ -1,10 +1,142 @@
 # middleware/auth.py
+import json
+import logging
+import threading
+
+import jwt
 import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, rsa
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.http import JsonResponse
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from utils import deadline
+
+logger = logging.getLogger(__name__)
+
+# 椭圆曲线与 JWS 算法的对应关系
+CURVE_ALGORITHMS = {
+    'secp256r1': 'ES256',
+    'secp384r1': 'ES384',
+    'secp521r1': 'ES512',
+    'secp256k1': 'ES256K',
+}
+
+
+def key_algorithms(key):
+    """公钥类型可用的签名算法，避免用 RSA 公钥去校验声明为 ES256 的令牌等错配"""
+    if isinstance(key, rsa.RSAPublicKey):
+        return {'RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512'}
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        return {CURVE_ALGORITHMS[key.curve.name]} if key.curve.name in CURVE_ALGORITHMS else set()
+    if isinstance(key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+        return {'EdDSA'}
+    return set()
+
+
+class LocalTokenVerifier:
+    """
+    使用配置的公钥或 JWKS 文件在本地校验签名令牌，不产生任何网络请求
+    - verify 返回 remote_user 字典
+    - 令牌不是 JWT，或找不到与其 kid 对应的公钥时返回 None，交给用户服务处理
+    - 签名、过期时间、aud/iss 等校验失败时抛出 jwt.InvalidTokenError
+    每个公钥只接受 AUTH_JWT_ALGORITHMS 中与其类型相符的算法，JWKS 中声明了 alg 的公钥只接受该算法
+    """
+
+    def __init__(self):
+        self.algorithms = list(getattr(settings, 'AUTH_JWT_ALGORITHMS', ['RS256']))
+        self.audience = getattr(settings, 'AUTH_JWT_AUDIENCE', None)
+        self.issuer = getattr(settings, 'AUTH_JWT_ISSUER', None)
+        self.leeway = getattr(settings, 'AUTH_JWT_LEEWAY', 0)
+        self.claims = dict(getattr(settings, 'AUTH_JWT_CLAIMS', {'id': 'user_id', 'is_premium': 'is_premium'}))
+        self.default_key = self.load_public_key()
+        self.keys = self.load_jwks()
+
+    @property
+    def enabled(self):
+        return self.default_key is not None or bool(self.keys)
+
+    def allowed(self, key, name, declared=None):
+        """返回 (公钥, 可用算法列表)，没有可用的算法时视为配置错误"""
+        algorithms = [alg for alg in self.algorithms
+                      if alg in key_algorithms(key) and (declared is None or alg == declared)]
+        if not algorithms:
+            raise ImproperlyConfigured(f"{name} 的公钥类型与 AUTH_JWT_ALGORITHMS 中的算法都不匹配")
+        return key, algorithms
+
+    def load_public_key(self):
+        key = getattr(settings, 'AUTH_JWT_PUBLIC_KEY', None)
+        path = getattr(settings, 'AUTH_JWT_PUBLIC_KEY_FILE', None)
+        if not key and path:
+            with open(path) as f:
+                key = f.read()
+        if not key:
+            return None
+        try:
+            public_key = serialization.load_pem_public_key(key.encode() if isinstance(key, str) else key)
+        except ValueError as e:
+            raise ImproperlyConfigured(f"AUTH_JWT_PUBLIC_KEY 不是有效的 PEM 公钥: {e}")
+        return self.allowed(public_key, 'AUTH_JWT_PUBLIC_KEY')
+
+    def load_jwks(self):
+        """读取 JWKS 文件，返回 {kid: (公钥, 可用算法列表)}"""
+        path = getattr(settings, 'AUTH_JWT_JWKS_FILE', None)
+        if not path:
+            return {}
+        with open(path) as f:
+            content = f.read()
+        try:
+            jwk_set = jwt.PyJWKSet.from_json(content)
+        except jwt.PyJWKSetError as e:
+            raise ImproperlyConfigured(f"AUTH_JWT_JWKS_FILE 无效: {e}")
+        declared = {item.get('kid'): item.get('alg') for item in json.loads(content)['keys']}
+        return {
+            jwk.key_id: self.allowed(jwk.key, f'AUTH_JWT_JWKS_FILE（kid={jwk.key_id}）', declared.get(jwk.key_id))
+            for jwk in jwk_set.keys
+        }
+
+    def resolve_key(self, header):
+        kid = header.get('kid')
+        if kid is not None and kid in self.keys:
+            return self.keys[kid]
+        if self.default_key is not None:
+            return self.default_key
+        if kid is None and len(self.keys) == 1:
+            return next(iter(self.keys.values()))
+        return None
+
+    def verify(self, token):
+        # 兼容带认证方案前缀的令牌（如 "Bearer xxx"）
+        token = token.rsplit(' ', 1)[-1]
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.DecodeError:
+            return None  # 不透明令牌
+        resolved = self.resolve_key(header)
+        if resolved is None:
+            logger.debug("没有与 kid=%s 对应的公钥，交给用户服务校验", header.get('kid'))
+            return None
+
+        key, algorithms = resolved
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={'require': ['exp'], 'verify_aud': self.audience is not None},
+        )
+
+        user_info = {field: claims[claim] for field, claim in self.claims.items() if claim in claims}
+        if user_info.get('id') is None:
+            raise jwt.MissingRequiredClaimError(self.claims.get('id', 'id'))
+        user_info['is_premium'] = bool(user_info.get('is_premium', False))
+        return user_info
+
 
 class TokenAuthMiddleware:
     def __init__(self, get_response):
@@ -13,8 +145,23 @@ class TokenAuthMiddleware:
         self.exempt_paths = [
             '/users/api/auth/login/',
             '/admin/',
-            '/openapi.json'
+            '/openapi.json',
+            '/api/engines/ready/',
         ]
+        self.local_verifier = LocalTokenVerifier()
+
+        # 复用连接，避免每次回退到用户服务时都重新建立 TLS 连接
+        # requests.Session 不是线程安全的，每个工作线程使用自己的会话
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            retries = Retry(total=2, backoff_factor=0.1)
+            session.mount('https://', HTTPAdapter(max_retries=retries))
+        return session
 
     def __call__(self, request):
         if request.method == 'OPTIONS':
@@ -37,16 +184,25 @@ class TokenAuthMiddleware:
         if not token:
             return JsonResponse({'detail': 'Missing credentials'}, status=401)
 
-        session = requests.Session()
-        retries = Retry(total=2, backoff_factor=0.1)
-        session.mount('https://', HTTPAdapter(max_retries=retries))
+        if self.local_verifier.enabled:
+            try:
+                user_info = self.local_verifier.verify(token)
+            except jwt.PyJWTError:
+                # 包括签名校验失败、过期、aud/iss 不符以及算法与公钥不匹配（InvalidKeyError）
+                return JsonResponse({'detail': 'Invalid token'}, status=401)
+            if user_info is not None:
+                return user_info
+
+        return self.authenticate_remote(token)
 
+    def authenticate_remote(self, token):
+        """调用用户服务解析不透明令牌，超时不超过请求剩余的时间"""
         try:
             # 直接发送原始Token（无Bearer前缀）
-            response = session.get(
+            response = self.session.get(
                 self.auth_api_url,
                 headers={'Authorization': token},  # 关键修改点
-                timeout=3
+                timeout=deadline.timeout(3)
             )
             response.raise_for_status()
             return response.json().get('data', {})
@@ -55,6 +211,8 @@ class TokenAuthMiddleware:
                 {'detail': 'Invalid token'},
                 status=401 if e.response.status_code == 401 else 503
             )
+        except deadline.DeadlineExceeded as e:
+            return JsonResponse({'detail': e.detail}, status=e.status_code)
         except requests.RequestException:
             return JsonResponse({'detail': 'Auth service error'}, status=503)
 
@@ -0,0 +1,52 @@
+# middleware/compression.py
+import re
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # 已列入 requirements/base.txt，未安装时只使用 gzip
+    brotli = None
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    响应压缩中间件
+    - 客户端支持且安装了 brotli 时优先使用 brotli，否则使用 gzip
+    - 小于 RESPONSE_COMPRESSION_MIN_SIZE 字节的响应不压缩
+    - 流式响应只做 gzip
+    需放在 MIDDLEWARE 靠前的位置，保证在其他中间件修改响应体之后再压缩
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.min_size = getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+        self.brotli_quality = getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 5)
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return super().process_response(request, response)
+
+        if len(response.content) < self.min_size or response.has_header('Content-Encoding'):
+            return response
+
+        ae = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is None or not re_accepts_brotli.search(ae):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed_content = brotli.compress(response.content, quality=self.brotli_quality)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import math
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from agent import metrics
+from utils import deadline
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineMiddleware:
+    """
+    为每个请求设置截止时间，认证、数据库查询和模型调用都以剩余时间为上限
+    - 截止时间取请求头 X-Request-Timeout（秒），缺省为 REQUEST_DEADLINE_DEFAULT，不超过 REQUEST_DEADLINE_MAX
+      助手设置了 request_timeout 时会进一步缩短（客户端只能缩短、不能延长）
+    - ASGI 部署下客户端断开时，Django 取消请求任务，这里设置取消标记，执行视图的线程在下一个检查点
+      （包括模型流式输出的每个 token）中止上游调用，不再写入记忆
+    需放在 MIDDLEWARE 的最前面
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.default = getattr(settings, 'REQUEST_DEADLINE_DEFAULT', 60)
+        self.max = getattr(settings, 'REQUEST_DEADLINE_MAX', 300)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def seconds(self, request):
+        value = request.headers.get('X-Request-Timeout')
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                seconds = None
+            # nan 与任何数比较都为 False，会绕过上下限使截止时间失效
+            if seconds is not None and math.isfinite(seconds):
+                return min(max(seconds, 0.1), self.max)
+        return self.default
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        current, token = deadline.activate(self.seconds(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            deadline.deactivate(token)
+        self.record(response)
+        return response
+
+    async def __acall__(self, request):
+        current, token = deadline.activate(self.seconds(request))
+        try:
+            response = await self.get_response(request)
+        except asyncio.CancelledError:
+            current.cancel()
+            metrics.incr('requests.cancelled')
+            logger.info("客户端断开，已取消请求 %s", request.path)
+            raise
+        finally:
+            deadline.deactivate(token)
+        self.record(response)
+        return response
+
+    def record(self, response):
+        if response.status_code == deadline.DeadlineExceeded.status_code:
+            metrics.incr('requests.deadline_exceeded')
@@ -0,0 +1,220 @@
+import gzip
+import threading
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from .admission import AdmissionControlMiddleware
+from .auth import TokenAuthMiddleware
+from .compression import CompressionMiddleware, brotli
+from .deadline import DeadlineMiddleware
+
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+EC_KEY = ec.generate_private_key(ec.SECP256R1())
+
+
+def public_pem(private_key):
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+
+
+@override_settings(
+    AUTH_JWT_PUBLIC_KEY=public_pem(RSA_KEY),
+    AUTH_JWT_JWKS_FILE=None,
+    AUTH_JWT_ALGORITHMS=['RS256', 'ES256', 'EdDSA'],
+    AUTH_JWT_AUDIENCE='agent',
+    AUTH_JWT_ISSUER='users',
+    AUTH_JWT_LEEWAY=0,
+)
+class LocalTokenAuthTest(SimpleTestCase):
+    """本地校验签名令牌：校验失败（包括算法与公钥不匹配）时返回 401，不产生 500"""
+
+    def setUp(self):
+        self.middleware = TokenAuthMiddleware(lambda request: JsonResponse(request.remote_user))
+        self.factory = RequestFactory()
+
+    def token(self, key=RSA_KEY, algorithm='RS256', **overrides):
+        claims = {'user_id': 7, 'is_premium': True, 'aud': 'agent', 'iss': 'users', 'exp': int(time.time()) + 60}
+        claims.update(overrides)
+        return jwt.encode(claims, key, algorithm=algorithm)
+
+    def get(self, token):
+        return self.middleware(self.factory.get('/api/agent/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+
+    def test_valid_token(self):
+        response = self.get(self.token())
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {'id': 7, 'is_premium': True})
+
+    def test_expired_token(self):
+        self.assertEqual(self.get(self.token(exp=int(time.time()) - 10)).status_code, 401)
+
+    def test_wrong_audience_or_issuer(self):
+        self.assertEqual(self.get(self.token(aud='other')).status_code, 401)
+        self.assertEqual(self.get(self.token(iss='other')).status_code, 401)
+
+    def test_algorithm_key_mismatch(self):
+        # 配置的是 RSA 公钥，声明为 ES256 的令牌不会被交给 RSA 公钥校验
+        self.assertEqual(self.get(self.token(key=EC_KEY, algorithm='ES256')).status_code, 401)
+        # 以公钥作为 HMAC 密钥伪造的令牌
+        forged = jwt.api_jws.PyJWS().encode(
+            b'{"user_id": 1, "aud": "agent", "iss": "users", "exp": 9999999999}',
+            b'secret', algorithm='HS256',
+        )
+        self.assertEqual(self.get(forged).status_code, 401)
+
+    def test_key_type_matching_no_algorithm_is_rejected(self):
+        with override_settings(AUTH_JWT_ALGORITHMS=['ES256']):
+            with self.assertRaises(ImproperlyConfigured):
+                TokenAuthMiddleware(lambda request: None)
+
+    def test_ec_key_accepts_only_its_curve(self):
+        with override_settings(AUTH_JWT_PUBLIC_KEY=public_pem(EC_KEY)):
+            middleware = TokenAuthMiddleware(lambda request: JsonResponse(request.remote_user))
+        self.assertEqual(middleware.local_verifier.default_key[1], ['ES256'])
+        request = self.factory.get('/api/agent/', HTTP_AUTHORIZATION=self.token(key=EC_KEY, algorithm='ES256'))
+        self.assertEqual(middleware(request).status_code, 200)
+        request = self.factory.get('/api/agent/', HTTP_AUTHORIZATION=self.token())
+        self.assertEqual(middleware(request).status_code, 401)
+
+    def test_session_per_thread(self):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(self.middleware.session))
+        thread.start()
+        thread.join()
+        self.assertIs(self.middleware.session, self.middleware.session)
+        self.assertIsNot(sessions[0], self.middleware.session)
+
+
+class DeadlineHeaderTest(SimpleTestCase):
+    """X-Request-Timeout 不是有限的数字时使用默认截止时间"""
+
+    @override_settings(REQUEST_DEADLINE_DEFAULT=60, REQUEST_DEADLINE_MAX=300)
+    def test_seconds(self):
+        middleware = DeadlineMiddleware(lambda request: None)
+        factory = RequestFactory()
+        for value, expected in [('5', 5), ('0', 0.1), ('1000', 300), ('abc', 60),
+                                ('nan', 60), ('NaN', 60), ('inf', 60), ('-inf', 60)]:
+            with self.subTest(value=value):
+                self.assertEqual(middleware.seconds(factory.get('/', HTTP_X_REQUEST_TIMEOUT=value)), expected)
+
+
+@override_settings(
+    ADMISSION_CONTROL_PATHS=['/api/agent/'],
+    ADMISSION_MAX_IN_FLIGHT=1,
+    ADMISSION_QUEUE_WEIGHTS={'premium': 4, 'free': 1},
+    ADMISSION_MAX_QUEUED={'premium': 1, 'free': 0},
+    ADMISSION_QUEUE_TIMEOUT={'premium': 0.05, 'free': 0.05},
+    ADMISSION_PER_USER_LIMIT={'premium': 2, 'free': 1},
+)
+class AdmissionControlTest(SimpleTestCase):
+    """并发已满时按用户上限返回 429、队列已满或排队超时返回 503，两者都带 Retry-After"""
+
+    def setUp(self):
+        self.entered, self.finish = threading.Event(), threading.Event()
+
+        def get_response(request):
+            if request.path_info.startswith('/api/agent/'):
+                self.entered.set()
+                self.finish.wait(5)
+            return JsonResponse({'ok': True})
+
+        self.middleware = AdmissionControlMiddleware(get_response)
+        self.factory = RequestFactory()
+
+    def call(self, user_id, is_premium=False, path='/api/agent/'):
+        request = self.factory.post(path)
+        request.remote_user = {'id': user_id, 'is_premium': is_premium}
+        return self.middleware(request)
+
+    def occupy(self, user_id):
+        """启动一个占用唯一执行名额的请求"""
+        thread = threading.Thread(target=self.call, args=(user_id,))
+        thread.start()
+        self.assertTrue(self.entered.wait(1))
+        self.addCleanup(thread.join)
+        self.addCleanup(self.finish.set)
+
+    def assertRejected(self, response, status):
+        self.assertEqual(response.status_code, status)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_user_limit(self):
+        self.occupy(1)
+        self.assertRejected(self.call(1), 429)
+
+    def test_queue_full(self):
+        self.occupy(1)
+        self.assertRejected(self.call(2), 503)
+
+    def test_queue_timeout(self):
+        self.occupy(1)
+        self.assertRejected(self.call(2, is_premium=True), 503)
+        self.assertEqual(self.middleware.controller.stats()['queued'], {'premium': 0, 'free': 0})
+
+    def test_admitted_after_release(self):
+        self.occupy(1)
+        self.finish.set()
+        for _ in range(100):
+            if self.middleware.controller.stats()['in_flight'] == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.call(2).status_code, 200)
+
+    def test_other_paths_are_not_limited(self):
+        self.occupy(1)
+        self.assertEqual(self.call(1, path='/api/assistant/templates/').status_code, 200)
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_SIZE=1024, RESPONSE_COMPRESSION_BROTLI_QUALITY=5)
+class CompressionTest(SimpleTestCase):
+    """按 Accept-Encoding 选择 brotli 或 gzip，小响应、已编码的响应不压缩，流式响应只做 gzip"""
+    body = ('{"content": "%s"}' % ('你好，今天过得怎么样？' * 200)).encode()
+
+    def call(self, response, accept_encoding=None):
+        headers = {'HTTP_ACCEPT_ENCODING': accept_encoding} if accept_encoding is not None else {}
+        request = RequestFactory().get('/api/agent/', **headers)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_negotiation(self):
+        response = self.call(HttpResponse(self.body), 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        response = self.call(HttpResponse(self.body))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.body)
+
+        response = self.call(HttpResponse(self.body), 'deflate, gzip;q=0.5, br')
+        if brotli is None:
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+        else:
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(brotli.decompress(response.content), self.body)
+            self.assertEqual(response['Content-Length'], str(len(response.content)))
+            self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_min_size(self):
+        small = self.body[:1000]
+        response = self.call(HttpResponse(small), 'gzip, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, small)
+
+    def test_already_encoded(self):
+        original = HttpResponse(self.body)
+        original['Content-Encoding'] = 'identity'
+        response = self.call(original, 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'identity')
+        self.assertEqual(response.content, self.body)
+
+    def test_streaming_uses_gzip(self):
+        response = self.call(StreamingHttpResponse(iter([self.body[:10], self.body[10:]])), 'br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body)
@@ -0,0 +1,96 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class DeadlineExceeded(APIException):
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = '请求超过截止时间'
+    default_code = 'deadline_exceeded'
+
+
+class RequestCancelled(APIException):
+    # 客户端已断开，响应不会被读取，状态码沿用 nginx 的 499
+    status_code = 499
+    default_detail = '客户端已断开连接'
+    default_code = 'request_cancelled'
+
+
+class Deadline:
+    """
+    单个请求的截止时间与取消标记
+    截止时间使用单调时钟；取消标记为 threading.Event，异步中间件在客户端断开时设置，执行视图的线程可以看到
+    """
+    __slots__ = ('expires_at', 'cancelled')
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+        self.cancelled = threading.Event()
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def narrow(self, seconds):
+        """只能缩短，不能延长"""
+        self.expires_at = min(self.expires_at, time.monotonic() + seconds)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise RequestCancelled()
+        if self.remaining() <= 0:
+            raise DeadlineExceeded()
+
+
+_current = ContextVar('request_deadline', default=None)
+
+
+def activate(seconds):
+    """为当前上下文设置截止时间，返回 (Deadline, token)，结束时用 token 调用 deactivate"""
+    deadline = Deadline(seconds)
+    return deadline, _current.set(deadline)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def current():
+    """当前请求的截止时间，不在请求中（如管理命令）时为 None"""
+    return _current.get()
+
+
+def check():
+    """已取消或已超时时抛出 RequestCancelled / DeadlineExceeded"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def is_cancelled():
+    deadline = _current.get()
+    return deadline is not None and deadline.cancelled.is_set()
+
+
+def narrow(seconds):
+    deadline = _current.get()
+    if deadline is not None and seconds:
+        deadline.narrow(seconds)
+
+
+def timeout(default):
+    """
+    下游调用（用户服务、模型）使用的超时：不超过剩余时间
+    已经超时时抛出 DeadlineExceeded，没有截止时间时返回 default
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    deadline.check()
+    remaining = deadline.remaining()
+    return remaining if default is None else min(default, remaining)
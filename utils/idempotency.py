@@ -0,0 +1,156 @@
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+from agent import metrics
+from utils import deadline
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# begin 的结果
+OWNER = 'owner'
+REPLAY = 'replay'
+CONFLICT = 'conflict'
+IN_PROGRESS = 'in_progress'
+
+
+class IdempotencyStore:
+    """
+    以 Idempotency-Key 合并重复请求，记录保存在 IDEMPOTENCY_CACHE_ALIAS 指向的缓存中
+    - 第一个请求以 cache.add 占位后执行，成功的响应保存 IDEMPOTENCY_TTL 秒，期间相同的请求直接重放
+    - 执行期间到达的相同请求等待其结果；执行失败（非 2xx 或抛出异常）时删除占位，等待者中的一个重新执行
+    - 同一个键对应的请求体不同时视为冲突
+    缓存为 django-redis 等共享缓存时多进程之间合并，否则只在进程内合并
+    进程内的等待者由条件变量唤醒，其他进程的结果通过轮询得到
+    """
+
+    def __init__(self, alias, ttl, lock_ttl, poll_interval=0.2):
+        self.alias = alias
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl  # 占位的有效期，执行者异常退出（如进程被杀）时到期后可重新执行
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def begin(self, key, fingerprint, timeout):
+        """返回 (结果, 已保存的响应)，结果为 OWNER / REPLAY / CONFLICT / IN_PROGRESS"""
+        waited = False
+        expires_at = time.monotonic() + timeout
+        while True:
+            if self.cache.add(key, {'fingerprint': fingerprint}, self.lock_ttl):
+                return OWNER, None
+            record = self.cache.get(key)
+            if record is None:
+                continue  # 占位恰好过期或被删除
+            if record['fingerprint'] != fingerprint:
+                return CONFLICT, None
+            if 'status' in record:
+                return REPLAY, record
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                return IN_PROGRESS, None
+            if not waited:
+                metrics.incr('idempotency.waited')
+                waited = True
+            with self.condition:
+                self.condition.wait(min(self.poll_interval, remaining))
+            deadline.check()
+
+    def finish(self, key, fingerprint, response=None):
+        """保存成功的响应；response 为 None 时删除占位，允许重新执行"""
+        if response is None:
+            self.cache.delete(key)
+        else:
+            self.cache.set(key, {
+                'fingerprint': fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+            }, self.ttl)
+        with self.condition:
+            self.condition.notify_all()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = IdempotencyStore(
+                    alias=getattr(settings, 'IDEMPOTENCY_CACHE_ALIAS', 'default'),
+                    ttl=getattr(settings, 'IDEMPOTENCY_TTL', 300),
+                    lock_ttl=getattr(settings, 'IDEMPOTENCY_LOCK_TTL', 330),
+                )
+    return _store
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def idempotent(scope):
+    """
+    视图方法装饰器：请求带有 Idempotency-Key 头时，同一用户相同键的请求只执行一次
+    客户端因网络抖动重试时不会重复调用大模型，也不会重复写入记忆；重放的响应带有 Idempotent-Replayed 头
+    等待时间不超过 IDEMPOTENCY_WAIT_TIMEOUT 与请求剩余时间，仍未完成时返回 409
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            idempotency_key = request.headers.get(HEADER)
+            if not idempotency_key:
+                return func(self, request, *args, **kwargs)
+            if len(idempotency_key) > MAX_KEY_LENGTH:
+                return Response({'detail': f'{HEADER} 不能超过 {MAX_KEY_LENGTH} 个字符'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            remote_user = getattr(request, 'remote_user', None) or {}
+            key = f"idempotency:{scope}:{remote_user.get('id')}:{hashlib.sha256(idempotency_key.encode()).hexdigest()}"
+            fingerprint = request_fingerprint(request)
+            store = get_store()
+            outcome, record = store.begin(key, fingerprint,
+                                          deadline.timeout(getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 60)))
+            if outcome == REPLAY:
+                metrics.incr('idempotency.replayed')
+                response = Response(record['data'], status=record['status'])
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            if outcome == CONFLICT:
+                metrics.incr('idempotency.conflicts')
+                return Response({'detail': f'{HEADER} 已用于内容不同的请求'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if outcome == IN_PROGRESS:
+                response = Response({'detail': '相同的请求正在处理中，请稍后重试'}, status=status.HTTP_409_CONFLICT)
+                response['Retry-After'] = '1'
+                return response
+
+            response = None
+            try:
+                response = func(self, request, *args, **kwargs)
+            finally:
+                succeeded = response is not None and status.is_success(response.status_code)
+                try:
+                    store.finish(key, fingerprint, response if succeeded else None)
+                except Exception:
+                    logger.warning("保存幂等请求的结果失败", exc_info=True)
+            return response
+        return wrapper
+    return decorator
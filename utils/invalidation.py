@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+try:
+    from django_redis import get_redis_connection
+except ImportError:  # 未安装 django-redis 时只能使用 local / file 传输
+    get_redis_connection = None
+
+logger = logging.getLogger(__name__)
+
+# model 为 app_label.ModelName；version 为修改后的 updated_at 时间戳，删除或无法确定时为 None
+# pk 为 None 表示该模型的所有记录
+Event = namedtuple('Event', ['model', 'pk', 'version'])
+FLUSH = '*'  # 订阅者应清空全部缓存（如与 Redis 的连接中断后可能错过了消息）
+
+
+class LocalTransport:
+    """只在当前进程内分发，单进程开发环境使用"""
+
+    def publish(self, message):
+        pass
+
+    def start(self, deliver):
+        pass
+
+
+class FileTransport:
+    """
+    追加写入一个共享文件，各进程的后台线程从文件末尾开始读取新的行
+    适用于同一台机器上的多个工作进程，不需要 Redis
+    文件超过 max_bytes 时由写入的进程轮转为 <path>.1，读取端发现文件变化后清空全部缓存
+    """
+
+    def __init__(self, path, poll_interval=0.5, max_bytes=10 * 1024 * 1024):
+        self.path = str(path)
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        self.identity = None  # (inode, 第一行)，轮转后删除的旧文件的 inode 可能被新文件复用，需要同时比较第一行
+        self.offset = 0
+        self.pending = b''
+
+    def publish(self, message):
+        # ts 使每一行各不相同，读取端才能以第一行区分轮转前后的文件
+        line = (json.dumps({**message, 'ts': time.time()}, ensure_ascii=False) + '\n').encode('utf-8')
+        # 以追加模式写入单行，多个进程同时写入时各行不会交错
+        with open(self.path, 'ab') as f:
+            f.write(line)
+            size = f.tell()
+        if self.max_bytes and size > self.max_bytes:
+            try:
+                os.replace(self.path, f'{self.path}.1')
+            except OSError:
+                logger.warning("轮转缓存失效文件失败", exc_info=True)
+
+    def start(self, deliver):
+        self.reset()
+        threading.Thread(target=self.run, args=(deliver,), name='invalidation-file', daemon=True).start()
+
+    def reset(self):
+        """从文件当前的末尾开始读取"""
+        self.identity, self.offset, self.pending = None, 0, b''
+        try:
+            with open(self.path, 'rb') as f:
+                self.identity, size = self.read_identity(f)
+        except OSError:
+            return
+        self.offset = size
+
+    def read_identity(self, f):
+        """返回 ((inode, 第一行), 文件大小)，第一行还没有写完整时按空处理"""
+        stat = os.fstat(f.fileno())
+        f.seek(0)
+        head = f.readline(1024)
+        return (stat.st_ino, head if head.endswith(b'\n') else b''), stat.st_size
+
+    def run(self, deliver):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll(deliver)
+            except Exception:
+                # IO 错误等不终止线程，否则该进程再也不会失效缓存；下一轮重试
+                logger.exception("读取缓存失效文件失败")
+
+    def poll(self, deliver):
+        """读取并分发上次读取之后写入的完整行"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return  # 轮转后还没有新的写入
+        with f:
+            identity, size = self.read_identity(f)
+            # 之前没有文件，或者文件为空时第一行从无到有，都不是轮转
+            unchanged = identity == self.identity or self.identity in (None, (identity[0], b''))
+            if not unchanged or size < self.offset:
+                # 文件被轮转或截断，期间的消息无法确定，清空全部缓存
+                self.offset, self.pending = 0, b''
+                deliver({'model': FLUSH})
+            self.identity = identity
+            if size == self.offset:
+                return
+            f.seek(self.offset)
+            self.pending += f.read()
+            self.offset = f.tell()
+        *lines, self.pending = self.pending.split(b'\n')
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                deliver(json.loads(line.decode('utf-8')))
+            except Exception:
+                # 一行无法解析或无法处理时跳过，不影响后面的消息
+                logger.exception("无法处理的缓存失效消息: %r", line[:200])
+
+
+class RedisTransport:
+    """Redis 发布/订阅，生产环境多节点使用；重新连接后清空全部缓存，弥补断线期间错过的消息"""
+
+    def __init__(self, alias, channel):
+        if get_redis_connection is None:
+            raise ImportError("INVALIDATION_TRANSPORT='redis' 需要安装 django-redis")
+        self.alias = alias
+        self.channel = channel
+
+    def publish(self, message):
+        get_redis_connection(self.alias).publish(self.channel, json.dumps(message, ensure_ascii=False))
+
+    def start(self, deliver):
+        threading.Thread(target=self.run, args=(deliver,), name='invalidation-redis', daemon=True).start()
+
+    def run(self, deliver):
+        connected_before = False
+        while True:
+            try:
+                pubsub = get_redis_connection(self.alias).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if connected_before:
+                    deliver({'model': FLUSH})
+                connected_before = True
+                for item in pubsub.listen():
+                    if item.get('type') != 'message':
+                        continue
+                    try:
+                        deliver(json.loads(item['data']))
+                    except Exception:
+                        logger.exception("无法处理的缓存失效消息: %r", item['data'][:200])
+            except Exception:
+                logger.warning("缓存失效订阅中断，稍后重新连接", exc_info=True)
+                time.sleep(1)
+
+
+class InvalidationBus:
+    """
+    进程内缓存的失效广播
+    - 模型保存/删除后（事务提交后）发布 (model, pk, version) 事件，本进程的订阅者立即收到
+    - 事件同时通过传输层发往其他进程和节点，订阅者只移除发生变化的条目
+    本进程发布的事件不会经由传输层再处理一次
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.node = uuid.uuid4().hex
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.pid = None
+
+    @property
+    def origin(self):
+        # 预加载后 fork 出的工作进程共享 node，以进程号区分
+        return f'{self.node}:{os.getpid()}'
+
+    def subscribe(self, model, callback):
+        """callback(event)；model 为 app_label.ModelName，模型为 FLUSH 的事件会发给所有订阅者"""
+        with self.lock:
+            self.subscribers.setdefault(model, []).append(callback)
+
+    def publish(self, model, pk, version=None):
+        event = Event(model, pk, version)
+        self.dispatch(event)
+        try:
+            self.transport.publish({'model': model, 'pk': pk, 'version': version, 'origin': self.origin})
+        except Exception:
+            logger.warning("发布缓存失效事件失败: %s", event, exc_info=True)
+
+    def deliver(self, message):
+        if message.get('origin') == self.origin:
+            return
+        self.dispatch(Event(message['model'], message.get('pk'), message.get('version')))
+
+    def dispatch(self, event):
+        with self.lock:
+            if event.model == FLUSH:
+                callbacks = [callback for callbacks in self.subscribers.values() for callback in callbacks]
+            else:
+                callbacks = list(self.subscribers.get(event.model, ()))
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logger.warning("处理缓存失效事件失败: %s", event, exc_info=True)
+
+    def ensure_started(self):
+        """启动传输层的接收线程；按进程号判断，fork 出的工作进程需要重新启动"""
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        self.transport.start(self.deliver)
+
+
+def build_transport():
+    name = getattr(settings, 'INVALIDATION_TRANSPORT', 'local')
+    if name == 'local':
+        return LocalTransport()
+    if name == 'file':
+        return FileTransport(getattr(settings, 'INVALIDATION_FILE', os.path.join(settings.BASE_DIR, 'invalidation.log')),
+                             max_bytes=getattr(settings, 'INVALIDATION_FILE_MAX_BYTES', 10 * 1024 * 1024))
+    if name == 'redis':
+        return RedisTransport(getattr(settings, 'INVALIDATION_REDIS_ALIAS', 'default'),
+                              getattr(settings, 'INVALIDATION_CHANNEL', 'agent:invalidation'))
+    raise ValueError(f"未知的 INVALIDATION_TRANSPORT: {name}")
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = InvalidationBus(build_transport())
+    return _bus
+
+
+def model_label(model):
+    return model._meta.label
+
+
+def instance_version(instance):
+    updated_at = getattr(instance, 'updated_at', None)
+    return updated_at.timestamp() if updated_at is not None else None
+
+
+def publish_on_commit(model, pk, version=None):
+    """在当前事务提交后发布，避免其他进程在提交前重新加载到旧数据"""
+    label = model_label(model)
+    transaction.on_commit(lambda: get_bus().publish(label, pk, version))
+
+
+def track(model):
+    """模型保存、删除以及多对多关系变化时发布失效事件，在 AppConfig.ready 中调用"""
+    label = model_label(model)
+
+    def saved(sender, instance, **kwargs):
+        publish_on_commit(model, instance.pk, instance_version(instance))
+
+    def deleted(sender, instance, **kwargs):
+        publish_on_commit(model, instance.pk)
+
+    post_save.connect(saved, sender=model, weak=False, dispatch_uid=f'invalidation_saved:{label}')
+    post_delete.connect(deleted, sender=model, weak=False, dispatch_uid=f'invalidation_deleted:{label}')
+
+    for field in model._meta.many_to_many:
+        def relation_changed(sender, instance, action, reverse, pk_set, **kwargs):
+            if not action.startswith('post_'):
+                return
+            if not reverse:
+                publish_on_commit(model, instance.pk)
+            else:
+                # 从关联模型一侧修改，pk_set 为本模型的主键（clear 时为 None，无法确定，清空本模型的缓存）
+                for pk in (pk_set if pk_set is not None else [None]):
+                    publish_on_commit(model, pk)
+
+        m2m_changed.connect(relation_changed, sender=field.remote_field.through, weak=False,
+                            dispatch_uid=f'invalidation_m2m:{label}.{field.name}')
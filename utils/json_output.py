@@ -0,0 +1,178 @@
+import json
+import re
+
+try:
+    import jsonschema
+except ImportError:  # 未安装 jsonschema 时只解析不校验
+    jsonschema = None
+
+CLOSERS = {'{': '}', '[': ']'}
+# 截断处可能残留的不完整片段：末尾的逗号、冒号、只有键没有值（含或不含冒号）、true/false/null 等
+INCOMPLETE_TAIL = re.compile(r'(?:,|:|"(?:[^"\\]|\\.)*"\s*:?|[-+\w.]+)\s*$')
+# 截断在数字或字面量中间时无法知道完整的值（"3" 可能是 "35"），直接去掉
+TRUNCATED_SCALAR = re.compile(r'[-+\w.]+$')
+TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+# 整段输出为一个代码块
+FENCED = re.compile(r'^\s*```[\w-]*[ \t]*\n(.*?)\n?[ \t]*```\s*$', re.S)
+
+
+class IncrementalJSONParser:
+    """
+    从模型输出中增量提取 JSON，可逐块 feed 流式输出
+    - 跳过第一个 { 或 [ 之前的内容（如 ```json 代码块标记、说明文字）
+    - 顶层值闭合后忽略后面的内容（结束的 ``` 或补充说明）
+    - 输出被截断时，value() 补全未闭合的字符串和括号，并去掉末尾不完整的键值，返回已经生成的部分
+    扫描状态随 feed 保存，每个字符只扫描一次
+    """
+
+    def __init__(self, start_chars='{['):
+        self.start_chars = start_chars
+        self.buffer = []
+        self.start = None
+        self.end = None
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.length = 0
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def feed(self, chunk):
+        if self.complete:
+            return self
+        offset = self.length
+        self.buffer.append(chunk)
+        self.length += len(chunk)
+        for index, char in enumerate(chunk, offset):
+            if self.start is None:
+                if char in self.start_chars:
+                    self.start = index
+                    self.stack.append(CLOSERS[char])
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in CLOSERS:
+                self.stack.append(CLOSERS[char])
+            elif self.stack and char == self.stack[-1]:
+                self.stack.pop()
+                if not self.stack:
+                    self.end = index + 1
+                    break
+        return self
+
+    def text(self):
+        if self.start is None:
+            return ''
+        return ''.join(self.buffer)[self.start:self.end]
+
+    def value(self):
+        """
+        返回 (值, 是否经过修复)，没有找到 JSON 时值为 None
+        已闭合的值解析失败时（如末尾多余的逗号）也会尝试修复
+        """
+        text = self.text()
+        if not text:
+            return None, False
+        if self.complete:
+            try:
+                return json.loads(text), False
+            except ValueError:
+                pass
+        return self._repair(text)
+
+    def _repair(self, text):
+        if not self.complete:
+            if self.in_string:
+                if self.escape:
+                    text = text[:-1]
+                text += '"'
+            else:
+                text = TRUNCATED_SCALAR.sub('', text)
+        for _ in range(8):
+            candidate = TRAILING_COMMA.sub(r'\1', text)
+            try:
+                return json.loads(candidate + ''.join(reversed(self._open_containers(candidate)))), True
+            except ValueError:
+                pass
+            trimmed = INCOMPLETE_TAIL.sub('', text)
+            if trimmed == text:
+                break
+            text = trimmed
+        return None, False
+
+    @staticmethod
+    def _open_containers(text):
+        stack, in_string, escape = [], False, False
+        for char in text:
+            if in_string:
+                if escape:
+                    escape = False
+                elif char == '\\':
+                    escape = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in CLOSERS:
+                stack.append(CLOSERS[char])
+            elif stack and char == stack[-1]:
+                stack.pop()
+        return stack
+
+
+def schema_errors(value, schema):
+    """按 JSON Schema 校验，返回错误信息列表；未安装 jsonschema 时不校验"""
+    if not schema or jsonschema is None:
+        return []
+    validator = jsonschema.Draft202012Validator(schema)
+    return [
+        f"{'/'.join(map(str, error.absolute_path)) or '$'}: {error.message}"
+        for error in sorted(validator.iter_errors(value), key=lambda error: [str(part) for part in error.absolute_path])
+    ]
+
+
+def check_schema(schema):
+    """校验 JSON Schema 本身是否合法，不合法时抛出 ValueError"""
+    if jsonschema is None:
+        return
+    try:
+        jsonschema.Draft202012Validator.check_schema(schema)
+    except jsonschema.SchemaError as e:
+        raise ValueError(e.message)
+
+
+def parse_json_document(text):
+    """
+    整段输出是一个 JSON 文档（可以包在 ``` 代码块中）时返回解析结果，否则返回 None
+    不从自由文本中提取片段，也不修复被截断的内容
+    """
+    match = FENCED.match(text or '')
+    try:
+        return json.loads(match.group(1) if match else text)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_json_output(text, schema=None):
+    """
+    解析模型的完整输出，返回 (值, 校验错误列表)，无法得到 JSON 时值为 None
+    - 设置了输出结构时容忍前后说明文字与被截断的 JSON，修复后的结果按输出结构校验；
+      schema 的顶层类型为 object/array 时只从对应的括号开始解析
+    - 没有输出结构时只接受整段为 JSON 的输出，自由文本（即使包含括号）原样返回
+    """
+    if not schema:
+        return parse_json_document(text), []
+    start_chars = {'object': '{', 'array': '['}.get(schema.get('type'), '{[')
+    value, _ = IncrementalJSONParser(start_chars).feed(text or '').value()
+    if value is None:
+        return None, []
+    return value, schema_errors(value, schema)
@@ -1,5 +1,6 @@
 from django.contrib.admin import action as admin_action
 from rest_framework import mixins, status
+from rest_framework.permissions import SAFE_METHODS
 from django.utils.translation import gettext_lazy as _
 from rest_framework.response import Response
 import logging
@@ -123,3 +124,63 @@ class ListModelMixin(ResponseMixin, mixins.ListModelMixin):
             },
             msg=_('获取成功')
         )
+
+
+class SparseFieldsMixin:
+    """
+    稀疏字段集与列投影混合类
+    - 支持 ?fields=id,name 只返回指定字段，只作用于 GET 等安全方法的输出；
+      创建、更新与批量接口的序列化器同时用于校验输入，不能裁剪字段
+    - 列表查询按序列化器实际输出的字段使用 only() 投影，跳过不需要的列（如大段的 TEXT 字段）
+    """
+    fields_query_param = 'fields'
+
+    def get_requested_fields(self):
+        """解析 ?fields= 参数，未指定或不是安全方法时返回 None"""
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        raw = request.query_params.get(self.fields_query_param)
+        if not raw:
+            return None
+        return {name.strip() for name in raw.split(',') if name.strip()}
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        requested = self.get_requested_fields()
+        if requested:
+            target = getattr(serializer, 'child', serializer)
+            for name in list(target.fields):
+                if name not in requested:
+                    target.fields.pop(name)
+        return serializer
+
+    def get_projection_fields(self, queryset):
+        """
+        根据序列化器输出的字段计算需要加载的模型列
+        如果某个字段无法对应到具体的列（例如方法字段或属性），返回 None 表示不做投影
+        """
+        model = queryset.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        columns = {model._meta.pk.name}
+        for field in self.get_serializer().fields.values():
+            source = field.source.split('.')[0]
+            if source not in concrete:
+                return None
+            columns.add(source)
+
+        # 排序字段也需要加载，否则游标分页读取位置时会逐行回查
+        for backend in self.filter_backends:
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(self.request, queryset, self) or []
+                columns.update(name.lstrip('-') for name in ordering if name.lstrip('-') in concrete)
+        return columns
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # 仅对列表做投影，避免更新操作保存到部分加载的实例
+        if getattr(self, 'action', None) == 'list':
+            columns = self.get_projection_fields(queryset)
+            if columns:
+                queryset = queryset.only(*columns)
+        return queryset
@@ -0,0 +1,148 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param
+
+from .search import is_rank_ordered
+
+
+class StandardCursorPagination(CursorPagination):
+    """
+    游标（keyset）分页，默认按主键倒序
+    翻页时使用 WHERE id < 游标位置 而不是 OFFSET，深翻页的代价不会随页数增长
+    按全文检索相关度排序的结果例外，见 paginate_ranked
+    """
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ranked_offset_cutoff = 10000  # 按相关度排序时允许的最大偏移量
+    ranked_offset = None  # 按相关度排序时当前页的偏移量
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if is_rank_ordered(request):
+            return self.paginate_ranked(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_ranked(self, queryset, request):
+        """
+        按相关度排序的搜索结果：相关度是可能重复的浮点数，作为游标位置比较时相同或舍入后相同的值会导致跳过或重复
+        结果已按 (相关度, id) 排序（见 FullTextSearchFilter），以偏移量翻页，游标中只保存偏移量
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.offset_cutoff = self.ranked_offset_cutoff
+        self.cursor = self.decode_cursor(request)
+        self.ranked_offset = self.cursor.offset if self.cursor is not None else 0
+        results = list(queryset[self.ranked_offset:self.ranked_offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        self.has_previous = self.ranked_offset > 0
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if self.ranked_offset is None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=self.ranked_offset + self.page_size, reverse=False, position=None))
+
+    def get_previous_link(self):
+        if self.ranked_offset is None:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        offset = max(0, self.ranked_offset - self.page_size)
+        if offset == 0:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(offset=offset, reverse=False, position=None))
+
+    def paginate_keyset(self, fetch, request, view=None):
+        """
+        不经过 QuerySet 的游标分页，数据来源按主键倒序排列
+        fetch(position, reverse, limit) 返回紧跟在 position 之后的至多 limit 个对象：
+        reverse 为 False 时按 id 倒序返回 id < position 的对象，为 True 时按 id 正序返回 id > position 的对象，
+        position 为 None 表示从头开始
+        游标格式与 paginate_queryset 相同，两种分页方式生成的链接可以互相使用
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = ('-id',)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        position = None
+        if current_position is not None:
+            try:
+                position = int(current_position)
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        if reverse and position is None:
+            results = []
+        else:
+            results = list(fetch(position, reverse, offset + self.page_size + 1))[offset:]
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        """与 api_response 保持一致的响应格式"""
+        return Response({
+            'code': 200,
+            'msg': 'success',
+            'data': {
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            }
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'code': {'type': 'integer', 'example': 200},
+                'msg': {'type': 'string', 'example': 'success'},
+                'data': super().get_paginated_response_schema(schema),
+            },
+        }
@@ -0,0 +1,73 @@
+import math
+
+from rest_framework.utils import encoders
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # 已列入 requirements/base.txt，未安装时退回 DRF 默认实现
+    orjson = None
+
+
+_encoder = encoders.JSONEncoder()
+
+
+def _default(obj):
+    """orjson 不支持的类型（懒翻译字符串、Decimal、QuerySet 等）交给 DRF 的编码器处理"""
+    return _encoder.default(obj)
+
+
+def _has_non_finite(data):
+    """数据中是否有 NaN / Infinity（orjson 会把它们输出为 null）"""
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_non_finite(item) for item in data)
+    return False
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    使用 orjson 渲染 JSON，输出与 DRF 的 JSONRenderer 保持一致
+    - datetime 等类型仍交给 DRF 编码器，时间格式不变
+    - 请求了缩进（如 BrowsableAPIRenderer）、UNICODE_JSON / COMPACT_JSON 不是默认值或未安装 orjson 时退回 DRF 默认实现
+    - orjson 无法编码的数据（如超过 64 位的整数）以及包含 NaN / Infinity 的数据也交给 DRF，
+      STRICT_JSON 时同样抛出 ValueError
+    """
+    options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        try:
+            ret = orjson.dumps(data, default=_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # 只有输出中有 null 时才可能来自 NaN / Infinity
+        if b'null' in ret and _has_non_finite(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        # 与 DRF 一致，转义 \u2028 和 \u2029 保证输出是合法的 JavaScript 子集
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class ORJSONParser(JSONParser):
+    """使用 orjson 解析请求体，未安装 orjson 时退回 DRF 默认实现"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,119 @@
+import time
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    基于数据库全文索引的搜索过滤器，索引由 assistant/migrations/0003_fulltext_search.py 创建
+    - SQLite: FTS5 虚拟表 <表名>_fts（trigram 分词），由触发器与主表保持同步
+    - PostgreSQL: 各搜索字段上 pg_trgm 的 GIN 三元组索引（见 0010_trigram_search.py），ILIKE 子串匹配走索引
+    两种数据库都是子串匹配（与 SearchFilter 的 icontains 一致），中文不需要分词
+    命中结果带 search_rank 相关度并默认按 (相关度, id) 排序，StandardCursorPagination 对其按偏移量翻页；
+    客户端显式传入 ordering 时以其为准
+    其他数据库、索引不存在或 SQLite 上搜索词过短（trigram 至少 3 个字符）时回退到 SearchFilter 的 LIKE 查询
+    索引是否存在的检查结果缓存 index_cache_ttl 秒，迁移后（post_migrate）清空
+    """
+    rank_field = 'search_rank'
+    min_term_length = 3
+    index_cache_ttl = 300
+    _index_cache = {}
+
+    @classmethod
+    def clear_index_cache(cls, **kwargs):
+        cls._index_cache.clear()
+
+    def get_index_table(self, queryset):
+        """返回可用的全文索引表名（SQLite）或已建三元组索引的列名集合（PostgreSQL），不可用时返回 None"""
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        cache_key = (queryset.db, table)
+        cached = self._index_cache.get(cache_key)
+        if cached is None or time.monotonic() - cached[1] > self.index_cache_ttl:
+            index = None
+            if connection.vendor == 'sqlite':
+                if f'{table}_fts' in connection.introspection.table_names():
+                    index = f'{table}_fts'
+            elif connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    constraints = connection.introspection.get_constraints(cursor, table)
+                index = frozenset(
+                    constraint['columns'][0] for name, constraint in constraints.items()
+                    if name.endswith('_trgm') and constraint['columns']
+                ) or None
+            cached = self._index_cache[cache_key] = (index, time.monotonic())
+        return cached[0]
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        index = self.get_index_table(queryset)
+        vendor = connections[queryset.db].vendor
+        if index and vendor == 'sqlite' and all(len(term) >= self.min_term_length for term in search_terms):
+            queryset = self.filter_sqlite(queryset, index, search_terms)
+        elif index and vendor == 'postgresql' and set(self.get_search_fields(view, request) or ()) <= index:
+            queryset = self.filter_postgresql(queryset, self.get_search_fields(view, request), search_terms)
+        else:
+            return super().filter_queryset(request, queryset, view)
+
+        request._fulltext_ranked = True
+        if is_rank_ordered(request):
+            # 相关度会重复，以主键作为次要排序保证顺序确定
+            queryset = queryset.order_by('-' + self.rank_field, '-pk')
+        return queryset
+
+    def filter_sqlite(self, queryset, fts_table, search_terms):
+        # 每个词作为短语匹配，多个词之间为 AND
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in search_terms)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH %s', [match])
+        ).annotate(**{
+            # bm25 越小越相关，取负值使 search_rank 越大越相关
+            self.rank_field: RawSQL(
+                f'SELECT -bm25({fts_table}) FROM {fts_table} '
+                f'WHERE {fts_table} MATCH %s AND {fts_table}.rowid = "{table}"."id"',
+                [match],
+                output_field=FloatField(),
+            )
+        })
+
+    def filter_postgresql(self, queryset, search_fields, search_terms):
+        # 每个词在任一字段中作为子串出现（ILIKE，走三元组索引），多个词之间为 AND
+        table = queryset.model._meta.db_table
+        columns = [f'"{table}"."{field}"' for field in search_fields]
+        for term in search_terms:
+            pattern = '%{}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+            queryset = queryset.filter(RawSQL(
+                '(' + ' OR '.join(f'{column} ILIKE %s' for column in columns) + ')',
+                [pattern] * len(columns), output_field=BooleanField(),
+            ))
+        # 相关度：搜索词与各字段中最相近片段的三元组相似度，取最大值
+        query = ' '.join(search_terms)
+        return queryset.annotate(**{
+            self.rank_field: RawSQL(
+                'GREATEST(' + ', '.join(f"word_similarity(%s, coalesce({column}, ''))" for column in columns) + ')',
+                [query] * len(columns), output_field=FloatField(),
+            )
+        })
+
+    def get_ordering(self, request, queryset, view):
+        """
+        供游标分页使用：全文检索命中时按相关度排序，否则沿用 OrderingFilter 的排序
+        视图中该过滤器需排在 OrderingFilter 之前
+        （StandardCursorPagination 对按相关度排序的结果使用偏移量翻页，不以相关度作为游标位置）
+        """
+        if is_rank_ordered(request):
+            return ('-' + self.rank_field, '-id')
+        return filters.OrderingFilter().get_ordering(request, queryset, view)
+
+
+def is_rank_ordered(request):
+    """本次请求的结果是否按全文检索的相关度排序（命中全文索引且客户端没有指定 ordering）"""
+    return getattr(request, '_fulltext_ranked', False) and api_settings.ORDERING_PARAM not in request.query_params
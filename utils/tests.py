@@ -0,0 +1,357 @@
+import io
+import os
+import tempfile
+import threading
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from . import idempotency, renderers, throttling
+from .idempotency import IdempotencyStore, idempotent
+from .invalidation import FLUSH, Event, FileTransport, InvalidationBus, LocalTransport
+from .json_output import parse_json_output
+from .renderers import ORJSONParser, ORJSONRenderer
+from .throttling import AssistantRateThrottle, LocalWindowStore, RateLimitHeadersMixin, UserRateThrottle
+
+
+class ParseJsonOutputTest(SimpleTestCase):
+    """没有输出结构时自由文本原样返回，只有整段为 JSON 的输出才被解析"""
+
+    def test_free_text_with_brackets_is_not_parsed(self):
+        for text in [
+            "建议如下：\n[1] 多喝水\n[2] 早睡",
+            "今天心情不错[2]",
+            'Sure! Here is a list: ["a","b"] hope it helps',
+            "记账格式为 {\"amount\": 3}，请按此填写",
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(parse_json_output(text), (None, []))
+
+    def test_truncated_json_without_schema_is_not_repaired(self):
+        self.assertEqual(parse_json_output('{"transactions": [{"type": "expense", "amount": 3'), (None, []))
+
+    def test_whole_document(self):
+        self.assertEqual(parse_json_output(' {"a": [1, 2]}\n'), ({'a': [1, 2]}, []))
+        self.assertEqual(parse_json_output('```json\n{"a": 1}\n```'), ({'a': 1}, []))
+        self.assertEqual(parse_json_output('```\n[1, 2]\n```'), ([1, 2], []))
+
+    def test_schema_enables_tolerant_parsing(self):
+        schema = {
+            'type': 'object',
+            'properties': {'amount': {'type': 'number'}},
+            'required': ['amount'],
+        }
+        self.assertEqual(parse_json_output('好的：{"amount": 3} 已记录', schema), ({'amount': 3}, []))
+        # 被截断后修复的结果按输出结构校验，缺少的字段作为错误返回
+        value, errors = parse_json_output('好的：{"type": "expense", "amo', schema)
+        self.assertEqual(value, {'type': 'expense'})
+        self.assertTrue(errors)
+
+
+class ThrottledView(RateLimitHeadersMixin, APIView):
+    throttle_classes = [UserRateThrottle, AssistantRateThrottle]
+
+    def post(self, request):
+        return Response({'ok': True})
+
+
+@override_settings(THROTTLE_TIER_RATES={
+    'user': {'premium': '10/min', 'free': '5/min'},
+    'assistant': {'premium': '6/min', 'free': '3/min'},
+})
+class SlidingWindowThrottleTest(SimpleTestCase):
+    """按等级的滑动窗口限额，以及剩余次数最少的限流器输出的 X-RateLimit-* 响应头"""
+    window_start = 60 * 1000000
+
+    def setUp(self):
+        store = LocalWindowStore()
+        for name in ('_store', '_local_store'):
+            patcher = mock.patch.object(throttling, name, store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+        self.view = ThrottledView.as_view()
+
+    def call(self, at, user_id=1, is_premium=False, assistant_name='companion'):
+        request = self.factory.post('/api/agent/', {'assistant_name': assistant_name}, format='json')
+        request.remote_user = {'id': user_id, 'is_premium': is_premium}
+        with mock.patch('utils.throttling.time.time', return_value=self.window_start + at):
+            return self.view(request)
+
+    def test_limit_and_headers(self):
+        for remaining in (2, 1, 0):
+            response = self.call(10)
+            self.assertEqual(response.status_code, 200)
+            # 助手级的限额更小，响应头以它为准
+            self.assertEqual(response['X-RateLimit-Limit'], '3')
+            self.assertEqual(response['X-RateLimit-Remaining'], str(remaining))
+            self.assertEqual(response['X-RateLimit-Reset'], '50')
+
+        response = self.call(10)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['X-RateLimit-Remaining'], '0')
+        self.assertIn('Retry-After', response)
+        # 其他助手只受用户级限额约束
+        self.assertEqual(self.call(10, assistant_name='bookkeeping').status_code, 200)
+
+    def test_previous_window_slides_out(self):
+        for _ in range(4):  # 3 次通过，1 次被拒绝，被拒绝的同样计数
+            self.call(50)
+        # 下一个窗口过半时，上一个窗口按一半计入：4 × 0.5 + 1 = 3，仍在限额内
+        self.assertEqual(self.call(90).status_code, 200)
+        self.assertEqual(self.call(90).status_code, 429)
+        # 上一个窗口完全滑出后恢复
+        self.assertEqual(self.call(180).status_code, 200)
+
+    def test_premium_tier(self):
+        statuses = [self.call(10, is_premium=True).status_code for _ in range(7)]
+        self.assertEqual(statuses, [200] * 6 + [429])
+        self.assertEqual(self.call(10, is_premium=True, assistant_name='other').status_code, 200)
+
+
+class IdempotentView(APIView):
+    calls = None
+    entered = None
+    finish = None
+
+    @idempotent('test')
+    def post(self, request):
+        self.calls.append(request.data)
+        if self.entered is not None:
+            self.entered.set()
+            self.finish.wait(5)
+        if request.data.get('fail'):
+            return Response({'detail': '失败'}, status=500)
+        return Response({'count': len(self.calls)}, status=201)
+
+
+@override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.1)
+class IdempotencyTest(SimpleTestCase):
+    """相同 Idempotency-Key 的请求只执行一次：成功后重放、内容不同返回 422、执行中等待超时返回 409"""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(idempotency, '_store',
+                                    IdempotencyStore('default', ttl=60, lock_ttl=60, poll_interval=0.01))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+        self.entered, self.finish = threading.Event(), threading.Event()
+        self.view = IdempotentView.as_view(calls=self.calls)
+        self.factory = APIRequestFactory()
+
+    def call(self, data, key='key-1', user_id=1):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key is not None else {}
+        request = self.factory.post('/api/agent/', data, format='json', **headers)
+        request.remote_user = {'id': user_id, 'is_premium': False}
+        return self.view(request)
+
+    def test_replay(self):
+        first = self.call({'user_input': '你好'})
+        replayed = self.call({'user_input': '你好'})
+        self.assertEqual((first.status_code, replayed.status_code), (201, 201))
+        self.assertEqual(replayed.data, first.data)
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(len(self.calls), 1)
+        # 其他用户或没有 Idempotency-Key 的请求照常执行
+        self.assertEqual(self.call({'user_input': '你好'}, user_id=2).data, {'count': 2})
+        self.assertEqual(self.call({'user_input': '你好'}, key=None).data, {'count': 3})
+
+    def test_conflict(self):
+        self.call({'user_input': '你好'})
+        response = self.call({'user_input': '再见'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_failure_is_not_saved(self):
+        self.assertEqual(self.call({'fail': True}).status_code, 500)
+        self.assertEqual(self.call({'fail': True}).status_code, 500)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_key_too_long(self):
+        self.assertEqual(self.call({}, key='k' * 256).status_code, 400)
+        self.assertEqual(self.calls, [])
+
+    def test_in_progress(self):
+        self.view = IdempotentView.as_view(calls=self.calls, entered=self.entered, finish=self.finish)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.call({'user_input': '你好'})))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.finish.set)
+        self.assertTrue(self.entered.wait(1))
+
+        response = self.call({'user_input': '你好'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+
+        # 执行完成后相同的请求得到保存的结果
+        self.finish.set()
+        thread.join()
+        self.assertEqual(results[0].status_code, 201)
+        replayed = self.call({'user_input': '你好'})
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(self.calls), 1)
+
+
+class InvalidationBusTest(SimpleTestCase):
+    """失效事件在本进程立即分发，经由文件传输到达其他进程；异常的消息与订阅者不会中断接收"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'invalidation.log')
+
+    def bus(self, max_bytes=1024 * 1024):
+        """模拟一个进程：独立的 node，从文件当前末尾开始接收"""
+        bus = InvalidationBus(FileTransport(self.path, max_bytes=max_bytes))
+        bus.transport.reset()
+        events = []
+        bus.subscribe('app.Model', events.append)
+        return bus, events
+
+    def receive(self, bus):
+        bus.transport.poll(bus.deliver)
+
+    def test_local_dispatch(self):
+        bus = InvalidationBus(LocalTransport())
+        events, others = [], []
+        bus.subscribe('app.Model', events.append)
+        bus.subscribe('app.Other', others.append)
+        bus.publish('app.Model', 1, 2.0)
+        self.assertEqual(events, [Event('app.Model', 1, 2.0)])
+        self.assertEqual(others, [])
+        bus.dispatch(Event(FLUSH, None, None))
+        self.assertEqual((len(events), len(others)), (2, 1))
+
+    def test_file_transport_between_processes(self):
+        (sender, sent), (receiver, received) = self.bus(), self.bus()
+        sender.publish('app.Model', 1, 2.0)
+        self.assertEqual(sent, [Event('app.Model', 1, 2.0)])
+        self.receive(receiver)
+        self.assertEqual(received, [Event('app.Model', 1, 2.0)])
+        # 本进程发布的事件不会再处理一次
+        self.receive(sender)
+        self.assertEqual(len(sent), 1)
+
+    def test_bad_lines_and_subscribers_do_not_stop_delivery(self):
+        (sender, _), (receiver, received) = self.bus(), self.bus()
+        receiver.subscribe('app.Model', mock.Mock(side_effect=RuntimeError))
+        with open(self.path, 'ab') as f:
+            f.write(b'not json\n\xff\xfe\n{"pk": 1}\n')
+        sender.publish('app.Model', 2)
+        with self.assertLogs('utils.invalidation', 'ERROR'):
+            self.receive(receiver)
+        self.assertEqual(received, [Event('app.Model', 2, None)])
+
+    def test_partial_line_waits_for_the_rest(self):
+        receiver, received = self.bus()
+        with open(self.path, 'ab') as f:
+            f.write(b'{"model": "app.Model", ')
+        self.receive(receiver)
+        with open(self.path, 'ab') as f:
+            f.write(b'"pk": 3}\n')
+        self.receive(receiver)
+        self.assertEqual(received, [Event('app.Model', 3, None)])
+
+    def test_rotation_flushes(self):
+        sender, _ = self.bus(max_bytes=200)
+        sender.publish('app.Model', 0)
+        receiver, received = self.bus()
+        for pk in range(1, 5):
+            sender.publish('app.Model', pk)
+        self.assertTrue(os.path.exists(f'{self.path}.1'))
+        self.receive(receiver)
+        self.assertIn(Event(FLUSH, None, None), received)
+        # 轮转之后的消息照常接收
+        received.clear()
+        sender.transport.max_bytes = None
+        sender.publish('app.Model', 9)
+        self.receive(receiver)
+        self.assertEqual(received[-1], Event('app.Model', 9, None))
+
+    def test_run_survives_io_errors(self):
+        transport = FileTransport(self.path, poll_interval=0)
+        calls = []
+
+        def poll(deliver):
+            calls.append(deliver)
+            if len(calls) == 1:
+                raise OSError('disk error')
+            raise SystemExit  # 结束测试中的循环
+
+        transport.poll = poll
+        with self.assertLogs('utils.invalidation', 'ERROR'), self.assertRaises(SystemExit):
+            transport.run(None)
+        self.assertEqual(len(calls), 2)
+
+
+class ORJSONRendererTest(SimpleTestCase):
+    """orjson 的输出与 DRF 的 JSONRenderer 逐字节一致，未安装 orjson 时的默认实现结果相同"""
+    data = {
+        'text': '你好 ☕ \u2028 "quoted"',
+        'decimal': Decimal('12.50'),
+        'datetime': datetime(2024, 5, 1, 8, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        'naive': datetime(2024, 5, 1, 8, 30),
+        'date': date(2024, 5, 1),
+        'duration': timedelta(minutes=5),
+        'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'lazy': gettext_lazy('助手'),
+        'nested': [{'a': None, 'b': True, 'c': 1.5}, (1, 2)],
+        1: 'int key',
+    }
+
+    def test_matches_drf(self):
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(ORJSONRenderer().render(self.data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(ORJSONRenderer().render(self.data), expected)
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        # orjson 无法编码的数据交给 DRF
+        self.assertEqual(ORJSONRenderer().render({'big': 2 ** 70}), JSONRenderer().render({'big': 2 ** 70}))
+
+    def test_non_finite_floats(self):
+        for value in (float('nan'), float('inf'), -float('inf')):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    JSONRenderer().render({'value': [value]})
+                with self.assertRaises(ValueError):
+                    ORJSONRenderer().render({'value': [value]})
+        self.assertEqual(ORJSONRenderer().render({'value': None}), b'{"value":null}')
+
+    def test_indent_uses_drf(self):
+        self.assertEqual(ORJSONRenderer().render({'a': 1}, 'application/json; indent=2'),
+                         JSONRenderer().render({'a': 1}, 'application/json; indent=2'))
+
+
+class ORJSONParserTest(SimpleTestCase):
+    """解析结果与错误处理与 DRF 的 JSONParser 一致"""
+
+    def parse(self, parser, body):
+        return parser.parse(io.BytesIO(body.encode('utf-8')), 'application/json', {})
+
+    def test_parse(self):
+        body = '{"text": "你好", "n": 1.5, "list": [1, null, true]}'
+        self.assertEqual(self.parse(ORJSONParser(), body), self.parse(JSONParser(), body))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(self.parse(ORJSONParser(), body), self.parse(JSONParser(), body))
+
+    def test_invalid(self):
+        for body in ('{"a": ', '{"a": NaN}', '{"a": Infinity}'):
+            with self.subTest(body=body):
+                with self.assertRaises(ParseError):
+                    self.parse(JSONParser(), body)
+                with self.assertRaises(ParseError):
+                    self.parse(ORJSONParser(), body)
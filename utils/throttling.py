@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.throttling import BaseThrottle
+
+try:
+    from django_redis import get_redis_connection
+    from django_redis.cache import RedisCache
+except ImportError:  # 未安装 django-redis 时只使用进程内计数
+    get_redis_connection = None
+    RedisCache = None
+
+logger = logging.getLogger(__name__)
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """与 DRF 相同的格式：'60/min'、'1000/day'，返回 (次数, 窗口秒数)"""
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period[0]]
+
+
+class LocalWindowStore:
+    """进程内的窗口计数，共享缓存不可用时使用"""
+    max_keys = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def hit(self, key, window_index, window):
+        with self.lock:
+            current_key = (key, window, window_index)
+            current = self.counts[current_key] = self.counts.get(current_key, 0) + 1
+            previous = self.counts.get((key, window, window_index - 1), 0)
+            if len(self.counts) > self.max_keys:
+                self.prune()
+        return current, previous
+
+    def prune(self):
+        """删除已经不在滑动窗口内的计数"""
+        now = time.time()
+        expired = [k for k in self.counts if k[2] < now // k[1] - 1]
+        for stored_key in expired:
+            del self.counts[stored_key]
+
+
+class RedisWindowStore:
+    """
+    基于 Redis 的窗口计数
+    当前窗口 INCR + EXPIRE 与读取上一个窗口在同一个 pipeline 中完成，每次检查只有一次往返
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def hit(self, key, window_index, window):
+        client = get_redis_connection(self.alias)
+        current_key = f'{key}:{window_index}'
+        pipe = client.pipeline(transaction=True)
+        pipe.incr(current_key)
+        pipe.expire(current_key, window * 2)
+        pipe.get(f'{key}:{window_index - 1}')
+        current, _, previous = pipe.execute()
+        return int(current), int(previous or 0)
+
+
+_local_store = LocalWindowStore()
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """配置的缓存是 django-redis 时使用 Redis，否则使用进程内计数"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                alias = getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')
+                if RedisCache is not None and isinstance(caches[alias], RedisCache):
+                    _store = RedisWindowStore(alias)
+                else:
+                    _store = _local_store
+    return _store
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    滑动窗口限流（滑动窗口计数法）
+    估算值 = 上一个窗口的计数 × 上一个窗口仍在滑动窗口内的比例 + 当前窗口的计数
+    - 按 remote_user['is_premium'] 从 THROTTLE_TIER_RATES[scope] 读取不同等级的限额
+    - 被拒绝的请求同样计数，持续超限的客户端不会在窗口滑过后立即恢复
+    - 共享缓存出错时退回进程内计数，不影响请求
+    子类需定义 scope 并实现 get_ident_key
+    """
+    scope = None
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def get_rate(self, request):
+        rates = getattr(settings, 'THROTTLE_TIER_RATES', {}).get(self.scope)
+        if rates is None:
+            raise ImproperlyConfigured(f"THROTTLE_TIER_RATES 中没有配置 '{self.scope}'")
+        remote_user = getattr(request, 'remote_user', None) or {}
+        rate = rates['premium'] if remote_user.get('is_premium', False) else rates['free']
+        return parse_rate(rate) if rate else None
+
+    def get_ident_key(self, request, view):
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def allow_request(self, request, view):
+        rate = self.get_rate(request)
+        ident = self.get_ident_key(request, view)
+        if rate is None or ident is None:
+            return True
+        self.limit, self.window = rate
+        key = self.cache_format % {'scope': self.scope, 'ident': ident}
+
+        now = time.time()
+        window_index = int(now // self.window)
+        self.elapsed = now - window_index * self.window
+        try:
+            self.current, self.previous = get_store().hit(key, window_index, self.window)
+        except Exception:
+            logger.warning("限流计数使用共享缓存失败，退回进程内计数", exc_info=True)
+            self.current, self.previous = _local_store.hit(key, window_index, self.window)
+
+        estimate = self.previous * (1 - self.elapsed / self.window) + self.current
+        self.remaining = max(0, int(self.limit - estimate))
+        self.record(request)
+        return estimate <= self.limit
+
+    def record(self, request):
+        """记录剩余次数最少的一个限流器，用于输出 X-RateLimit-* 响应头"""
+        reset = max(1, int(self.window - self.elapsed + 0.999))
+        state = (self.remaining, self.limit, reset)
+        current = getattr(request, '_rate_limit', None)
+        # 剩余次数相同时取限额更小的一个
+        if current is None or state[:2] < current[:2]:
+            request._rate_limit = state
+
+    def wait(self):
+        if self.current > self.limit or self.previous == 0:
+            # 只有等当前窗口结束
+            return self.window - self.elapsed
+        # 上一个窗口的权重随时间线性下降，计算估算值回到限额以内的时间点
+        needed = self.window * (1 - (self.limit - self.current) / self.previous)
+        return max(0.0, needed - self.elapsed)
+
+
+class UserRateThrottle(SlidingWindowThrottle):
+    """按用户限流"""
+    scope = 'user'
+
+    def get_ident_key(self, request, view):
+        remote_user = getattr(request, 'remote_user', None) or {}
+        user_id = remote_user.get('id')
+        return f'user:{user_id}' if user_id is not None else None
+
+
+class AssistantRateThrottle(SlidingWindowThrottle):
+    """按 用户 + 助手 限流，助手名称取自请求体的 assistant_name，缺省时使用视图的 default_assistant_name"""
+    scope = 'assistant'
+
+    def get_ident_key(self, request, view):
+        remote_user = getattr(request, 'remote_user', None) or {}
+        user_id = remote_user.get('id')
+        if user_id is None:
+            return None
+        data = request.data if isinstance(request.data, dict) else {}
+        assistant_name = data.get('assistant_name') or getattr(view, 'default_assistant_name', None)
+        if not assistant_name:
+            return None
+        return f'user:{user_id}:assistant:{assistant_name}'
+
+
+class RateLimitHeadersMixin:
+    """在响应中输出限流状态：X-RateLimit-Limit / X-RateLimit-Remaining / X-RateLimit-Reset（秒）"""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        state = getattr(request, '_rate_limit', None)
+        if state is not None:
+            remaining, limit, reset = state
+            response['X-RateLimit-Limit'] = str(limit)
+            response['X-RateLimit-Remaining'] = str(remaining)
+            response['X-RateLimit-Reset'] = str(reset)
+        return response